@@ -0,0 +1,151 @@
+import sys
+import argparse
+
+import numpy as np
+
+# lines generated and written at a time
+BLOCK_LINES = 2 ** 18
+START_TS = 1565647200
+
+# the ways a line can be malformed, all of which the parsers reject
+MALFORMED = [
+    lambda ts, frm, to: b"%d %b" % (ts, frm),
+    lambda ts, frm, to: b"%d %b %b extra" % (ts, frm, to),
+    lambda ts, frm, to: b"notatime %b %b" % (frm, to),
+    lambda ts, frm, to: b"%d -%b %b" % (ts, frm, to),
+    lambda ts, frm, to: b"",
+]
+
+
+def host_names(n):
+    """ n distinct valid host names, h0 to h<n-1> in base 36 """
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    names = []
+    for i in range(n):
+        name = ""
+        while True:
+            i, d = divmod(i, 36)
+            name = digits[d] + name
+            if not i:
+                break
+        names.append(("h" + name).encode())
+    return names
+
+
+class Workload:
+    """
+    A deterministic synthetic connection log, the same for the same
+    parameters and seed however it's read.
+
+    lines:        how many lines in all
+    hosts:        distinct hosts
+    zipf:         exponent of the Zipf law hosts are picked with, the
+                  host of rank r being picked in proportion to 1 / r^zipf
+    rate:         lines per second, which sets the time the log spans
+    late:         fraction of lines that are late
+    max_late:     late lines are up to this many seconds late
+    malformed:    fraction of lines that are malformed
+    ms:           timestamps in milliseconds rather than seconds
+    """
+
+    def __init__(self, lines=10 ** 6, hosts=10 ** 5, zipf=1.1, rate=100.0,
+                 late=0.01, max_late=120.0, malformed=0.001, ms=True, seed=0,
+                 start_ts=START_TS):
+        self.lines = lines
+        self.hosts = hosts
+        self.zipf = zipf
+        self.rate = rate
+        self.late = late
+        self.max_late = max_late
+        self.malformed = malformed
+        self.ms = ms
+        self.seed = seed
+        self.start_ts = start_ts
+        self.names = host_names(hosts)
+        weights = 1.0 / np.arange(1, hosts + 1) ** zipf
+        self.cdf = np.cumsum(weights) / weights.sum()
+        # popular hosts are spread over the names rather than the first ones
+        self.ranked = np.random.Generator(np.random.PCG64(seed)).permutation(hosts)
+
+    def params(self):
+        return {'lines': self.lines, 'hosts': self.hosts, 'zipf': self.zipf,
+                'rate': self.rate, 'late': self.late, 'max_late': self.max_late,
+                'malformed': self.malformed, 'ms': self.ms, 'seed': self.seed}
+
+    def end_ts(self):
+        return self.start_ts + self.lines / self.rate
+
+    def _pick(self, rng, n):
+        ranks = np.searchsorted(self.cdf, rng.random(n), side='right')
+        return self.ranked[np.minimum(ranks, self.hosts - 1)]
+
+    def block(self, i):
+        """ the lines of block i, as bytes """
+        first = i * BLOCK_LINES
+        n = min(BLOCK_LINES, self.lines - first)
+        # every block has its own stream, so blocks can be made in any order
+        rng = np.random.Generator(np.random.PCG64([self.seed, i]))
+
+        ts = self.start_ts + (first + np.arange(n)) / self.rate
+        late = rng.random(n) < self.late
+        ts[late] -= rng.random(int(late.sum())) * self.max_late
+        ts = np.round(ts * 1000).astype(np.int64)
+        if not self.ms:
+            ts //= 1000
+        frm, to = self._pick(rng, n), self._pick(rng, n)
+        bad = np.flatnonzero(rng.random(n) < self.malformed)
+        kinds = rng.integers(len(MALFORMED), size=len(bad))
+
+        names = self.names
+        rows = list(zip(ts.tolist(), [names[h] for h in frm.tolist()],
+                        [names[h] for h in to.tolist()]))
+        lines = [b"%d %b %b" % row for row in rows]
+        for line, kind in zip(bad.tolist(), kinds.tolist()):
+            lines[line] = MALFORMED[kind](*rows[line])
+        return b"\n".join(lines) + b"\n"
+
+    def blocks(self):
+        return (self.block(i) for i in range((self.lines + BLOCK_LINES - 1) // BLOCK_LINES))
+
+    def write(self, f):
+        for block in self.blocks():
+            f.write(block)
+
+
+def add_arguments(args_parser):
+    args_parser.add_argument('--lines', type=int, default=10 ** 6,
+            help='lines to generate, up to 10^9 and beyond')
+    args_parser.add_argument('--hosts', type=int, default=10 ** 5,
+            help='distinct hosts')
+    args_parser.add_argument('--zipf', type=float, default=1.1,
+            help='skew of host popularity, 0 for uniform')
+    args_parser.add_argument('--rate', type=float, default=100.0,
+            help='lines per second of log time')
+    args_parser.add_argument('--late', type=float, default=0.01,
+            help='fraction of lines out of order')
+    args_parser.add_argument('--max_late', type=float, default=120.0,
+            help='how many seconds late a late line can be')
+    args_parser.add_argument('--malformed', type=float, default=0.001,
+            help='fraction of malformed lines')
+    args_parser.add_argument('--seconds', action='store_true', default=False,
+            help='timestamps in seconds rather than milliseconds')
+    args_parser.add_argument('--seed', type=int, default=0)
+
+
+def workload(args):
+    if args.lines < 0 or args.hosts < 1:
+        raise Exception("lines can't be negative and there must be at least a host")
+    return Workload(args.lines, args.hosts, args.zipf, args.rate, args.late,
+                    args.max_late, args.malformed, not args.seconds, args.seed)
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=""
+            "generate a synthetic connection log on STDOUT, the same every "
+            "time for the same parameters")
+    add_arguments(args_parser)
+    workload(args_parser.parse_args(sys.argv[1:])).write(sys.stdout.buffer)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.generate import Workload, add_arguments, workload
+
+BENCHMARKS = {}
+SEEKS = 200     # seek_just_before_index calls timed
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def io_counters():
+    """ bytes read (rchar), page faults and the like, so far in this process """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    counters = {'minor_faults': usage.ru_minflt, 'major_faults': usage.ru_majflt}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key in ('rchar', 'syscr', 'read_bytes'):
+                    counters[key] = int(value)
+    except OSError:
+        pass        # not linux
+    return counters
+
+
+@benchmark('Parser.parse')
+def bench_parser(path, wl):
+    from connspy.parser import Parser
+    parser = Parser()
+    lines = 0
+    with open(path, 'r') as f:
+        for line in f:
+            parser.parse(line)
+            lines += 1
+    return lines
+
+
+@benchmark('BatchParser.parse')
+def bench_batch_parser(path, wl):
+    from connspy.parser import BatchParser, read_chunks
+    parser = BatchParser()
+    lines = 0
+    with open(path, 'rb') as f:
+        for chunk in read_chunks(f):
+            lines += len(parser.parse(chunk).ts)
+    return lines
+
+
+@benchmark('seek_just_before_index')
+def bench_seek(path, wl):
+    from connspy.binaryseek import seek_just_before_index
+    rnd = random.Random(0)
+    targets = [rnd.uniform(wl.start_ts, wl.end_ts()) for _ in range(SEEKS)]
+    with open(path, 'rb') as f:
+        for target in targets:
+            seek_just_before_index(path, f, target)
+    return SEEKS
+
+
+@benchmark('process_stream')
+def bench_process_stream(path, wl):
+    from connspy.connspy import process_stream, parse_argv
+    from connspy.parser import read_lines
+    args = parse_argv(['--to', wl.names[wl.ranked[0]].decode(), '--time_init', str(wl.start_ts),
+                       '--time_end', str(int(wl.end_ts()) + 1), path])
+    with open(path, 'rb') as f:
+        process_stream(read_lines(f), args, lambda frm, to: None)
+    return wl.lines
+
+
+def _processor(path, wl, engine):
+    from connspy.stream import Processor, parse_argv
+    args = parse_argv(['--engine', engine, '--to', wl.names[wl.ranked[0]].decode(),
+                       '--from', wl.names[wl.ranked[1]].decode(), path])
+    pr = Processor(args, lambda *summary: None)
+    with open(path, 'rb' if engine == 'batch' else 'r') as f:
+        pr.process(f)
+    pr.dump_remaining()
+    return wl.lines
+
+
+@benchmark('Processor.process')
+def bench_processor(path, wl):
+    return _processor(path, wl, 'batch')
+
+
+@benchmark('Processor.process line')
+def bench_processor_line(path, wl):
+    return _processor(path, wl, 'line')
+
+
+@benchmark('BloomStringSet')
+def bench_bloom(path, wl):
+    from connspy.bloomset import BloomStringSet
+    keys = [name.decode() for name in wl.names]
+    s = BloomStringSet()
+    for key in keys:
+        s.add(key)
+    s.add_many(keys)
+    # a false positive can leave a key out, but only a handful
+    if sum(1 for _ in s) < len(keys) * 0.99:
+        raise Exception("BloomStringSet lost keys")
+    return 2 * len(keys)
+
+
+def run_one(name, path, params):
+    """
+    Runs the benchmark name in this process, on the log at path made
+    with params, and returns its measurements. Meant to be the only
+    thing a fresh process does, so the peak RSS is its own.
+    """
+    # what the code timed logs is not what is being timed
+    logging.disable(logging.ERROR)
+    wl = Workload(**params)
+    before, start = io_counters(), time.perf_counter()
+    items = BENCHMARKS[name](path, wl)
+    seconds = time.perf_counter() - start
+    after = io_counters()
+    result = {'seconds': seconds, 'items': items, 'items_per_second': items / seconds,
+              'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    result.update({key: after[key] - before[key] for key in after})
+    if name != 'seek_just_before_index' and name != 'BloomStringSet':
+        result['mb_per_second'] = os.path.getsize(path) / 2 ** 20 / seconds
+    return result
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(__file__)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def log_path(data_dir, params):
+    """ where the log for params is kept, so it's only generated once """
+    key = "-".join(f"{k}{v}" for k, v in sorted(params.items()))
+    return os.path.join(data_dir, f"connspy-bench-{key}.log")
+
+
+def run(params, names, data_dir, repeat=1):
+    path = log_path(data_dir, params)
+    if not os.path.exists(path):
+        print(f"generating {path}", file=sys.stderr)
+        with open(path + ".tmp", 'wb') as f:
+            Workload(**params).write(f)
+        os.replace(path + ".tmp", path)
+
+    results = {}
+    spawn = multiprocessing.get_context('spawn')
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            # a process of its own for each run, for a clean peak RSS
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                runs.append(pool.submit(run_one, name, path, params).result())
+        # the fastest run is the least disturbed one
+        results[name] = min(runs, key=lambda r: r['seconds'])
+        print(f"{name:28} {results[name]['seconds']:8.3f}s "
+              f"{results[name]['items_per_second']:14,.0f}/s "
+              f"{results[name]['peak_rss_mb']:8.1f}MB", file=sys.stderr)
+
+    return {'revision': revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'cpus': os.cpu_count(), 'params': params, 'results': results}
+
+
+def compare(old, new):
+    """ lines comparing two runs, speedup > 1 meaning new is faster """
+    lines = [f"{'benchmark':28} {'old s':>9} {'new s':>9} {'speedup':>8} {'rss old':>8} {'rss new':>8}"]
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            continue
+        lines.append(f"{name:28} {before['seconds']:9.3f} {result['seconds']:9.3f} "
+                     f"{before['seconds'] / result['seconds']:8.2f} "
+                     f"{before['peak_rss_mb']:8.1f} {result['peak_rss_mb']:8.1f}")
+    if old['params'] != new['params']:
+        lines.append("note: the two runs were made with different workloads")
+    return lines
+
+
+def parse_argv(argv):
+    args_parser = argparse.ArgumentParser(description=""
+            "benchmark connspy's moving parts on a generated log and save the "
+            "throughput, peak RSS and I/O of each as JSON")
+    add_arguments(args_parser)
+    args_parser.add_argument('--only', type=str, action='append', default=[],
+            choices=sorted(BENCHMARKS), help='run just this benchmark, can be given several times')
+    args_parser.add_argument('--repeat', type=int, default=1,
+            help='run each benchmark this many times and keep the fastest')
+    args_parser.add_argument('--data_dir', type=str, default='/tmp',
+            help='where generated logs are kept between runs')
+    args_parser.add_argument('--out', type=str, required=False,
+            help='save the results to this JSON file')
+    args_parser.add_argument('--compare', type=str, required=False,
+            help='compare with the results saved in this JSON file')
+    args = args_parser.parse_args(argv)
+    if args.repeat < 1:
+        raise Exception("repeat must be at least 1")
+    return args
+
+
+def main():
+    args = parse_argv(sys.argv[1:])
+    params = workload(args).params()
+    results = run(params, args.only or list(BENCHMARKS), args.data_dir, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), results)))
+
+
+if __name__ == '__main__':
+    main()
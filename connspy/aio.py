@@ -0,0 +1,244 @@
+import asyncio
+import signal
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from connspy.parser import read_chunks
+from connspy.compressed import compression, open_log
+from connspy.pack import PackFile, is_packed
+from connspy.tail import Tailer, Inotify, POLL_SECONDS
+
+logger = logging.getLogger("aio")
+
+# chunks waiting for the Processor, over all sources and per source.
+# a source with its share queued is simply not read from, which for
+# sockets pushes back on the shipper through TCP flow control
+QUEUE_CHUNKS = 64
+SOURCE_CHUNKS = 8
+SOCKET_READ = 256 * 2 ** 10
+
+
+def parse_listen(addr):
+    """
+    unix:/path/to/socket, or [tcp:]host:port with an empty host
+    meaning all interfaces. Returns ('unix', path) or ('tcp', host, port)
+    """
+    if addr.startswith("unix:"):
+        path = addr[len("unix:"):]
+        if not path:
+            raise Exception(f"no socket path in {addr}")
+        return ('unix', path)
+
+    if addr.startswith("tcp:"):
+        addr = addr[len("tcp:"):]
+    host, sep, port = addr.rpartition(":")
+    if not sep or not port.isdigit():
+        raise Exception(f"cannot listen on {addr}, expected unix:PATH or HOST:PORT")
+    return ('tcp', host.strip("[]") or None, int(port))
+
+
+class Ingest:
+    """
+    Feeds one Processor from many sources at once, all on a single
+    asyncio loop: files, read through or tailed, and UNIX or TCP
+    sockets log shippers write lines to.
+
+    Every source reads chunks of whole lines into a bounded queue that
+    the Processor works through. Each source can only have so many
+    chunks queued, so a busy source cannot crowd out the others, and
+    a slow one is just a task waiting for data, holding nobody up.
+
+    The Processor works on a thread of its own, so the loop keeps
+    reading sources while a chunk is parsed. Only that thread ever
+    touches the Processor, host table included. Files are opened, read
+    and polled on the threads of the loop's default executor, so one
+    on a stalled disk or NFS mount only holds up itself.
+    """
+
+    def __init__(self, pr, queue_chunks=QUEUE_CHUNKS, source_chunks=SOURCE_CHUNKS):
+        self.pr = pr
+        self.queue = asyncio.Queue(queue_chunks)
+        self.source_chunks = source_chunks
+        self.servers = []
+        self.stopped = asyncio.Event()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="connspy-processor")
+
+    async def put(self, chunk, share):
+        await share.acquire()
+        await self.queue.put((chunk, share))
+
+    async def call(self, fn, *args):
+        """ fn(*args) on the Processor's thread """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def read(self, fn, *args):
+        """ fn(*args), blocking on a file, on a thread of the default executor """
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def process(self, chunk):
+        if isinstance(chunk, tuple):
+            self.pr.process_columns(*chunk)
+        else:
+            self.pr.process_chunk(chunk)
+        if self.pr.reporter:
+            self.pr.reporter.maybe_report()
+
+    async def consume(self):
+        while True:
+            chunk, share = await self.queue.get()
+            try:
+                await self.call(self.process, chunk)
+            finally:
+                share.release()
+                self.queue.task_done()
+
+    async def read_file(self, path, tail=False):
+        share = asyncio.Semaphore(self.source_chunks)
+        packed = await self.read(is_packed, path)
+        if tail and (packed or await self.read(compression, path) is not None):
+            raise Exception(f"{path} is compressed or packed, it can't be followed with --tail")
+        if packed:
+            # blocks go in the queue already parsed, as columns, their
+            # hosts interned on the Processor's thread
+            pack = await self.read(PackFile, path)
+            columns = pack.columns(self.pr.hosts)
+            while True:
+                block = await self.call(next, columns, None)
+                if block is None:
+                    break
+                _, ts, frm, to = block
+                await self.put((ts, frm, to), share)
+            pack.close()
+            return
+        with await self.read(open_log, path) as f:
+            if not tail:
+                chunks = read_chunks(f)
+                while True:
+                    chunk = await self.read(next, chunks, None)
+                    if chunk is None:
+                        break
+                    await self.put(chunk, share)
+                return
+
+            tailer = Tailer(f, path)
+            self.pr.tailers.append(tailer)
+            try:
+                while True:
+                    chunk = await self.read(tailer.poll)
+                    if chunk is None:
+                        await wait_for_change(tailer)
+                    else:
+                        await self.put(chunk, share)
+            finally:
+                self.pr.tailers.remove(tailer)
+                tailer.close()
+
+    async def read_stream(self, reader, writer):
+        share = asyncio.Semaphore(self.source_chunks)
+        peer = writer.get_extra_info('peername') or 'unix socket'
+        logger.info(f"{peer} connected")
+        rest = b""
+        try:
+            while True:
+                data = await reader.read(SOCKET_READ)
+                if not data:
+                    break
+                cut = data.rfind(b"\n") + 1
+                if cut == 0:
+                    rest += data
+                    continue
+                await self.put(rest + data[:cut], share)
+                rest = data[cut:]
+            if rest:
+                await self.put(rest, share)
+        finally:
+            logger.info(f"{peer} disconnected")
+            writer.close()
+
+    async def listen(self, addr):
+        kind, *where = parse_listen(addr)
+        if kind == 'unix':
+            server = await asyncio.start_unix_server(self.read_stream, where[0])
+        else:
+            server = await asyncio.start_server(self.read_stream, *where)
+        logger.info(f"listening on {addr}")
+        self.servers.append(server)
+        return server
+
+    def stop(self):
+        self.stopped.set()
+
+    async def run(self, files=(), tail=False, listen=()):
+        """
+        Ingests until every file is read, if not tailing nor listening,
+        or else until stop(). Whatever was queued is processed first.
+        If a source or the Processor fails, so does this, with its
+        exception.
+        """
+        consumer = asyncio.create_task(self.consume())
+        sources = [asyncio.create_task(self.read_file(path, tail)) for path in files]
+        try:
+            for addr in listen:
+                await self.listen(addr)
+
+            waiters = [asyncio.create_task(self.stopped.wait())]
+            if sources and not tail and not listen:
+                waiters.append(asyncio.gather(*sources))
+            await asyncio.wait(waiters + [consumer], return_when=asyncio.FIRST_COMPLETED)
+
+            for server in self.servers:
+                server.close()
+                await server.wait_closed()
+            for task in sources + waiters:
+                task.cancel()
+            await asyncio.gather(*sources, *waiters, return_exceptions=True)
+            # a source that failed should not go unnoticed
+            for task in sources:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+
+            # what's queued, unless the Processor failed on the way
+            joined = asyncio.create_task(self.queue.join())
+            await asyncio.wait([joined, consumer], return_when=asyncio.FIRST_COMPLETED)
+            joined.cancel()
+            if consumer.done():
+                consumer.result()
+        finally:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+            # the chunk being processed, if any, is let finish
+            self.executor.shutdown()
+
+
+async def wait_for_change(tailer):
+    """ Tailer.watcher.wait(), without blocking the loop """
+    watcher = tailer.watcher
+    if not isinstance(watcher, Inotify):
+        await asyncio.sleep(POLL_SECONDS)
+        return
+
+    loop = asyncio.get_running_loop()
+    changed = loop.create_future()
+    def on_event():
+        if watcher.drain() and not changed.done():
+            changed.set_result(True)
+
+    loop.add_reader(watcher.fileno(), on_event)
+    try:
+        await asyncio.wait_for(changed, tailer.wait_seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(watcher.fileno())
+
+
+def run(pr, args):
+    """ connspy-stream's entry to all this, stops on SIGINT or SIGTERM """
+    async def main():
+        ingest = Ingest(pr)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, ingest.stop)
+        await ingest.run(args.files, args.tail, args.listen)
+
+    asyncio.run(main())
@@ -1,20 +1,139 @@
-import unittest
-import tempfile
 import os
+import mmap
 
 import logging
 
+from connspy.parser import Parser
+
 logger = logging.getLogger(__name__)
 block_size = 4096  # bytes. note typical ssd is 2-4 MB and 8kb pages
 
+
+def _line_at(mm, pos, hi):
+    """
+    Returns (offset, ts) of the first well formed line starting at
+    or after pos and before hi, or (offset, None) if there is none,
+    offset then being where the next line after pos would start.
+    """
+    if pos > 0:
+        pos = mm.find(b"\n", pos - 1, hi) + 1 or hi
+    first = pos
+    while pos < hi:
+        end = mm.find(b"\n", pos, hi)
+        if end < 0:
+            end = hi
+        ele = mm[pos:end].split()
+        # malformed lines are just skipped over
+        if len(ele) == 3:
+            ts = Parser.parse_ts(ele[0])
+            if ts:
+                return pos, ts
+        pos = end + 1
+    return min(first, hi), None
+
+
+def _last_line(mm, size):
+    """ (offset, ts) of the last well formed line, working backwards """
+    hi = size
+    while hi > 0:
+        start = mm.rfind(b"\n", 0, hi - 1) + 1
+        pos, ts = _line_at(mm, start, hi)
+        if ts is not None:
+            return pos, ts
+        hi = start
+    return 0, None
+
+
+def latest_timestamp(mm, size=None):
+    """ the timestamp of the last well formed line of a mapped log, None if it has none """
+    _, ts = _last_line(mm, len(mm) if size is None else size)
+    return ts
+
+
+def bracket(mm, target, size=None):
+    """
+    Finds (lo, hi), two line starts at most block_size apart, so that
+    the line at lo is before target (or lo is 0) and the line at hi is
+    at or after target (or hi is the end of the file).
+
+    Timestamps are close to linear in the offset, so it interpolates
+    where target should be, falling back to halving the range whenever
+    interpolating did not at least halve it.
+    """
+    size = len(mm) if size is None else size
+    lo, lo_ts = 0, None
+    hi, hi_ts = size, None
+
+    pos, ts = _line_at(mm, 0, size)
+    if ts is None or ts >= target:
+        return 0, pos if ts is not None else size
+    lo, lo_ts = pos, ts
+
+    pos, ts = _last_line(mm, size)
+    if ts < target:
+        return pos, size
+    hi, hi_ts = pos, ts
+
+    bisect = False
+    while hi - lo > block_size:
+        if bisect or hi_ts <= lo_ts:
+            guess = (lo + hi) // 2
+        else:
+            guess = lo + int((target - lo_ts) / (hi_ts - lo_ts) * (hi - lo))
+            guess = min(max(guess, lo + 1), hi - 1)
+
+        pos, ts = _line_at(mm, guess, hi)
+        logger.info(f"lo: {lo}, hi: {hi}, guess: {guess}, got {pos} {ts}")
+
+        width = hi - lo
+        if ts is None:
+            if pos >= hi:
+                if bisect:
+                    break       # the line at lo runs all the way to hi
+                bisect = True
+                continue
+            hi = pos        # nothing but malformed lines from pos to hi
+        elif ts < target:
+            lo, lo_ts = pos, ts
+        else:
+            hi, hi_ts = pos, ts
+
+        # interpolation is great on smooth data, but on lumpy data
+        # it can creep along, so make sure every other step halves
+        bisect = not bisect and (hi - lo) * 2 > width
+
+    return lo, hi
+
+
+def seek_range(path, time_init, time_end, max_log_late_seconds=0):
+    """
+    Returns (start, end), the byte range of the file at path to scan
+    for lines in [time_init, time_end), allowing for lines up to
+    max_log_late_seconds out of order. end is None for end of file.
+    """
+    size = os.stat(path).st_size
+    if size < 5 * block_size:
+        return 0, None      # less than 5 blocks not worth it
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mapped_range(mm, size, time_init, time_end, max_log_late_seconds)
+
+
+def mapped_range(mm, size, time_init, time_end, max_log_late_seconds=0):
+    """ seek_range, in a log already mapped as mm, of size bytes """
+    start, _ = bracket(mm, time_init - max_log_late_seconds, size)
+    # the first line at or after time_end + late means latest_ts
+    # is past it, so nothing after that can still be in range
+    _, end = bracket(mm, time_end + max_log_late_seconds, size)
+    return start, (end if end < size else None)
+
+
 def seek_just_before_index(path, f, target):
     """
     This function accepts an open file handle object
-    and attempts to seek through the file via
-    binary search and return the file handle
-    at a start of line before the 
-    index desired, within 8kb by default
-    This matches the page cache size on SSDs.
+    and seeks it to the start of a line before the
+    index desired, within block_size.
 
     path: path to file
     f: file object (already opened)
@@ -28,36 +147,10 @@ def seek_just_before_index(path, f, target):
         logger.info("Was asked to seek from a resource that is not seekable()")
         return # it's prob a stdio stream or something
 
-    statinfo = os.stat(path)
-    size = statinfo.st_size 
-    last_block = size // block_size  # rounds down
-
-    # less than 5 blocks not worth it
-    if last_block < 5:
+    size = os.stat(path).st_size
+    if size < 5 * block_size:
         return
 
-    new_start = 0
-    lo = 0
-    hi = last_block
-    
-    iteration_limit = 20                  # for safety
-    while (iteration_limit >= 0) and (hi - lo > 1):
-        iteration_limit -= 1
-        mid = (lo + hi) // 2
-        f.seek(mid * block_size, os.SEEK_SET)  # from start of file
-        f.readline()                      # blow this one, likely incomplete
-        line = f.readline()
-        index = int(line.split()[0])
-
-        logger.info(f"new_start: {new_start}, hi: {hi}, lo: {lo}, {line}")
-
-        # TODO: some more graceful error handling on that
-        if index  < target:
-            lo = mid
-            new_start = f.tell()              # get current seek position
-            continue
-        hi = mid
-
-    # we are within 2 blocks of the file location we want, anyway
-    f.seek(new_start)
-        
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        lo, _ = bracket(mm, target, size)
+    f.seek(lo)
@@ -1,6 +1,195 @@
-from bloom_filter import BloomFilter
+import math
+import struct
+import hashlib
 from tempfile import SpooledTemporaryFile
-import unittest
+
+import numpy as np
+
+MAGIC = b"CSPYBLM1"
+# spilled keys are kept in memory up to this many bytes
+SPOOL_BYTES = (2 ** 20) * 5
+# bits, hash functions, keys added, capacity, error rate
+STAGE = struct.Struct("<QQQQd")
+
+
+def hash_ids(keys):
+    """ 64 bit hashes of an array of ints, splitmix64 style """
+    with np.errstate(over='ignore'):
+        x = np.asarray(keys).astype(np.uint64) + np.uint64(0x9e3779b97f4a7c15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+
+def hash_strings(keys):
+    """ 64 bit hashes of strings, so they can go through hash_ids too """
+    return np.fromiter((int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(),
+                                       'little') for key in keys),
+                       np.uint64, len(keys))
+
+
+class BloomFilter:
+    """
+    A plain Bloom filter over a numpy bit array, sized for capacity
+    keys at error_rate false positives. Works on whole arrays of
+    64 bit key hashes at once (see hash_ids), k bit positions each
+    derived from two halves of the hash (Kirsch and Mitzenmacher).
+    """
+
+    def __init__(self, capacity, error_rate, bits=None, k=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        if bits is None:
+            bits = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        if k is None:
+            k = max(round(bits / capacity * math.log(2)), 1)
+        self.n_bits = bits
+        self.k = k
+        self.bits = np.zeros((bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, hashes):
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.k, dtype=np.uint64)[:, None]
+        with np.errstate(over='ignore'):
+            return (h1 + i * h2) % np.uint64(self.n_bits)
+
+    def contains_hashes(self, hashes):
+        pos = self._positions(hashes)
+        hit = self.bits[pos >> np.uint64(3)] & (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8))
+        return np.all(hit != 0, axis=0)
+
+    def add_hashes(self, hashes):
+        pos = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, pos >> np.uint64(3),
+                         np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8))
+        self.count += len(hashes)
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def union(self, other):
+        """ ORs other in, which has to be the same shape """
+        if (self.n_bits, self.k) != (other.n_bits, other.k):
+            raise Exception("can only union bloom filters of the same size")
+        self.bits |= other.bits
+        # keys in both would be counted twice, so estimate the union
+        # from the bits now set (Swamidass and Baldi): -m/k ln(1 - X/m)
+        m = self.n_bits
+        x = min(int(np.unpackbits(self.bits)[:m].sum()), m - 1)
+        estimate = round(-m / self.k * math.log(1 - x / m))
+        self.count = max(estimate, self.count, other.count)
+
+    def to_bytes(self):
+        return (STAGE.pack(self.n_bits, self.k, self.count, self.capacity, self.error_rate) +
+                self.bits.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """ returns the filter and the offset right after it """
+        n_bits, k, count, capacity, error_rate = STAGE.unpack_from(data, offset)
+        offset += STAGE.size
+        bloom = cls(capacity, error_rate, n_bits, k)
+        size = len(bloom.bits)
+        bloom.bits[:] = np.frombuffer(data, np.uint8, size, offset)
+        bloom.count = count
+        return bloom, offset + size
+
+
+class ScalableBloomFilter:
+    """
+    A Bloom filter that starts small and grows with the number of keys,
+    as a list of BloomFilters (Almeida et al, Scalable Bloom Filters).
+    When the last one is full a new one is added, growth times bigger
+    and with a tightened error rate, so the overall false positive
+    rate stays under error_rate however many keys come. Memory is then
+    in proportion to the keys actually seen, not a guess made upfront.
+    """
+
+    def __init__(self, error_rate=10 ** -9, capacity=1024, growth=4, tightening=0.5):
+        self.error_rate = error_rate
+        self.initial_capacity = capacity
+        self.growth = growth
+        self.tightening = tightening
+        self.stages = []
+
+    def _grow(self):
+        i = len(self.stages)
+        self.stages.append(BloomFilter(
+            self.initial_capacity * self.growth ** i,
+            self.error_rate * (1 - self.tightening) * self.tightening ** i))
+
+    def contains_hashes(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for stage in self.stages:
+            found |= stage.contains_hashes(hashes)
+        return found
+
+    def add_hashes(self, hashes):
+        """
+        Adds the keys not already in, returns the mask of those.
+        A key given more than once is only new the first time.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        _, first = np.unique(hashes, return_index=True)
+        new = np.zeros(len(hashes), dtype=bool)
+        new[first] = True
+        new &= ~self.contains_hashes(hashes)
+
+        todo = hashes[new]
+        while len(todo):
+            if not self.stages or self.stages[-1].full():
+                self._grow()
+            stage = self.stages[-1]
+            room = stage.capacity - stage.count
+            stage.add_hashes(todo[:room])
+            todo = todo[room:]
+        return new
+
+    def __len__(self):
+        return sum(stage.count for stage in self.stages)
+
+    def nbytes(self):
+        return sum(len(stage.bits) for stage in self.stages)
+
+    def fill_ratio(self):
+        """ fraction of the bits set, over all the stages """
+        bits = sum(stage.n_bits for stage in self.stages)
+        if not bits:
+            return 0.0
+        return sum(int(np.unpackbits(stage.bits).sum()) for stage in self.stages) / bits
+
+    def union(self, other):
+        """
+        Adds every key of other, stage by stage where they match,
+        which they do when made with the same parameters
+        """
+        for i, stage in enumerate(other.stages):
+            if i < len(self.stages):
+                self.stages[i].union(stage)
+            else:
+                self.stages.append(BloomFilter.from_bytes(stage.to_bytes())[0])
+
+    def to_bytes(self):
+        return b"".join([MAGIC,
+                         struct.pack("<dQQdQ", self.error_rate, self.initial_capacity,
+                                     self.growth, self.tightening, len(self.stages))] +
+                        [stage.to_bytes() for stage in self.stages])
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:len(MAGIC)] != MAGIC:
+            raise Exception("not a serialized bloom filter")
+        offset = len(MAGIC)
+        error_rate, capacity, growth, tightening, n = struct.unpack_from("<dQQdQ", data, offset)
+        offset += struct.calcsize("<dQQdQ")
+        bloom = cls(error_rate, capacity, growth, tightening)
+        for _ in range(n):
+            stage, offset = BloomFilter.from_bytes(data, offset)
+            bloom.stages.append(stage)
+        return bloom
+
 
 class BloomStringSet:
     """
@@ -10,37 +199,67 @@ class BloomStringSet:
     which would cause some missing keyue, however the likelihood
     of such is controllable through the parameters. Temporary files
     are only created after they reach 5MB, otherwise stay in memory.
-    
-    cardinality: the estimated maximum number of unique elements.
-                 As one goes beyond this number, risk of collision
-                 increases, but sloooooowly.
 
-    error_rate:  the false positive rate you are comfortable with when
-                 the cardinality number is reached.
+    error_rate:  the false positive rate you are comfortable with.
+                 The filter grows with the keys so as to keep it,
+                 starting out small (see ScalableBloomFilter).
 
+    Sets pickle, filter and spilled keys included, for checkpoints.
     """
 
-    def __init__(self, cardinality=10 ** 6, error_rate=10 ** -9):
-        self.bloom = BloomFilter(cardinality, error_rate)
-        self.file  = SpooledTemporaryFile(max_size=(2 ** 20) * 5, mode='w')
+    MODE = 'w+'
+
+    def __init__(self, error_rate=10 ** -9):
+        self.bloom = ScalableBloomFilter(error_rate)
+        self.file  = SpooledTemporaryFile(max_size=SPOOL_BYTES, mode=self.MODE)
+        self.closed = False
+
+    def __getstate__(self):
+        if self.closed:
+            raise Exception("Cannot save a set that's being read")
+        self.file.seek(0)
+        spilled = self.file.read()
+        return {'bloom': self.bloom.to_bytes(), 'spilled': spilled}
+
+    def __setstate__(self, state):
+        self.bloom = ScalableBloomFilter.from_bytes(state['bloom'])
+        self.file  = SpooledTemporaryFile(max_size=SPOOL_BYTES, mode=self.MODE)
+        self.file.write(state['spilled'])
         self.closed = False
-        
+
+    def _hash(self, keys):
+        return hash_strings(keys)
+
     def add(self, key):
+        return bool(self.add_many([key])[0])
+
+    def add_many(self, keys):
+        """ adds keys, returning the mask of those that were new """
         if self.closed:
             raise Exception("Cannot add new element after attempting to read")
+        for key in keys:
+            if type(key) is not str:
+                raise Exception("Can only use string keys for now")
 
-        if type(key) is not str:
-            raise Exception("Can only use string keys for now")
+        new = self.bloom.add_hashes(self._hash(keys))
+        self._spill([key for key, is_new in zip(keys, new) if is_new])
+        return new
 
-        if key in self.bloom:
-            return False
-
-        self.bloom.add(key)
-        self.file.write(key + "\n")
+    def _spill(self, keys):
+        for key in keys:
+            self.file.write(key + "\n")
 
     def __contains__(self, key):
-        return key in self.bloom
-    
+        return bool(self.bloom.contains_hashes(self._hash([key]))[0])
+
+    def nbytes(self):
+        """ memory held, roughly: the filter and the keys not yet on disk """
+        spilled = 0 if self.closed else self.file.tell()
+        return self.bloom.nbytes() + (spilled if spilled <= SPOOL_BYTES else 0)
+
+    def __len__(self):
+        return len(self.bloom)
+
     def __iter__(self):
         self.closed = True
         self.file.seek(0)
@@ -55,3 +274,37 @@ class BloomStringSet:
 
     def __del__(self):
         self.file.close()
+
+
+class BloomIdSet(BloomStringSet):
+    """
+    BloomStringSet for interned host ids (see hosts.HostTable).
+    The ids are spilled as packed 4 byte ints rather than text lines
+    and come back out as ints.
+    """
+
+    MODE = 'w+b'
+
+    def _hash(self, keys):
+        return hash_ids(np.asarray(keys, dtype=np.int64))
+
+    def add_many(self, keys):
+        if self.closed:
+            raise Exception("Cannot add new element after attempting to read")
+        keys = np.asarray(keys, dtype=np.int32)
+        new = self.bloom.add_hashes(self._hash(keys))
+        self.file.write(keys[new].tobytes())
+        return new
+
+    def __iter__(self):
+        self.closed = True
+        self.file.seek(0)
+        return self._read_ids()
+
+    def _read_ids(self):
+        while True:
+            block = self.file.read(2 ** 16)
+            if not block:
+                break
+            yield from np.frombuffer(block, np.int32).tolist()
+        self.file.close()
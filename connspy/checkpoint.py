@@ -0,0 +1,89 @@
+import os
+import time
+import pickle
+import logging
+
+logger = logging.getLogger("checkpoint")
+
+STATE_FILE = "state.pickle"
+VERSION = 1
+DEFAULT_EVERY_SECONDS = 60
+
+# the options that shape the state, a checkpoint made with other
+# values for any of them can't be resumed from
+STATE_OPTIONS = ('to', 'frm', 'window', 'hop', 'max_log_late_seconds',
+                 'most_capacity', 'distinct', 'distinct_max_keys', 'fan_top',
+                 'fan_precision')
+
+
+def fingerprint(args):
+    return {option: getattr(args, option) for option in STATE_OPTIONS}
+
+
+class Checkpointer:
+    """
+    Saves the state of a Processor to directory every so often, along
+    with where in which file it's up to, so that after a restart it
+    can pick up from there rather than reading the logs all over again.
+
+    A checkpoint is a single pickle written next to the last one and
+    renamed over it, so there's always a whole one to go back to.
+    It holds the open windows in full, Bloom filters, spilled hosts
+    and MOST counters included, the host table and the latest
+    timestamp seen. It's also saved whenever windows were output, so
+    at most a chunk's worth of windows can be output again on resume.
+    """
+
+    def __init__(self, directory, args, every_seconds=DEFAULT_EVERY_SECONDS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, STATE_FILE)
+        self.every_seconds = every_seconds
+        self.fingerprint = fingerprint(args)
+        self.last_saved = time.monotonic()
+        self.last_emitted = 0
+        self.position = None    # of the last save
+
+    def load(self):
+        """
+        Returns the last checkpoint, {'processor': ..., 'position':
+        (path, inode, offset)}, or None if there is none.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != VERSION:
+            raise Exception(f"{self.path} is from another version of connspy")
+        if state['fingerprint'] != self.fingerprint:
+            raise Exception(f"{self.path} was made with other options, "
+                            "remove it or use another --checkpoint_dir")
+        return state
+
+    def save(self, pr, position):
+        start = time.monotonic()
+        state = {'version': VERSION, 'fingerprint': self.fingerprint,
+                 'processor': pr.state(), 'position': position}
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # and make the rename itself stick
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self.last_saved = time.monotonic()
+        self.last_emitted = pr.emitted
+        self.position = position
+        logger.info(f"checkpoint at {position} took {self.last_saved - start:.3f}s")
+
+    def maybe_save(self, pr, position):
+        """ saves if it's been a while, or if windows were output since """
+        if (pr.emitted != self.last_emitted or
+                time.monotonic() - self.last_saved >= self.every_seconds):
+            self.save(pr, position)
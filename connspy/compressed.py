@@ -0,0 +1,163 @@
+import io
+import gzip
+import zlib
+import struct
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("compressed")
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# The header of every gzip member of a block compressed log, a plain
+# gzip header with one extra field, BGZF style: 'CS' and the size of
+# the whole member, so members can be walked without inflating them.
+# id1, id2, method, flags, mtime, extra flags, os, extra length,
+# subfield id, subfield length, member size
+BLOCK_HEADER = struct.Struct("<BBBBIBBH2sHI")
+BLOCK_ID = b"CS"
+FEXTRA = 4
+# the crc32 and length of the inflated data that close a member
+BLOCK_TRAILER = struct.Struct("<II")
+
+
+def compression(path):
+    """ 'gzip', 'zstd' or None for a plain log, going by its first bytes """
+    with open(path, 'rb') as f:
+        magic = f.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+def is_block_compressed(path):
+    """ whether path was written by compress_block(), one block after another """
+    with open(path, 'rb') as f:
+        header = f.read(BLOCK_HEADER.size)
+    return _block_size(header) is not None
+
+
+def _block_size(header):
+    if len(header) < BLOCK_HEADER.size:
+        return None
+    id1, id2, _, flags, _, _, _, _, block_id, _, size = BLOCK_HEADER.unpack(header)
+    if bytes((id1, id2)) != GZIP_MAGIC or not flags & FEXTRA or block_id != BLOCK_ID:
+        return None
+    return size
+
+
+def compress_block(data, level=6):
+    """ data, whole lines, as one gzip member of a block compressed log """
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = deflate.compress(data) + deflate.flush()
+    size = BLOCK_HEADER.size + len(body) + BLOCK_TRAILER.size
+    return (BLOCK_HEADER.pack(0x1f, 0x8b, 8, FEXTRA, 0, 0, 255,
+                              BLOCK_HEADER.size - 12, BLOCK_ID, 4, size) +
+            body + BLOCK_TRAILER.pack(zlib.crc32(data), len(data) & 0xffffffff))
+
+
+def read_blocks(f, offset=0, end=None):
+    """
+    Walks the block compressed log f from offset, which has to be the
+    start of a block, up to end. Yields (offset, data) for every whole
+    block, data being its lines inflated. Stops before a block that is
+    still being written.
+    """
+    while end is None or offset < end:
+        f.seek(offset)
+        header = f.read(BLOCK_HEADER.size)
+        if not header:
+            return
+        size = _block_size(header)
+        if size is None:
+            raise Exception(f"no block starts at byte {offset}, is it block compressed ?")
+        block = header + f.read(size - len(header))
+        if len(block) < size:
+            return
+        yield offset, zlib.decompress(block, 16 + zlib.MAX_WBITS)
+        offset += size
+
+
+def block_offsets(path, start=0, end=None):
+    """ byte offsets of the blocks of a block compressed log in [start, end) """
+    offsets = []
+    with open(path, 'rb') as f:
+        offset = start
+        while end is None or offset < end:
+            f.seek(offset)
+            size = _block_size(f.read(BLOCK_HEADER.size))
+            if size is None:
+                break
+            offsets.append(offset)
+            offset += size
+    return offsets
+
+
+class _Range(io.RawIOBase):
+    """ the bytes [start, end) of the binary file f, as a file """
+
+    def __init__(self, f, start, end):
+        f.seek(start)
+        self.f = f
+        self.left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.f.readinto(memoryview(b)[:min(len(b), self.left)])
+        self.left -= n
+        return n
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+class _Inflated(io.BufferedReader):
+    """
+    Inflating readers hand back a few KB at a time, read1() included,
+    which would make for tiny chunks (see parser.read_chunks). A file
+    is no pipe, so here read1() waits for as much as asked for.
+    """
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+
+def open_log(path, start=0, end=None):
+    """
+    Opens the log at path for reading as a binary file, from byte start
+    up to end (None for the end of the file). gzip and zstd compressed
+    logs are inflated as they're read, start and end then being offsets
+    in the compressed file that must be at block (or frame) boundaries,
+    as found by the index of a block compressed log.
+    """
+    kind = compression(path)
+    f = open(path, 'rb')
+    if end is None:
+        f.seek(start)
+    else:
+        f = io.BufferedReader(_Range(f, start, end))
+    if kind == 'gzip':
+        gz = gzip.GzipFile(fileobj=f, mode='rb')
+        gz.myfileobj = f        # so that closing it closes f too
+        return _Inflated(gz)
+    if kind == 'zstd':
+        if zstandard is None:
+            f.close()
+            raise Exception(f"{path} is zstd compressed, which needs the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True,
+                                                            closefd=True)
+        return _Inflated(reader)
+    return f
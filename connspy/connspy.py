@@ -1,34 +1,75 @@
 import sys
+import copy
 import logging
 import argparse
 import unittest
 import re
 
+import numpy as np
+
 from collections import namedtuple 
-from connspy.parser import Parser, VALID_HOST_REGEX
-from connspy.binaryseek import seek_just_before_index
+from connspy.parser import Parser, BatchParser, VALID_HOST_REGEX, read_chunks, read_lines, first_seen
+from connspy.binaryseek import seek_range
+from connspy.index import load_index
+from connspy.compressed import compression, open_log
+from connspy.pack import PackFile, is_packed, to_seconds
+from connspy.rollup import load_rollups, HOUR
+from connspy.hosts import HostTable, pair_ids, unpair_ids, read_host_file
+from connspy.rejects import Rejects
+from connspy.sinks import make_sink, parse_output
+from connspy.metrics import Metrics, Reporter, parse_target
 
 logger = logging.getLogger("connspy")
 
 def parse_argv(argv):
     args_parser = argparse.ArgumentParser(description=""
             "connspy: parse connection logs to see who is connecting to who")
-    args_parser.add_argument('--to', type=str, required=False,
-            help='Collect all hosts who connected to this host')
+    args_parser.add_argument('--to', type=str, required=False, action='append',
+            default=[], help='Collect all hosts who connected to this host. '
+                             'Can be given several times')
+    args_parser.add_argument('--to_file', type=str, required=False,
+            help='a file listing more hosts to collect connections to, '
+                 'one per line')
     args_parser.add_argument('--time_init', type=str, required=True,
             help='the earliest time stamp of the log entries we should consider')
     args_parser.add_argument('--nofastseek', action='store_true',
             default=False, help='do not use fast block seek to start time')
+    args_parser.add_argument('--noindex', action='store_true',
+            default=False, help='ignore the index sidecar written by connspy-index')
+    args_parser.add_argument('--norollup', action='store_true',
+            default=False, help='ignore the hourly rollups written by connspy-rollup')
     args_parser.add_argument('--time_end', type=str, required=True,
             help='the end of the time stamp range, noninclusive'),
     args_parser.add_argument('--max_log_late_seconds', type=int, 
             required=False, default=5 * 60, 
             help='the maximum time in seconds a log line can be late, relative to minimum time')
+    args_parser.add_argument('--engine', choices=['batch', 'line'], default='batch',
+            help='batch parses large chunks at once into numpy columns, '
+                 'line parses one line at a time')
+    args_parser.add_argument('--workers', type=int, required=False, default=1,
+            help='scan the byte range in this many processes')
+    args_parser.add_argument('--unordered', action='store_true', default=False,
+            help='with --workers, print hosts as soon as each slice of the '
+                 'file is done, not in the order they were first seen')
+    args_parser.add_argument('--metrics', type=str, required=False,
+            help='count lines, rejects, bytes and hits and report them once '
+                 'done as JSON to stderr, and to a Prometheus text file at '
+                 'this path unless it is stderr')
+    args_parser.add_argument('--output', type=str, required=False, default='tsv',
+            help='tsv, jsonl or sqlite, each with an optional :PATH to write to '
+                 'instead of STDOUT, sqlite:PATH inserting the hosts straight '
+                 'into that SQLite database')
+    args_parser.add_argument('--quarantine', type=str, required=False,
+            help='append the malformed lines read to this file, each with its '
+                 'byte offset and why it was rejected')
     args_parser.add_argument('file', type=str, default=None,
             help='the file to parse') 
 
     args = args_parser.parse_args(argv) 
-    args.to = args.to.lower()
+    if args.to_file:
+        args.to.extend(read_host_file(args.to_file))
+    # dedup, but keep the order given
+    args.to = list(dict.fromkeys(to.lower() for to in args.to))
 
     if args.max_log_late_seconds < 0:
         raise Exception("max_log_late_seconds mist be positive")
@@ -40,42 +81,304 @@ def parse_argv(argv):
         raise Exception("time_end invalid")
     if args.time_end < args.time_init:
         raise Exception("time_end is before time_init")
-    if not re.match(VALID_HOST_REGEX, args.to):
-        raise Exception(f"invalid to-host {args.to} . Must match " + VALID_HOST_REGEX)
+    if not args.to:
+        raise Exception("at least one --to host or a --to_file is needed")
+    if args.workers < 1:
+        raise Exception("workers must be at least 1")
+    for to in args.to:
+        if not re.match(VALID_HOST_REGEX, to):
+            raise Exception(f"invalid to-host {to} . Must match " + VALID_HOST_REGEX)
+    parse_output(args.output)
+    if args.quarantine and args.engine != 'batch':
+        raise Exception("--quarantine only works with the batch engine")
+    if args.metrics and parse_target(args.metrics)[0] == 'http':
+        raise Exception("connspy exits once done, its --metrics go to a file or stderr")
 
     return args
 
 # factored out for testing ease
-def process_stream(f, args, callback):
+def process_stream(f, args, callback, metrics=None, rejects=None):
+    """
+    Calls back with (frm, to) for every distinct host frm that connected
+    to one of the args.to hosts in the time range. Stops once the lines
+    are past the range, late lines included, at the first line at or
+    past time_end + max_log_late_seconds, whether f holds the whole log
+    or only the byte range found for it. Lines read are counted in metrics,
+    a metrics.Metrics, and those rejected in rejects, a rejects.Rejects,
+    if given.
+    """
     latest_ts = -float('inf')
-    parser = Parser()
-    seen   = set()
+    parser  = Parser(rejects)
+    hosts   = HostTable()
+    targets = set(args.to)
+    seen    = set()          # of (to, frm) host ids
+    late    = []             # for metrics, how far behind each line was
+    rejected = 0
 
     for line in f:
         ts, frm, to = parser.parse(line)
         if not ts:       # invalid
+            rejected += 1
             continue  
+        # can we stop early, including the out of order buffer ?
+        if max(ts, latest_ts) >= (args.time_end + args.max_log_late_seconds):
+            break
+        if metrics is not None:
+            late.append(max(latest_ts - ts, 0))
         latest_ts = max(ts, latest_ts)
 
+        if (args.time_init <= ts < args.time_end and
+                        to in      targets):
+            pair = (hosts.intern(to), hosts.intern(frm))
+            if pair not in seen:
+                seen.add(pair)
+                callback(frm, to)
+
+    if metrics is not None:
+        metrics.count('lines', len(late))
+        metrics.count('rejected_lines', rejected)
+        metrics.observe('line_lateness_seconds', late)
+
+
+def process_chunks(chunks, args, callback, metrics=None, rejects=None, hourly=False):
+    """
+    Same as process_stream, but fed with chunks of whole lines
+    (see parser.read_chunks) which are parsed and filtered as arrays.
+    Returns the latest timestamp it read, which is past the range if
+    it stopped early. With hourly, hosts are distinct
+    within each hour of the range rather than over all of it, and are
+    called back with (frm, to, hour).
+    """
+    latest_ts = -float('inf')
+    stop_ts   = args.time_end + args.max_log_late_seconds
+    parser    = BatchParser(rejects=rejects)
+    hosts     = parser.hosts
+    targets   = np.array([hosts.intern(to) for to in args.to], dtype=np.int32)
+    seen      = set()        # of paired (to, frm) ids
+
+    for chunk in chunks:
+        ts, frm, to, valid = parser.parse(chunk)
+
         # can we stop early, including the out of order buffer ?
-        if latest_ts >= (args.time_end + args.max_log_late_seconds):
-            return
+        # invalid lines can't move the latest timestamp
+        latest = np.maximum.accumulate(np.where(valid, ts, -np.inf))
+        stop = np.flatnonzero(np.maximum(latest, latest_ts) >= stop_ts)
+        if len(stop):
+            latest_ts = max(latest_ts, latest[stop[0]])
+            ts, frm, to, valid = ts[:stop[0]], frm[:stop[0]], to[:stop[0]], valid[:stop[0]]
+        elif len(latest):
+            latest_ts = max(latest_ts, latest[-1])
 
-        if (args.time_init <= ts < args.time_end and
-                        to ==      args.to  and 
-                       frm not in  seen):
-            seen.add(frm)
-            callback(frm)
+        if metrics is not None:
+            count_chunk(metrics, chunk, ts, valid)
+
+        hits = valid & np.isin(to, targets) & (args.time_init <= ts) & (ts < args.time_end)
+        if not hourly:
+            pairs = first_seen(pair_ids(to[hits], frm[hits]))
+            to_ids, frm_ids = unpair_ids(pairs)
+            for pair, to_id, frm_id in zip(pairs.tolist(), to_ids.tolist(), frm_ids.tolist()):
+                if pair not in seen:
+                    seen.add(pair)
+                    callback(hosts[frm_id], hosts[to_id])
+        else:
+            hours = ts // HOUR * HOUR
+            for hour in np.unique(hours[hits]).tolist():
+                in_hour = hits & (hours == hour)
+                pairs = first_seen(pair_ids(to[in_hour], frm[in_hour]))
+                to_ids, frm_ids = unpair_ids(pairs)
+                hour = int(hour)
+                for pair, to_id, frm_id in zip(pairs.tolist(), to_ids.tolist(), frm_ids.tolist()):
+                    if (hour, pair) not in seen:
+                        seen.add((hour, pair))
+                        callback(hosts[frm_id], hosts[to_id], hour)
+
+        if len(stop):
+            break
+
+    return latest_ts
+
+
+def count_chunk(metrics, chunk, ts, valid):
+    """ the metrics of a parsed chunk, or of the part of it used """
+    metrics.count('chunks')
+    metrics.count('bytes', len(chunk))
+    metrics.count('lines', np.count_nonzero(valid))
+    metrics.count('rejected_lines', len(valid) - np.count_nonzero(valid))
+    ts = ts[valid]
+    if len(ts):
+        # the latest timestamp read before each line, within the chunk
+        before = np.maximum.accumulate(np.concatenate(([ts[0]], ts[:-1])))
+        metrics.observe('line_lateness_seconds', np.maximum(before - ts, 0))
+
+
+def process_packed(pack, args, callback, metrics=None):
+    """
+    process_chunks over a packed log (see pack.PackFile), reading only
+    the blocks that overlap the time range, the way an index would
+    """
+    ids = {name: host_id for host_id, name in enumerate(pack.names)}
+    targets = np.array([ids[to] for to in args.to if to in ids], dtype=np.int32)
+    seen = set()
+    if not len(targets):
+        return
+
+    # like the scan of the log, stop at the first row at or past the
+    # range and its late lines: that's in the first block to get there,
+    # as the latest timestamp of every block before falls short of it
+    stop_ts = args.time_end + args.max_log_late_seconds
+    past = np.flatnonzero(to_seconds(pack.blocks['max_ts']) >= stop_ts)
+    last = past[0] if len(past) else len(pack.blocks)
+
+    for i in pack.blocks_between(args.time_init, args.time_end):
+        if i > last:
+            break
+        ts, frm, to = pack.block(i)
+        if i == last:
+            stop = np.flatnonzero(to_seconds(ts) >= stop_ts)[0]
+            ts, frm, to = ts[:stop], frm[:stop], to[:stop]
+        if metrics is not None:
+            metrics.count('pack_blocks')
+            metrics.count('lines', len(ts))
+        hits = np.flatnonzero(np.isin(to, targets))
+        # only the few rows that matter are turned into seconds
+        in_range = to_seconds(ts[hits])
+        hits = hits[(args.time_init <= in_range) & (in_range < args.time_end)]
+        pairs = first_seen(pair_ids(to[hits], frm[hits]))
+        to_ids, frm_ids = unpair_ids(pairs)
+        for pair, to_id, frm_id in zip(pairs.tolist(), to_ids.tolist(), frm_ids.tolist()):
+            if pair not in seen:
+                seen.add(pair)
+                callback(pack.names[frm_id], pack.names[to_id])
+
+
+def find_range(args):
+    """
+    The (start, end) byte range of args.file to scan, end being
+    None for end of file, or None if we have to scan it all
+    """
+    # the index sidecar, when there is one, knows exactly
+    # which bytes can hold the time range
+    index = None if args.noindex else load_index(args.file)
+    if index is not None:
+        start, end = index.range(args.time_init, args.time_end, args.max_log_late_seconds)
+        index.close()
+        logger.info(f"index says bytes {start} to {end}")
+        return start, end
+
+    if compression(args.file) is not None:
+        # without an index the only way through is from the start,
+        # stopping once past the range
+        logger.info(f"{args.file} is compressed, can't seek in it")
+        return None
+
+    if not args.nofastseek:
+        start, end = seek_range(args.file, args.time_init, args.time_end,
+                                args.max_log_late_seconds)
+        logger.info(f"seek says bytes {start} to {end}")
+        return start, end
+
+    return None
+
+
+def process_rollups(rollups, args, callback, metrics=None):
+    """
+    Answers the hours wholly in the time range from rollups (see
+    rollup.Rollups), scanning the log only for what's left, the partial
+    hours at either end and any hour not rolled up. Hosts come out
+    hour after hour, in the order first seen within each. The lines
+    too late for the scan of their hour alone, but that the scan of
+    the whole range reads, come from the rollups' late lines.
+    """
+    stop_ts = args.time_end + args.max_log_late_seconds
+    seen = set()
+    def report(frm, to):
+        if (to, frm) not in seen:
+            seen.add((to, frm))
+            callback(frm, to)
+
+    def scan_between(time_init, time_end):
+        if time_init < time_end:
+            part = copy.copy(args)
+            part.time_init, part.time_end = time_init, time_end
+            scan(part, report, metrics)
+
+    hours = rollups.within(args.time_init, args.time_end)
+    logger.info(f"{len(hours)} hours answered from rollups")
+    if metrics is not None:
+        metrics.count('rollup_hours', len(hours))
+    scanned_to = args.time_init
+    for hour in hours:
+        scan_between(scanned_to, hour)
+        for to in args.to:
+            for frm in rollups.get(hour).neighbors(to):
+                report(frm, to)
+        for frm, to in rollups.late_lines(scanned_to, hour + HOUR, stop_ts):
+            if to in args.to:
+                report(frm, to)
+        scanned_to = hour + HOUR
+    scan_between(scanned_to, args.time_end)
 
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        # the same queries, answered by a daemon, see connspy.serve
+        from connspy.serve import main as serve
+        serve(sys.argv[2:])
+        return
     args = parse_argv(sys.argv[1:])
     logger.info("opening " + args.file)
 
-    with open(args.file, 'r') as f:
-        if not args.nofastseek:
-            seek_just_before_index(args.file, f, args.time_init - args.max_log_late_seconds)
-        process_stream(f, args, lambda x: print (x))
+    # with more than one target, say which one each host connected to
+    sink = make_sink(args.output, len(args.to) > 1)
+    callback = sink.hit
+
+    metrics = None
+    if args.metrics:
+        metrics = Metrics()
+        reporter = Reporter(metrics, args.metrics)
+        printer = callback
+        def callback(frm, to):
+            metrics.count('hits')
+            printer(frm, to)
+
+    rollups = None if args.norollup else load_rollups(args.file, args.max_log_late_seconds)
+    if rollups is not None and rollups.within(args.time_init, args.time_end):
+        process_rollups(rollups, args, callback, metrics)
+        rollups.close()
+    else:
+        scan(args, callback, metrics)
+    sink.close()
+    if metrics is not None:
+        reporter.close()
+
+
+def scan(args, callback, metrics=None):
+    """
+    calls back with every (frm, to) of the time range, from the log
+    itself, counting what was read in metrics if given
+    """
+    if is_packed(args.file):
+        pack = PackFile(args.file)
+        process_packed(pack, args, callback, metrics)
+        pack.close()
+        return
+
+    byte_range = find_range(args)
+
+    if args.workers > 1:
+        from connspy.parallel import scan_parallel
+        scan_parallel(args, byte_range, callback, metrics)
+        return
+
+    start, end = byte_range if byte_range is not None else (0, None)
+    rejects = Rejects(args.quarantine)
+    rejects.start(args.file, start)
+    with open_log(args.file, start, end) as f:
+        if args.engine == 'batch':
+            process_chunks(read_chunks(f), args, callback, metrics, rejects)
+        else:
+            process_stream(read_lines(f), args, callback, metrics, rejects)
+    rejects.close()
 
 if __name__ == '__main__':
     logger.info("Called with: " + str(sys.argv))
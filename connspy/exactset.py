@@ -0,0 +1,165 @@
+import sys
+import heapq
+from tempfile import TemporaryFile
+
+import numpy as np
+
+DEFAULT_MAX_KEYS = 2 ** 20
+RUN_BLOCK = 2 ** 14     # ids read from each run at a time when merging
+
+
+class ExactIdSet:
+    """
+    An exact set of interned host ids (see hosts.HostTable), for when
+    BloomIdSet's tiny chance of missing a host is not acceptable, in
+    bounded memory nonetheless.
+
+    Up to max_keys ids are kept in memory, in the order added. Past
+    that, each is tagged with when it was first added, sorted and
+    written out to a temporary file as a run of packed 8 byte ints,
+    id then tag, and memory starts over empty. Iterating k-way merges
+    the runs and what's left in memory, keeping the first tag of every
+    id, then sorts those back by tag the same way, so each id comes
+    out once, in the order first added, like BloomIdSet.
+
+    Sets pickle, runs included, for checkpoints.
+    """
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.keys = {}          # id: None, in the order added
+        self.added = 0          # ids spilled so far, the tag of the first in memory
+        self.file = None
+        self.runs = []          # (offset, length) of every sorted run
+        self.closed = False
+
+    def add(self, key):
+        """
+        Returns False if key is known to be in already. With runs on
+        disk, True only means it's not among the ids in memory.
+        """
+        if self.closed:
+            raise Exception("Cannot add new element after attempting to read")
+        key = int(key)
+        if key in self.keys:
+            return False
+        self.keys[key] = None
+        if len(self.keys) >= self.max_keys:
+            self._spill()
+        return True
+
+    def add_many(self, keys):
+        if self.closed:
+            raise Exception("Cannot add new element after attempting to read")
+        keys = np.asarray(keys, dtype=np.int32).tolist()
+        room = self.max_keys - len(self.keys)
+        while keys:
+            self.keys.update(dict.fromkeys(keys[:room]))
+            keys = keys[room:]
+            if len(self.keys) >= self.max_keys:
+                self._spill()
+            room = self.max_keys - len(self.keys)
+
+    def _tagged(self):
+        """ the ids in memory, tagged, as id << 32 | tag, sorted """
+        ids = np.fromiter(self.keys, np.int64, len(self.keys))
+        run = (ids << 32) | np.arange(self.added, self.added + len(ids), dtype=np.int64)
+        run.sort()
+        return run
+
+    def _write_run(self, run):
+        if self.file is None:
+            self.file = TemporaryFile()
+        self.file.seek(0, 2)
+        self.runs.append((self.file.tell(), len(run)))
+        self.file.write(run.tobytes())
+
+    def _spill(self):
+        self._write_run(self._tagged())
+        self.added += len(self.keys)
+        self.keys = {}
+
+    def _run(self, offset, length):
+        # reads a run back a block at a time, the file being shared
+        # with the other runs it's merged with
+        for start in range(0, length, RUN_BLOCK):
+            self.file.seek(offset + start * 8)
+            n = min(RUN_BLOCK, length - start)
+            yield from np.frombuffer(self.file.read(n * 8), np.int64).tolist()
+
+    def __contains__(self, key):
+        key = int(key)
+        if key in self.keys:
+            return True
+        for offset, length in self.runs:
+            # binary search, straight off the file
+            lo, hi = 0, length
+            while lo < hi:
+                mid = (lo + hi) // 2
+                self.file.seek(offset + mid * 8)
+                value = int(np.frombuffer(self.file.read(8), np.int64)[0]) >> 32
+                if value == key:
+                    return True
+                if value < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return False
+
+    def nbytes(self):
+        """ memory held, roughly, runs on disk not included """
+        return sys.getsizeof(self.keys) + 28 * len(self.keys)
+
+    def __iter__(self):
+        self.closed = True
+        return self._merge()
+
+    def _merge(self):
+        if not self.runs:
+            yield from list(self.keys)
+            self.close()
+            return
+
+        runs = [self._run(offset, length) for offset, length in self.runs]
+        # from here on, runs of the first tag of every id, as tag << 32 | id
+        self.runs = []
+        batch, last = [], None
+        for value in heapq.merge(self._tagged().tolist(), *runs):
+            key = value >> 32
+            if key != last:
+                batch.append((value & 0xffffffff) << 32 | key)
+                last = key
+                if len(batch) >= self.max_keys:
+                    self._write_run(np.sort(np.array(batch, np.int64)))
+                    batch = []
+        runs = [self._run(offset, length) for offset, length in self.runs]
+        for value in heapq.merge(sorted(batch), *runs):
+            yield value & 0xffffffff
+        self.close()
+
+    def __getstate__(self):
+        if self.closed:
+            raise Exception("Cannot save a set that's being read")
+        runs = b""
+        if self.file is not None:
+            self.file.seek(0)
+            runs = self.file.read()
+        return {'max_keys': self.max_keys, 'runs': self.runs, 'spilled': runs,
+                'added': self.added, 'keys': np.fromiter(self.keys, np.int32, len(self.keys))}
+
+    def __setstate__(self, state):
+        self.max_keys = state['max_keys']
+        self.keys = dict.fromkeys(state['keys'].tolist())
+        self.added = state['added']
+        self.runs = state['runs']
+        self.file = None
+        if self.runs:
+            self.file = TemporaryFile()
+            self.file.write(state['spilled'])
+        self.closed = False
+
+    def close(self):
+        self.keys = {}
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,343 @@
+import os
+import sys
+import re
+import json
+import shutil
+import logging
+import argparse
+
+import numpy as np
+
+from connspy.hosts import HostTable, pair_ids, unpair_ids, read_host_file
+from connspy.parser import Parser, VALID_HOST_REGEX
+from connspy.pack import read_columns
+from connspy.rollup import HOUR
+from connspy.windows import parse_duration
+
+logger = logging.getLogger("graph")
+
+GRAPH_SUFFIX = ".graph"
+DIRECTIONS = ('in', 'out')
+
+
+def graph_path(path):
+    return path + GRAPH_SUFFIX
+
+
+def distinct(keys):
+    """ np.unique, sorted, by way of a plain sort which is a lot faster on int64 """
+    keys = np.sort(keys)
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+
+
+def build_graph(path, bucket_seconds=HOUR):
+    """
+    Writes the graph of the log at path (see Graph) to its graph
+    directory, every valid line an edge from its frm to its to host in
+    the bucket of its timestamp. Returns the number of distinct edges.
+    """
+    statinfo = os.stat(path)
+    hosts = HostTable()
+    # distinct (frm, to) pairs of each bucket, deduplicated a chunk at a time
+    buckets = {}
+    for ts, frm, to in read_columns(path, hosts):
+        if not len(ts):
+            continue
+        starts = np.floor_divide(ts, bucket_seconds).astype(np.int64)
+        pairs = pair_ids(frm, to)
+        for bucket in np.unique(starts).tolist():
+            buckets.setdefault(bucket, []).append(distinct(pairs[starts == bucket]))
+
+    first = min(buckets, default=0)
+    edges = [(np.full(len(pairs), bucket - first, np.int32), pairs) for bucket, pairs in
+             ((bucket, distinct(np.concatenate(parts))) for bucket, parts in buckets.items())]
+    bucket = np.concatenate([b for b, _ in edges] or [np.empty(0, np.int32)])
+    frm, to = unpair_ids(np.concatenate([p for _, p in edges] or [np.empty(0, np.int64)]))
+
+    out = graph_path(path)
+    tmp = out + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    n_hosts = len(hosts)
+    for direction, src, dst in (('out', frm, to), ('in', to, frm)):
+        # by host, then bucket, so a host's edges are one slice
+        order = np.lexsort((dst, bucket, src))
+        indptr = np.zeros(n_hosts + 1, np.int64)
+        np.cumsum(np.bincount(src, minlength=n_hosts), out=indptr[1:])
+        np.save(os.path.join(tmp, f"{direction}_indptr.npy"), indptr)
+        np.save(os.path.join(tmp, f"{direction}_hosts.npy"), dst[order])
+        np.save(os.path.join(tmp, f"{direction}_buckets.npy"), bucket[order])
+    names = np.array([name.encode() for name in hosts.names], dtype=bytes)
+    np.save(os.path.join(tmp, "names.npy"), names)
+    # and sorted, with their ids, to look names up by
+    order = np.argsort(names, kind='stable').astype(np.int32)
+    np.save(os.path.join(tmp, "sorted_names.npy"), names[order])
+    np.save(os.path.join(tmp, "sorted_ids.npy"), order)
+    with open(os.path.join(tmp, "meta.json"), 'w') as f:
+        json.dump({'inode': statinfo.st_ino, 'size': statinfo.st_size,
+                   'bucket_seconds': bucket_seconds, 'first': first * bucket_seconds,
+                   'buckets': (max(buckets) - first + 1) if buckets else 0}, f)
+
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    logger.info(f"{len(bucket)} edges between {n_hosts} hosts in {len(buckets)} buckets")
+    return len(bucket)
+
+
+def _lower_bound(column, lo, hi, value):
+    """
+    For each slice [lo, hi) of column, sorted within, where value would
+    go in it: np.searchsorted over all the slices at once
+    """
+    lo, hi = lo.copy(), hi.copy()
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        below = np.zeros(len(lo), bool)
+        below[active] = column[mid[active]] < value
+        lo = np.where(below, mid + 1, lo)
+        hi = np.where(active & ~below, mid, hi)
+
+
+class Graph:
+    """
+    Who connected to who, as compressed sparse rows over host ids, once
+    for each direction: in_indptr[h] to in_indptr[h + 1] is the slice
+    of in_hosts and in_buckets listing the hosts that connected to h,
+    each with the time bucket it did, out_* the hosts h connected to.
+    An edge is there once per bucket it was seen in, and a host's edges
+    are sorted by bucket, so a time range is a binary search into each
+    slice. Host names are kept sorted as well, to look up ids by.
+    Everything is memory mapped .npy files, so opening one costs next
+    to nothing and a query only touches the slices of the hosts it
+    goes through.
+
+    Time ranges are answered in whole buckets, those that overlap it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        def load(name):
+            # plain arrays onto the map, memmap's own indexing being slow
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r').view(np.ndarray)
+        self.names = load("names")
+        self.sorted_names, self.sorted_ids = load("sorted_names"), load("sorted_ids")
+        self.csr = {direction: (load(f"{direction}_indptr"), load(f"{direction}_hosts"),
+                                load(f"{direction}_buckets"))
+                    for direction in DIRECTIONS}
+
+    def ids(self, names):
+        """ the ids of those of names in the graph """
+        wanted = np.array([name.encode() for name in names], dtype=bytes)
+        if not len(wanted) or not len(self.sorted_names):
+            return np.empty(0, np.int32)
+        at = np.minimum(np.searchsorted(self.sorted_names, wanted), len(self.sorted_names) - 1)
+        found = self.sorted_names[at] == wanted
+        return distinct(self.sorted_ids[at[found]]).astype(np.int32)
+
+    def name(self, host_id):
+        return self.names[host_id].decode()
+
+    def buckets(self, time_init, time_end):
+        """ [first, end) the buckets overlapping [time_init, time_end) """
+        size, first = self.meta['bucket_seconds'], self.meta['first']
+        start = int(np.floor((time_init - first) / size))
+        end = int(np.ceil((time_end - first) / size))
+        return max(start, 0), min(max(end, 0), self.meta['buckets'])
+
+    def _edges(self, ids, direction, buckets):
+        """ indices of the edges of ids in direction within buckets """
+        indptr, _, bucket = self.csr[direction]
+        ids = np.asarray(ids, dtype=np.int64)
+        starts, ends = indptr[ids], indptr[ids + 1]
+        # each slice is sorted by bucket, so only the edges within
+        # buckets are ever read
+        starts = _lower_bound(bucket, starts, ends, buckets[0])
+        lengths = _lower_bound(bucket, starts, ends, buckets[1]) - starts
+        # the slices of all of ids at once, one arange with each
+        # slice's start added on
+        return (np.arange(lengths.sum(), dtype=np.int64) +
+                np.repeat(starts - np.cumsum(lengths) + lengths, lengths))
+
+    def neighbors(self, ids, direction, buckets):
+        """ the distinct hosts connected to (in) or from (out) any of ids """
+        return distinct(self.csr[direction][1][self._edges(ids, direction, buckets)])
+
+    def reach(self, ids, hops, direction, time_init, time_end):
+        """
+        (ids, hops): the hosts that reach any of ids (in), or that they
+        reach (out), in at most hops connections within the time range,
+        and how many hops away each is, breadth first. ids themselves
+        are left out, unless reached through some cycle they aren't.
+        """
+        buckets = self.buckets(time_init, time_end)
+        # sorted, as big as what was reached rather than the whole graph
+        seen = distinct(np.asarray(ids, dtype=np.int32))
+        frontier = seen
+        found, found_hops = [], []
+        for hop in range(1, hops + 1):
+            if not len(frontier):
+                break
+            frontier = self.neighbors(frontier, direction, buckets)
+            frontier = frontier[~np.isin(frontier, seen, assume_unique=True)]
+            seen = np.sort(np.concatenate((seen, frontier)))
+            found.append(frontier)
+            found_hops.append(np.full(len(frontier), hop, np.int16))
+        if not found:
+            return np.empty(0, np.int32), np.empty(0, np.int16)
+        return np.concatenate(found), np.concatenate(found_hops)
+
+    def fan(self, ids, time_init, time_end):
+        """ (fan in, fan out), the distinct hosts each of ids connected from and to """
+        buckets = self.buckets(time_init, time_end)
+        return tuple(np.array([len(self.neighbors([host_id], direction, buckets))
+                               for host_id in ids], dtype=np.int64)
+                     for direction in DIRECTIONS)
+
+    def top(self, n, direction, time_init, time_end):
+        """ (ids, counts) of the n hosts with the largest fan in (or out) """
+        first, end = self.buckets(time_init, time_end)
+        indptr, hosts, bucket = self.csr[direction]
+        owners = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+        in_range = (bucket >= first) & (bucket < end)
+        owner, _ = unpair_ids(distinct(pair_ids(owners[in_range], hosts[in_range])))
+        counts = np.bincount(owner, minlength=len(self.names))
+        ids = np.argsort(-counts, kind='stable')[:n]
+        ids = ids[counts[ids] > 0]
+        return ids, counts[ids]
+
+
+def load_graph(path):
+    """ the Graph of the log at path, None if it has none or it's of an older log """
+    out = graph_path(path)
+    if not os.path.isdir(out):
+        return None
+    if not os.path.exists(os.path.join(out, "sorted_names.npy")):
+        logger.info(f"{out} was built by an older connspy-graph, ignoring it")
+        return None
+    graph = Graph(out)
+    statinfo = os.stat(path)
+    if statinfo.st_ino != graph.meta['inode'] or statinfo.st_size < graph.meta['size']:
+        logger.info(f"{out} is of an older {path}, ignoring it")
+        return None
+    if statinfo.st_size > graph.meta['size']:
+        logger.warning(f"{path} grew since {out} was built, the lines since are left out")
+    return graph
+
+
+def parse_argv(argv):
+    args_parser = argparse.ArgumentParser(description=""
+            "connspy-graph: build a graph of who connected to who, bucketed "
+            "by time, and answer multi-hop questions from it")
+    commands = args_parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='build the graph of logs, next to each')
+    build.add_argument('--bucket', type=str, default='1h',
+            help='the time buckets edges are kept by, the finest a query '
+                 'can ask for, say 5m, 1h or 1d')
+    build.add_argument('files', type=str, nargs='+',
+            help='the log files to build the graph of')
+
+    query = commands.add_parser('query', help='ask the graph of a log')
+    query.add_argument('--to', type=str, action='append', default=[],
+            help='the hosts that connected to this host, or, with --hops, '
+                 'to any host that did and so on. Can be given several times')
+    query.add_argument('--from', type=str, dest='frm', action='append', default=[],
+            help='the hosts this host connected to, and so on with --hops. '
+                 'Can be given several times')
+    query.add_argument('--to_file', type=str, required=False,
+            help='a file listing more --to hosts, one per line')
+    query.add_argument('--hops', type=int, default=1,
+            help='how many connections away to go from --to and --from hosts')
+    query.add_argument('--fan', type=str, action='append', default=[],
+            help='how many distinct hosts this host connected from and to. '
+                 'Can be given several times')
+    query.add_argument('--top', type=int, default=0,
+            help='the hosts with the most distinct hosts connecting to them, '
+                 'and connected to, this many of each')
+    query.add_argument('--time_init', type=str, required=True,
+            help='the earliest time stamp to consider, rounded down to a bucket')
+    query.add_argument('--time_end', type=str, required=True,
+            help='the end of the time range, noninclusive, rounded up to a bucket')
+    query.add_argument('file', type=str,
+            help='the log whose graph to ask, built by connspy-graph build')
+
+    args = args_parser.parse_args(argv)
+    if args.command == 'build':
+        args.bucket = parse_duration(args.bucket)
+        return args
+
+    if args.to_file:
+        args.to.extend(read_host_file(args.to_file))
+    for option in ('to', 'frm', 'fan'):
+        hosts = list(dict.fromkeys(host.lower() for host in getattr(args, option)))
+        for host in hosts:
+            if not re.match(VALID_HOST_REGEX, host):
+                raise Exception(f"invalid host {host} . Must match " + VALID_HOST_REGEX)
+        setattr(args, option, hosts)
+    if not (args.to or args.frm or args.fan or args.top):
+        raise Exception("nothing asked, give --to, --from, --fan or --top")
+    if args.hops < 1:
+        raise Exception("hops must be at least 1")
+    if args.top < 0:
+        raise Exception("top can't be negative")
+    args.time_init = Parser.parse_ts(args.time_init)
+    if not args.time_init:
+        raise Exception("time_init invalid")
+    args.time_end = Parser.parse_ts(args.time_end)
+    if not args.time_end:
+        raise Exception("time_end invalid")
+    if args.time_end < args.time_init:
+        raise Exception("time_end is before time_init")
+    return args
+
+
+def query(graph, args):
+    """
+    The lines answering args: TO or FROM, hops away, host for what --to
+    and --from hosts reach; FAN, host, fan in, fan out for --fan hosts;
+    FAN_IN or FAN_OUT, host, count for the --top hosts
+    """
+    lines = []
+    for kind, direction, hosts in (("TO", 'in', args.to), ("FROM", 'out', args.frm)):
+        if hosts:
+            ids, hops = graph.reach(graph.ids(hosts), args.hops, direction,
+                                    args.time_init, args.time_end)
+            lines.extend(f"{kind}\t{hop}\t{graph.name(host_id)}"
+                         for host_id, hop in zip(ids.tolist(), hops.tolist()))
+    if args.fan:
+        known = {graph.name(host_id): host_id for host_id in graph.ids(args.fan).tolist()}
+        ids = [known[host] for host in args.fan if host in known]
+        fan_in, fan_out = graph.fan(ids, args.time_init, args.time_end)
+        lines.extend(f"FAN\t{graph.name(host_id)}\t{i}\t{o}"
+                     for host_id, i, o in zip(ids, fan_in.tolist(), fan_out.tolist()))
+    if args.top:
+        for kind, direction in (("FAN_IN", 'in'), ("FAN_OUT", 'out')):
+            ids, counts = graph.top(args.top, direction, args.time_init, args.time_end)
+            lines.extend(f"{kind}\t{graph.name(host_id)}\t{count}"
+                         for host_id, count in zip(ids.tolist(), counts.tolist()))
+    return lines
+
+
+def main():
+    args = parse_argv(sys.argv[1:])
+    if args.command == 'build':
+        for path in args.files:
+            logger.info("building the graph of " + path)
+            build_graph(path, args.bucket)
+        return
+
+    graph = load_graph(args.file)
+    if graph is None:
+        raise Exception(f"{args.file} has no graph, run connspy-graph build first")
+    lines = query(graph, args)
+    if lines:
+        print("\n".join(lines))
+
+
+if __name__ == '__main__':
+    main()
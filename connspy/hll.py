@@ -0,0 +1,126 @@
+import numpy as np
+
+# 2 ** 6 registers a host, estimates within about 13%
+DEFAULT_PRECISION = 6
+# 2 ** -rank for every rank a register can hold
+_POWERS = np.exp2(-np.arange(256, dtype=np.float64))
+
+
+class HostHLL:
+    """
+    HyperLogLog sketches of the distinct peers of every host, in a
+    single array of registers shared by all of them: each host seen
+    gets a row of 2 ** precision registers, one byte each, so memory is
+    fixed per host however many peers it has. Only the hosts seen here
+    get a row, in the order they come, so a window's sketch is as big
+    as the hosts in that window, not the whole host table.
+
+    Peers go in as 64 bit hashes of their names (see
+    bloomset.hash_strings), not their ids, so that sketches made in
+    other processes, with other host ids, merge (see relabel).
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros((0, 1 << precision), np.uint8)
+        # the host id of every row, and the rows sorted by host id to look them up
+        self.ids = np.empty(0, np.int32)
+        self.sorted_ids = np.empty(0, np.int32)
+        self.sorted_rows = np.empty(0, np.int32)
+
+    def _grow(self, rows):
+        if rows > len(self.registers):
+            # doubling, so a steady trickle of new hosts isn't quadratic
+            grown = np.zeros((max(rows, 2 * len(self.registers)), self.registers.shape[1]),
+                             np.uint8)
+            grown[:len(self.registers)] = self.registers
+            self.registers = grown
+
+    def _find(self, ids):
+        """ the row of every host id in ids, -1 where it has none """
+        at = np.searchsorted(self.sorted_ids, ids)
+        rows = np.full(len(ids), -1, np.int64)
+        inside = at < len(self.sorted_ids)
+        found = inside.copy()
+        found[inside] = self.sorted_ids[at[inside]] == ids[inside]
+        rows[found] = self.sorted_rows[at[found]]
+        return rows
+
+    def _rows(self, ids):
+        """ the row of every host id in ids, adding rows for the new ones """
+        rows = self._find(ids)
+        missing = rows < 0
+        if missing.any():
+            new = np.unique(ids[missing]).astype(np.int32)
+            first = len(self.ids)
+            self._grow(first + len(new))
+            self.ids = np.concatenate((self.ids, new))
+            at = np.searchsorted(self.sorted_ids, new)
+            self.sorted_ids = np.insert(self.sorted_ids, at, new)
+            self.sorted_rows = np.insert(self.sorted_rows, at,
+                                         np.arange(first, first + len(new), dtype=np.int32))
+            rows[missing] = self._find(ids[missing])
+        return rows
+
+    def add(self, owners, peer_hashes):
+        """ counts each peer, by the hash of its name, for its owner host id """
+        if not len(owners):
+            return
+        rows = self._rows(owners)
+        p = self.precision
+        register = (peer_hashes & np.uint64((1 << p) - 1)).astype(np.int64)
+        # the rank of the first set bit in what's left of the hash,
+        # through the exponent of it as a float
+        rest = (peer_hashes >> np.uint64(p)).astype(np.float64)
+        rank = (64 - p + 1 - np.frexp(rest)[1]).astype(np.uint8)
+        np.maximum.at(self.registers.reshape(-1), rows * (1 << p) + register, rank)
+
+    def _estimates(self):
+        """ the estimated number of distinct peers of every row """
+        m = self.registers.shape[1]
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        registers = self.registers[:len(self.ids)]
+        raw = alpha * m * m / _POWERS[registers].sum(axis=1)
+        # few peers: count the registers still empty instead
+        zeros = (registers == 0).sum(axis=1)
+        small = (raw <= 2.5 * m) & (zeros > 0)
+        raw[small] = m * np.log(m / zeros[small])
+        return raw
+
+    def estimates(self):
+        """ the estimated number of distinct peers of every host id, by id """
+        out = np.zeros(int(self.ids.max()) + 1 if len(self.ids) else 0)
+        out[self.ids] = self._estimates()
+        return out
+
+    def top(self, n):
+        """ [(host id, estimate)] of the n hosts with the most peers """
+        estimates = self._estimates()
+        # the lowest host id first among equals
+        rows = np.lexsort((self.ids, -estimates))[:n]
+        return list(zip(self.ids[rows].tolist(),
+                        np.rint(estimates[rows]).astype(np.int64).tolist()))
+
+    def merge(self, other):
+        """ adds the peers of the sketch other, of the same host ids and precision """
+        if other.precision != self.precision:
+            raise Exception("cannot merge sketches of different precisions")
+        if not len(other.ids):
+            return
+        rows = self._rows(other.ids)
+        np.maximum.at(self.registers, rows, other.registers[:len(other.ids)])
+
+    def relabel(self, lut):
+        """ a copy with host id h as lut[h], for merging with sketches of another host table """
+        out = HostHLL(self.precision)
+        if len(self.ids):
+            rows = out._rows(lut[self.ids])
+            np.maximum.at(out.registers, rows, self.registers[:len(self.ids)])
+        return out
+
+    def nbytes(self):
+        return (self.registers.nbytes + self.ids.nbytes + self.sorted_ids.nbytes +
+                self.sorted_rows.nbytes)
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,108 @@
+import numpy as np
+
+MAX_HOSTS = 2 ** 31 - 1     # ids have to fit an int32
+
+
+class HostTable:
+    """
+    Interns host names into int32 ids so each name is stored once,
+    no matter how many hours, sets or counters refer to it.
+    Everything downstream of the parser works on ids and only
+    turns them back into names when writing output.
+
+    ids:   host -> id
+    names: id -> host, the reverse array
+    """
+
+    def __init__(self):
+        self.ids   = {}
+        self.names = []
+
+    def intern(self, host):
+        host_id = self.ids.get(host)
+        if host_id is None:
+            host_id = len(self.names)
+            if host_id >= MAX_HOSTS:
+                raise Exception("Too many distinct hosts for int32 ids")
+            self.ids[host] = host_id
+            self.names.append(host)
+        return host_id
+
+    def get(self, host, default=None):
+        return self.ids.get(host, default)
+
+    def view(self, ids):
+        """ lazily presents a collection of ids as host names """
+        return HostView(self, ids)
+
+    def targets_view(self, sets):
+        """ same for a {target id: collection of ids} dict """
+        return TargetView(self, sets)
+
+    def __getitem__(self, host_id):
+        return self.names[host_id]
+
+    def __contains__(self, host):
+        return host in self.ids
+
+    def __len__(self):
+        return len(self.names)
+
+
+class HostView:
+    """
+    Iterates over a collection of host ids, yielding host names.
+    The names are only looked up as they are iterated.
+    """
+
+    def __init__(self, table, ids):
+        self.table = table
+        self.ids = ids
+
+    def __iter__(self):
+        names = self.table.names
+        for host_id in self.ids:
+            yield names[host_id]
+
+
+class TargetView:
+    """
+    Results kept per target host, {target id: collection of host ids},
+    seen through names. Iterating yields the host names of every
+    target in turn, items() pairs each target name with a HostView.
+    """
+
+    def __init__(self, table, sets):
+        self.table = table
+        self.sets = sets
+
+    def __iter__(self):
+        for ids in self.sets.values():
+            yield from HostView(self.table, ids)
+
+    def items(self):
+        for target, ids in self.sets.items():
+            yield self.table[target], HostView(self.table, ids)
+
+
+def pair_ids(a, b):
+    """ packs two arrays of host ids into one int64 key per pair """
+    return (a.astype(np.int64) << 32) | b.astype(np.int64)
+
+
+def unpair_ids(keys):
+    """ the inverse of pair_ids """
+    return (keys >> 32).astype(np.int32), (keys & 0xffffffff).astype(np.int32)
+
+
+def read_host_file(path):
+    """
+    Reads a list of hosts, whitespace separated, typically one per
+    line. Anything after a # on a line is ignored.
+    """
+    hosts = []
+    with open(path, 'r') as f:
+        for line in f:
+            hosts.extend(line.split('#', 1)[0].lower().split())
+    return hosts
+
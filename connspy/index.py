@@ -0,0 +1,318 @@
+import sys
+import os
+import mmap
+import zlib
+import struct
+import logging
+import argparse
+
+import numpy as np
+
+from connspy.parser import BatchParser, read_chunks, CHUNK_SIZE
+from connspy.compressed import (compression, is_block_compressed, compress_block,
+                                read_blocks)
+
+logger = logging.getLogger("index")
+
+INDEX_SUFFIX = ".idx"
+MAGIC = b"CSPYIDX2"
+# magic, inode of the log, bytes of the log covered, number of blocks,
+# the every_bytes / every_lines the index was built with, and the crc32
+# of the first and of the last CHECKED_BYTES of the log covered
+HEADER = struct.Struct("<8sQQQQQII")
+CHECKED_BYTES = 4096
+# every block is a byte offset and the min / max timestamp of its lines
+BLOCK = np.dtype([('offset', '<u8'), ('min_ts', '<f8'), ('max_ts', '<f8')])
+
+DEFAULT_EVERY_BYTES = 2 ** 20
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+class SparseIndex:
+    """
+    A memory mapped timestamp index sidecar of a log file.
+
+    The log is cut into blocks of whole lines, every so many bytes
+    or lines, and for each block we keep where it starts and the
+    smallest and largest timestamp in it. That's enough to find,
+    despite out of order lines, the byte range that holds every
+    line of a time range.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.inode, self.size, n, self.every_bytes, self.every_lines,
+            self.head_crc, self.tail_crc) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise Exception(f"{path} is not a connspy index")
+        self.blocks = np.frombuffer(self.mm, BLOCK, n, HEADER.size)
+
+    def range(self, time_init, time_end, max_log_late_seconds=0):
+        """
+        Returns (start, end) byte offsets so that every line with a
+        timestamp in [time_init, time_end) is within them, short of
+        those after a line at or past time_end + max_log_late_seconds,
+        where a scan stops (see connspy.process_chunks), as seek_range
+        does. end is None when the range runs up to the end of the file.
+        """
+        blocks = self.blocks
+        if len(blocks) == 0:
+            return 0, None
+
+        # largest timestamp of everything before each block, and
+        # smallest of everything from it onwards
+        before = np.empty(len(blocks))
+        before[0] = -np.inf
+        np.maximum.accumulate(blocks['max_ts'][:-1], out=before[1:])
+        after = np.minimum.accumulate(blocks['min_ts'][::-1])[::-1]
+
+        # the last block with nothing at or after time_init before it
+        i = max(np.searchsorted(before, time_init, side='left') - 1, 0)
+        # the first block with nothing before time_end from it onwards,
+        # or with a line past the cutoff before it, whichever is first
+        j = min(np.searchsorted(after, time_end, side='left'),
+                np.searchsorted(before, time_end + max_log_late_seconds, side='left'))
+
+        start = int(blocks['offset'][i])
+        end = int(blocks['offset'][j]) if j < len(blocks) else None
+        return start, end
+
+    def close(self):
+        self.blocks = None
+        try:
+            self.mm.close()
+        except BufferError:
+            pass        # someone still holds a view, the gc will do it
+
+
+def _index_blocks(f, offset, every_bytes, every_lines):
+    """
+    Reads f from offset and returns its blocks, along with
+    the offset right after the last whole line read
+    """
+    parser = BatchParser()
+    chunk_size = CHUNK_SIZE if every_lines else every_bytes
+    blocks = []
+    block_start, block_lines = offset, 0
+    block_min, block_max = np.inf, -np.inf
+
+    for chunk in read_chunks(f, chunk_size):
+        # never index a line that is still being written
+        chunk = chunk[:chunk.rfind(b"\n") + 1]
+        if not chunk:
+            break
+
+        ts, frm, to, valid = parser.parse(chunk)
+        ts = np.where(valid, ts, np.nan)
+        line_ends = np.flatnonzero(np.frombuffer(chunk, np.uint8) == 10) + 1
+
+        # lines at which blocks end in this chunk
+        if every_lines:
+            cuts = list(range(every_lines - block_lines, len(line_ends) + 1, every_lines))
+        else:
+            cuts = [len(line_ends)]
+        if not cuts or cuts[-1] != len(line_ends):
+            cuts.append(None)       # the rest carries over to the next chunk
+
+        prev = 0
+        for cut in cuts:
+            stop = len(line_ends) if cut is None else cut
+            if stop > prev:
+                block_min = min(block_min, np.nanmin(ts[prev:stop], initial=np.inf))
+                block_max = max(block_max, np.nanmax(ts[prev:stop], initial=-np.inf))
+                block_lines += stop - prev
+                prev = stop
+            if cut is not None and block_lines:
+                blocks.append((block_start, block_min, block_max))
+                block_start = offset + int(line_ends[cut - 1])
+                block_lines = 0
+                block_min, block_max = np.inf, -np.inf
+
+        offset += len(chunk)
+
+    if block_lines:
+        blocks.append((block_start, block_min, block_max))
+    return np.array(blocks, dtype=BLOCK), offset
+
+
+def _index_compressed(f, offset):
+    """
+    _index_blocks for a block compressed log, a block of the index
+    for every compressed block, its offset being in the compressed file
+    """
+    parser = BatchParser()
+    blocks = []
+    for start, data in read_blocks(f, offset):
+        ts, frm, to, valid = parser.parse(data)
+        ts = ts[valid]
+        blocks.append((start, ts.min(initial=np.inf), ts.max(initial=-np.inf)))
+        offset = f.tell()
+    return np.array(blocks, dtype=BLOCK), offset
+
+
+def _index_file(path, f, offset, every_bytes, every_lines):
+    if compression(path) is None:
+        return _index_blocks(f, offset, every_bytes, every_lines)
+    if not is_block_compressed(path):
+        raise Exception(f"{path} is compressed as one stream, so it can't be indexed. "
+                        "connspy-index --compress writes a block compressed copy that can")
+    return _index_compressed(f, offset)
+
+
+def checksums(log, size):
+    """
+    crc32 of the first and of the last CHECKED_BYTES of the first size
+    bytes of the open log, to tell it from another written over it
+    """
+    log.seek(0)
+    head = zlib.crc32(log.read(min(size, CHECKED_BYTES)))
+    log.seek(max(size - CHECKED_BYTES, 0))
+    tail = zlib.crc32(log.read(min(size, CHECKED_BYTES)))
+    return head, tail
+
+
+def _write_header(f, log, inode, size, n, every_bytes, every_lines):
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, inode, size, n, every_bytes, every_lines or 0,
+                        *checksums(log, size)))
+
+
+def build_index(path, every_bytes=DEFAULT_EVERY_BYTES, every_lines=None):
+    """
+    Writes a fresh index sidecar next to the log at path,
+    a block every every_bytes bytes, or every_lines lines if given.
+    """
+    out = index_path(path)
+    tmp = out + ".tmp"
+    with open(path, 'rb') as f, open(tmp, 'wb') as idx:
+        inode = os.fstat(f.fileno()).st_ino
+        blocks, size = _index_file(path, f, 0, every_bytes, every_lines)
+        _write_header(idx, f, inode, size, len(blocks), every_bytes, every_lines)
+        idx.write(blocks.tobytes())
+
+    os.replace(tmp, out)    # so nobody ever sees half an index
+    return SparseIndex(out)
+
+
+def compress_log(path, out=None, every_bytes=DEFAULT_EVERY_BYTES):
+    """
+    Writes a block compressed copy of the log at path to out (path.gz by
+    default), every_bytes of whole lines to a block, and its index.
+    Any gzip reader can read it back, but block by block it can also be
+    read from the middle, which the index says where.
+    """
+    out = path + ".gz" if out is None else out
+    tmp = out + ".tmp"
+    with open(path, 'rb') as f, open(tmp, 'wb') as gz:
+        for chunk in read_chunks(f, every_bytes):
+            gz.write(compress_block(chunk))
+    os.replace(tmp, out)
+    return build_index(out, every_bytes)
+
+
+def extend_index(path, index):
+    """
+    Indexes whatever was appended to the log since index was written.
+    Returns the updated index.
+    """
+    out = index.path
+    inode, start, n = index.inode, index.size, len(index.blocks)
+    every_bytes, every_lines = index.every_bytes, index.every_lines
+    index.close()
+
+    with open(path, 'rb') as f, open(out, 'r+b') as idx:
+        f.seek(start)
+        blocks, size = _index_file(path, f, start, every_bytes, every_lines)
+        idx.seek(HEADER.size + n * BLOCK.itemsize)
+        idx.write(blocks.tobytes())
+        idx.truncate()
+        # blocks first, header last, so a crash leaves the old index intact
+        idx.flush()
+        _write_header(idx, f, inode, size, n + len(blocks), every_bytes, every_lines)
+
+    return SparseIndex(out)
+
+
+def load_index(path, update=True):
+    """
+    Returns the SparseIndex of the log at path, None if it has none or
+    if it's of a different, truncated or rewritten file, or an older
+    format. With update, the index is first extended to cover anything
+    appended to the log.
+    """
+    out = index_path(path)
+    if not os.path.exists(out):
+        return None
+    with open(out, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            logger.info(f"{out} is of an older connspy-index, ignoring it")
+            return None
+
+    index = SparseIndex(out)
+    statinfo = os.stat(path)
+    stale = statinfo.st_ino != index.inode or statinfo.st_size < index.size
+    if not stale:
+        # rewritten in place, the inode stays the same
+        with open(path, 'rb') as log:
+            stale = checksums(log, index.size) != (index.head_crc, index.tail_crc)
+    if stale:
+        logger.info(f"{out} is out of date, ignoring it")
+        index.close()
+        return None
+
+    if update and statinfo.st_size > index.size:
+        try:
+            index = extend_index(path, index)
+        except OSError as e:
+            logger.info(f"could not extend {out}: {e}")
+            return None
+    return index
+
+
+def parse_argv(argv):
+    args_parser = argparse.ArgumentParser(description=""
+            "connspy-index: write timestamp index sidecars so connspy can "
+            "jump straight to the lines it needs")
+    args_parser.add_argument('--every_bytes', type=int, required=False,
+            default=DEFAULT_EVERY_BYTES,
+            help='start a new index block every this many bytes')
+    args_parser.add_argument('--every_lines', type=int, required=False,
+            default=None,
+            help='start a new index block every this many lines instead')
+    args_parser.add_argument('--rebuild', action='store_true', default=False,
+            help='rebuild the index even if an up to date one exists')
+    args_parser.add_argument('--compress', action='store_true', default=False,
+            help='instead write a block gzipped copy of each log, FILE.gz, '
+                 'a block every --every_bytes, and index that')
+    args_parser.add_argument('files', type=str, nargs='+',
+            help='the log files to index')
+    args = args_parser.parse_args(argv)
+
+    if args.every_bytes <= 0:
+        raise Exception("every_bytes must be positive")
+    if args.every_lines is not None and args.every_lines <= 0:
+        raise Exception("every_lines must be positive")
+    return args
+
+
+def main():
+    args = parse_argv(sys.argv[1:])
+    for path in args.files:
+        if args.compress:
+            logger.info("compressing " + path)
+            compress_log(path, every_bytes=args.every_bytes).close()
+            continue
+        index = None if args.rebuild else load_index(path)
+        if index is None:
+            logger.info("indexing " + path)
+            index = build_index(path, args.every_bytes, args.every_lines)
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import heapq
+
+import numpy as np
+
+
+def merge_columns(sources):
+    """
+    Merges sources, each an iterator of (ts, frm, to) column batches
+    from a log in about timestamp order, into batches in timestamp
+    order, whatever the overlap between the logs.
+
+    The source read next is always the one furthest behind, the one
+    whose latest timestamp is the smallest, kept on top of a heap. No
+    source can have anything before that timestamp still to come but
+    its late lines, so every row at or before it, from any source, is
+    sorted and yielded. What's held back is only the rows of each
+    source past that, about a batch a source, whatever the size of
+    the logs. Late lines stay no later than they were in their own log.
+    """
+    latest = [-np.inf] * len(sources)
+    pending = [None] * len(sources)     # rows not yielded yet
+    earliest = [np.inf] * len(sources)  # and the earliest of them
+    heap = [(-np.inf, i) for i in range(len(sources))]
+
+    while heap:
+        _, i = heapq.heappop(heap)
+        batch = next(sources[i], None)
+        if batch is not None:
+            if len(batch[0]):
+                latest[i] = max(latest[i], float(batch[0].max()))
+                earliest[i] = min(earliest[i], float(batch[0].min()))
+                pending[i] = batch if pending[i] is None else tuple(
+                        np.concatenate(pair) for pair in zip(pending[i], batch))
+            heapq.heappush(heap, (latest[i], i))
+        # once a source is done, it's not holding anyone back
+        watermark = heap[0][0] if heap else np.inf
+
+        ready = []
+        for j, rows in enumerate(pending):
+            if rows is None or earliest[j] > watermark:
+                continue
+            ts, frm, to = rows
+            out = ts <= watermark
+            ready.append((ts[out], frm[out], to[out]))
+            if out.all():
+                pending[j], earliest[j] = None, np.inf
+            else:
+                keep = ~out
+                pending[j] = (ts[keep], frm[keep], to[keep])
+                earliest[j] = float(pending[j][0].min())
+
+        if ready:
+            ts, frm, to = (np.concatenate(column) for column in zip(*ready))
+            # stable, so rows of the same second keep their order
+            order = np.argsort(ts, kind='stable')
+            yield ts[order], frm[order], to[order]
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+logger = logging.getLogger("metrics")
+
+PREFIX = "connspy_"
+DEFAULT_EVERY_SECONDS = 10
+
+COUNTERS = {
+    'lines': 'valid log lines processed',
+    'rejected_lines': 'malformed log lines skipped',
+    'bytes': 'bytes of log lines parsed',
+    'chunks': 'chunks of lines parsed',
+    'windows_emitted': 'windows output',
+    'hits': 'hosts output',
+    'pack_blocks': 'blocks of packed logs read',
+    'rollup_hours': 'hours answered from rollups',
+}
+
+GAUGES = {
+    'elapsed_seconds': 'seconds since the start',
+    'lines_per_second': 'valid lines processed per second since the last report',
+    'latest_timestamp_seconds': 'latest log timestamp read',
+    'ingest_lag_seconds': 'seconds between now and the latest log timestamp read',
+    'tail_backlog_bytes': 'bytes written to the followed logs not read yet',
+    'open_windows': 'windows not output yet',
+    'hosts': 'distinct hosts seen',
+    'bloom_fill_ratio': 'fraction of bits set in the fullest Bloom filter of the open windows',
+    'window_bytes': 'approximate memory held by each open window',
+}
+
+# the label gauges set to a dict are by
+LABELS = {'window_bytes': 'window'}
+
+# upper bounds of the buckets, Prometheus style, +Inf being implied
+HISTOGRAMS = {
+    'line_lateness_seconds': ('how far behind the latest timestamp read before it each line was',
+                              (0, 1, 5, 15, 60, 300, 900, 3600)),
+    'chunk_seconds': ('time spent summarizing each chunk of lines',
+                      (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)),
+}
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of what connspy is up to.
+
+    Meant to be updated a chunk of lines at a time, never per line:
+    counters are plain ints and histograms take a whole array of
+    values at once. Gauges can be set to a function, called only when
+    the metrics are read. Metrics pickle, so workers can send theirs
+    back to be merged.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.gauges = {}        # name: value, function or {label value: value}
+        self.buckets = {name: np.array(bounds, dtype=np.float64)
+                        for name, (_, bounds) in HISTOGRAMS.items()}
+        self.counts = {name: np.zeros(len(bounds) + 1, dtype=np.int64)
+                       for name, (_, bounds) in HISTOGRAMS.items()}
+        self.sums = dict.fromkeys(HISTOGRAMS, 0.0)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # functions don't pickle, and are for the process they're in
+        state['gauges'] = {name: value for name, value in self.gauges.items()
+                           if not callable(value)}
+        return state
+
+    def count(self, name, n=1):
+        self.counters[name] += int(n)
+
+    def set(self, name, value):
+        """ value can be a number, a function of nothing or a dict by label """
+        self.gauges[name] = value
+
+    def observe(self, name, values):
+        """ adds an array of values to the histogram name """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        bucket = np.searchsorted(self.buckets[name], values, side='left')
+        self.counts[name] += np.bincount(bucket, minlength=len(self.counts[name]))
+        self.sums[name] += float(values.sum())
+
+    def merge(self, other):
+        """ adds the counters and histograms of other, gauges are ours """
+        for name, n in other.counters.items():
+            self.counters[name] += n
+        for name in HISTOGRAMS:
+            self.counts[name] += other.counts[name]
+            self.sums[name] += other.sums[name]
+
+    def gauge(self, name):
+        value = self.gauges.get(name)
+        return value() if callable(value) else value
+
+    def _bounds(self, name):
+        return [f"{b:g}" for b in self.buckets[name]] + ['+Inf']
+
+    def snapshot(self):
+        """ everything as a dict ready for JSON """
+        snapshot = {'time': time.time()}
+        snapshot.update(self.counters)
+        for name in self.gauges:
+            snapshot[name] = self.gauge(name)
+        for name, counts in self.counts.items():
+            snapshot[name] = {'buckets': dict(zip(self._bounds(name), np.cumsum(counts).tolist())),
+                              'sum': self.sums[name], 'count': int(counts.sum())}
+        return snapshot
+
+    def prometheus(self):
+        """ everything in the Prometheus text exposition format """
+        lines = []
+        for name, n in self.counters.items():
+            lines += [f"# HELP {PREFIX}{name}_total {COUNTERS[name]}",
+                      f"# TYPE {PREFIX}{name}_total counter",
+                      f"{PREFIX}{name}_total {n}"]
+        for name in list(self.gauges):
+            value = self.gauge(name)
+            if value is None:
+                continue
+            lines += [f"# HELP {PREFIX}{name} {GAUGES[name]}",
+                      f"# TYPE {PREFIX}{name} gauge"]
+            if isinstance(value, dict):
+                label = LABELS.get(name, 'label')
+                lines += [f'{PREFIX}{name}{{{label}="{key}"}} {v}' for key, v in value.items()]
+            else:
+                lines.append(f"{PREFIX}{name} {value}")
+        for name, counts in self.counts.items():
+            help, _ = HISTOGRAMS[name]
+            lines += [f"# HELP {PREFIX}{name} {help}",
+                      f"# TYPE {PREFIX}{name} histogram"]
+            for bound, n in zip(self._bounds(name), np.cumsum(counts).tolist()):
+                lines.append(f'{PREFIX}{name}_bucket{{le="{bound}"}} {n}')
+            lines += [f"{PREFIX}{name}_sum {self.sums[name]}",
+                      f"{PREFIX}{name}_count {int(counts.sum())}"]
+        return "\n".join(lines) + "\n"
+
+
+def parse_target(target):
+    """
+    Where --metrics go: stderr, http:[HOST:]PORT, or a file path.
+    Returns ('stderr',), ('http', host, port) or ('file', path)
+    """
+    if target == 'stderr':
+        return ('stderr',)
+    if target.startswith("http:"):
+        host, _, port = target[len("http:"):].rpartition(":")
+        if not port.isdigit():
+            raise Exception(f"cannot serve metrics on {target}, expected http:[HOST:]PORT")
+        # local only, unless asked otherwise
+        return ('http', host.strip("[]") or '127.0.0.1', int(port))
+    if not target:
+        raise Exception("no metrics file given")
+    return ('file', target)
+
+
+class Reporter:
+    """
+    Reports Metrics every every_seconds, as a JSON line to stderr and
+    to the target (see parse_target): a Prometheus text file, written
+    to a new file renamed over the old one so a scraper never reads a
+    half written one, or a local HTTP endpoint. The endpoint answers
+    from a thread of its own, with the counters as they are then.
+
+    refresh, if given, is called before every report to update gauges.
+    """
+
+    def __init__(self, metrics, target, every_seconds=DEFAULT_EVERY_SECONDS,
+                 refresh=None, stream=None):
+        self.metrics = metrics
+        self.target = parse_target(target)
+        self.every_seconds = every_seconds
+        self.refresh = refresh
+        self.stream = stream
+        self.last_reported = time.monotonic()
+        self.last_lines = 0
+        self.server = None
+        metrics.set('elapsed_seconds', lambda: time.time() - metrics.start)
+        if self.target[0] == 'http':
+            self.serve(*self.target[1:])
+
+    def serve(self, host, port):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # a scrape every few seconds is not news
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"serving metrics on http://{host}:{self.server.server_port}/metrics")
+
+    def report(self):
+        now = time.monotonic()
+        lines = self.metrics.counters['lines']
+        if now > self.last_reported:
+            self.metrics.set('lines_per_second',
+                             (lines - self.last_lines) / (now - self.last_reported))
+        self.last_reported, self.last_lines = now, lines
+        if self.refresh:
+            self.refresh()
+
+        print(json.dumps(self.metrics.snapshot()), file=self.stream or sys.stderr, flush=True)
+        if self.target[0] == 'file':
+            path = self.target[1]
+            with open(path + ".tmp", 'w') as f:
+                f.write(self.metrics.prometheus())
+            os.replace(path + ".tmp", path)
+
+    def maybe_report(self):
+        if time.monotonic() - self.last_reported >= self.every_seconds:
+            self.report()
+
+    def close(self):
+        """ a last report, and the endpoint goes away """
+        self.report()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
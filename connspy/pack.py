@@ -0,0 +1,225 @@
+import os
+import sys
+import mmap
+import struct
+import logging
+import argparse
+
+import numpy as np
+
+from connspy.parser import BatchParser, read_chunks
+from connspy.compressed import open_log
+
+logger = logging.getLogger("pack")
+
+PACK_SUFFIX = ".pack"
+MAGIC = b"CSPYPAK1"
+# magic, number of blocks, number of hosts, offset of the host names,
+# offset of the block table
+HEADER = struct.Struct("<8sQQQQ")
+# every block is where its columns start, how many rows it has and
+# the min / max timestamp of its rows, in microseconds
+BLOCK = np.dtype([('offset', '<u8'), ('rows', '<u8'),
+                  ('min_ts', '<i8'), ('max_ts', '<i8')])
+
+DEFAULT_BLOCK_ROWS = 2 ** 16
+
+
+def pack_path(path):
+    return path + PACK_SUFFIX
+
+
+def is_packed(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def to_micros(ts):
+    """ parsed timestamps (see parser.parse_ts_array) to int64 microseconds """
+    seconds = np.floor(ts)
+    return seconds.astype(np.int64) * 1000000 + np.rint((ts - seconds) * 1e6).astype(np.int64)
+
+
+def to_seconds(us):
+    """
+    The inverse of to_micros, giving back exactly the floats the
+    parser would have, seconds and microseconds being added the same way
+    """
+    seconds, us = np.divmod(us, 1000000)
+    return seconds.astype(np.float64) + us / 1e6
+
+
+class PackFile:
+    """
+    A memory mapped packed log, written by write_pack.
+
+    A packed log holds only the valid lines of a text log, parsed once
+    and for all, as columns: timestamps as int64 microseconds and from
+    and to as int32 ids into a host dictionary stored alongside. The
+    rows are cut into blocks, and a table at the end records where each
+    block starts, its number of rows and its min and max timestamp, so
+    that a time range only touches the blocks that overlap it.
+
+    Blocks come back as numpy views straight onto the mapped file, no
+    copy and no parsing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, self.n_hosts, names_at, table_at = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise Exception(f"{path} is not a packed connspy log")
+        self.blocks = np.frombuffer(self.mm, BLOCK, n, table_at)
+        self._names = (names_at, table_at)
+
+    @property
+    def names(self):
+        """ the host names, id -> name, decoded on first use """
+        if isinstance(self._names, tuple):
+            start, end = self._names
+            data = self.mm[start:end].decode()
+            self._names = data.split("\n") if data else []
+        return self._names
+
+    def block(self, i):
+        """ (ts, frm, to) columns of block i, ts in microseconds """
+        offset, rows = int(self.blocks['offset'][i]), int(self.blocks['rows'][i])
+        ts  = np.frombuffer(self.mm, np.int64, rows, offset)
+        frm = np.frombuffer(self.mm, np.int32, rows, offset + 8 * rows)
+        to  = np.frombuffer(self.mm, np.int32, rows, offset + 12 * rows)
+        return ts, frm, to
+
+    def blocks_between(self, time_init=-np.inf, time_end=np.inf):
+        """ indices of the blocks that can hold timestamps in [time_init, time_end) """
+        overlap = ((to_seconds(self.blocks['max_ts']) >= time_init) &
+                   (to_seconds(self.blocks['min_ts']) < time_end))
+        return np.flatnonzero(overlap)
+
+    def columns(self, hosts, start=0, end=None):
+        """
+        Yields (block_end, ts, frm, to) for every block starting in the
+        bytes [start, end), ts in seconds like the parser's and the hosts
+        as ids interned in hosts, a HostTable, block_end being where the
+        block ends.
+        """
+        lut = np.array([hosts.intern(name) for name in self.names], dtype=np.int32)
+        offsets = self.blocks['offset']
+        for i in np.flatnonzero((offsets >= start) & (offsets < (end or len(self.mm)))):
+            ts, frm, to = self.block(i)
+            block_end = int(offsets[i]) + 16 * len(ts)
+            yield block_end, to_seconds(ts), lut[frm], lut[to]
+
+    def close(self):
+        self.blocks = None
+        try:
+            self.mm.close()
+        except BufferError:
+            pass        # someone still holds a view, the gc will do it
+
+
+def read_columns(path, hosts):
+    """
+    Yields (ts, frm, to) of the valid lines of the log at path, packed,
+    compressed or plain, a block or chunk at a time, the hosts as ids
+    interned in hosts, a HostTable
+    """
+    if is_packed(path):
+        pack = PackFile(path)
+        for _, ts, frm, to in pack.columns(hosts):
+            yield ts, frm, to
+        pack.close()
+        return
+    parser = BatchParser(hosts)
+    with open_log(path) as f:
+        for chunk in read_chunks(f):
+            ts, frm, to, valid = parser.parse(chunk)
+            yield ts[valid], frm[valid], to[valid]
+
+
+def _write_block(f, ts, frm, to):
+    offset = f.tell()
+    f.write(ts.tobytes())
+    f.write(frm.astype(np.int32).tobytes())
+    f.write(to.astype(np.int32).tobytes())
+    return offset, len(ts), ts.min(), ts.max()
+
+
+def write_pack(path, out=None, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Packs the log at path, compressed or not, into out (path.pack by
+    default), block_rows rows to a block. Returns the PackFile.
+    """
+    out = pack_path(path) if out is None else out
+    tmp = out + ".tmp"
+    parser = BatchParser()
+    blocks = []
+    with open_log(path) as f, open(tmp, 'wb') as pack:
+        pack.write(HEADER.pack(MAGIC, 0, 0, 0, 0))
+
+        pending = []        # columns not yet in a block
+        rows = 0
+        for chunk in read_chunks(f):
+            ts, frm, to, valid = parser.parse(chunk)
+            ts = ts[valid]
+            us = to_micros(ts)
+            # far enough in the future, floats can't hold microseconds
+            if not np.array_equal(to_seconds(us), ts):
+                raise Exception(f"{path} has timestamps that can't be packed to the microsecond")
+            pending.append((us, frm[valid], to[valid]))
+            rows += int(valid.sum())
+            if rows < block_rows:
+                continue
+            ts, frm, to = (np.concatenate(col) for col in zip(*pending))
+            cut = rows - rows % block_rows
+            for start in range(0, cut, block_rows):
+                end = start + block_rows
+                blocks.append(_write_block(pack, ts[start:end], frm[start:end], to[start:end]))
+            pending = [(ts[cut:], frm[cut:], to[cut:])]
+            rows -= cut
+
+        if rows:
+            blocks.append(_write_block(pack, *(np.concatenate(col) for col in zip(*pending))))
+
+        names_at = pack.tell()
+        pack.write("\n".join(parser.hosts.names).encode())
+        table_at = pack.tell()
+        pack.write(np.array(blocks, dtype=BLOCK).tobytes())
+        pack.seek(0)
+        pack.write(HEADER.pack(MAGIC, len(blocks), len(parser.hosts), names_at, table_at))
+
+    os.replace(tmp, out)    # so nobody ever sees half a pack
+    return PackFile(out)
+
+
+def parse_argv(argv):
+    args_parser = argparse.ArgumentParser(description=""
+            "connspy-pack: convert closed logs into packed columnar files "
+            "that connspy and connspy-stream read without parsing")
+    args_parser.add_argument('--block_rows', type=int, required=False,
+            default=DEFAULT_BLOCK_ROWS,
+            help='lines to a block, the unit skipped over by time')
+    args_parser.add_argument('--out', type=str, required=False,
+            help='where to write the packed log, with a single file. '
+                 'Defaults to the log name plus .pack')
+    args_parser.add_argument('files', type=str, nargs='+',
+            help='the log files to pack')
+    args = args_parser.parse_args(argv)
+
+    if args.block_rows <= 0:
+        raise Exception("block_rows must be positive")
+    if args.out and len(args.files) > 1:
+        raise Exception("--out only works with a single file")
+    return args
+
+
+def main():
+    args = parse_argv(sys.argv[1:])
+    for path in args.files:
+        logger.info("packing " + path)
+        write_pack(path, args.out, args.block_rows).close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+import os
+import copy
+import bisect
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from connspy.parser import BatchParser, read_chunks, first_seen
+from connspy.stream import Processor, TO, FROM, MOST, FAN_IN
+from connspy.connspy import process_chunks
+from connspy.compressed import compression, is_block_compressed, block_offsets, open_log
+from connspy.pack import PackFile, is_packed
+from connspy.metrics import Metrics
+from connspy.rejects import Rejects
+
+logger = logging.getLogger("parallel")
+
+# files smaller than this are never split between workers
+MIN_RANGE_BYTES = 64 * 2 ** 20
+# connspy cuts its byte range into up to this many slices per worker,
+# so that a worker stuck with a dense slice does not hold up the rest
+SLICES_PER_WORKER = 4
+
+
+def line_aligned_ranges(path, n, start=0, end=None):
+    """
+    Splits the bytes [start, end) of the file at path into up to n
+    (start, end) ranges of about the same size, cut at line boundaries.
+    """
+    end = os.stat(path).st_size if end is None else end
+    cuts = [start]
+    with open(path, 'rb') as f:
+        for i in range(1, n):
+            pos = start + (end - start) * i // n
+            if pos <= cuts[-1]:
+                continue
+            # back off a byte so a cut right at a line start stays put
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= end:
+                break
+            if pos > cuts[-1]:
+                cuts.append(pos)
+    cuts.append(end)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def aligned_ranges(path, n, start=0, end=None):
+    """
+    line_aligned_ranges, but for a packed log, or a compressed one, cuts
+    at the start of its blocks, if block compressed, and doesn't cut at
+    all otherwise
+    """
+    if is_packed(path):
+        pack = PackFile(path)
+        offsets = pack.blocks['offset'].tolist()
+        pack.close()
+    elif compression(path) is None:
+        return line_aligned_ranges(path, n, start, end)
+    else:
+        offsets = block_offsets(path, start, end) if is_block_compressed(path) else []
+
+    end = os.stat(path).st_size if end is None else end
+    cuts = [start]
+    for i in range(1, n):
+        j = bisect.bisect_left(offsets, start + (end - start) * i // n)
+        if j < len(offsets) and offsets[j] > cuts[-1]:
+            cuts.append(offsets[j])
+    cuts.append(end)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+class PartialProcessor(Processor):
+    """
+    A Processor that, instead of calling back with finished windows,
+    keeps every window it would have emitted as a partial summary to
+    be merged by the parent process, in the order it did. Each comes
+    with the latest timestamp read before the window was opened and
+    when it was closed, for the parent to close its own windows as a
+    single process would have by then.
+
+    That only holds while no line is later than --max_log_late_seconds:
+    such a line lands in a window or not depending on everything read
+    before it, the ranges of other workers included. So it also keeps
+    the earliest timestamp it read, and whether a line was that late
+    within its own range, for the parent to tell.
+    """
+
+    def __init__(self, args):
+        super().__init__(args, None)
+        self.partials = []
+        self.opened = {}        # window -> latest timestamp before it was
+        self.min_ts = float('inf')
+        self.too_late = False
+
+    def process_columns(self, ts, frm, to):
+        if len(ts):
+            before = np.maximum.accumulate(np.concatenate(([self.latest_ts], ts[:-1])))
+            self.too_late |= bool((before - ts > self.args.max_log_late_seconds).any())
+            self.min_ts = min(self.min_ts, float(ts.min()))
+        super().process_columns(ts, frm, to)
+
+    def aggregate(self, starts, frm, to):
+        for window in first_seen(starts).tolist():
+            if window not in self.windows:
+                self.opened[window] = self.latest_ts
+        super().aggregate(starts, frm, to)
+
+    def emit(self, window):
+        summary = self.windows.pop(window)
+        to   = {t: np.fromiter(s, np.int32) for t, s in summary[TO].items()}
+        frm  = {t: np.fromiter(s, np.int32) for t, s in summary[FROM].items()}
+        self.partials.append((window, self.opened.pop(window), self.latest_ts,
+                              to, frm, summary[MOST], summary[FAN_IN:]))
+
+
+def summarize_range(args, path, start, end):
+    """
+    Worker side. Runs the lines of path in [start, end) through a
+    PartialProcessor and returns its host names, its partial window
+    summaries in the order they were closed, its latest timestamp, its
+    earliest, whether it had lines too late within the range and,
+    with --metrics, its Metrics.
+    """
+    pr = PartialProcessor(args)
+    pr.rejects.start(path, start)
+    if args.metrics:
+        pr.metrics = Metrics()
+    if is_packed(path):
+        pack = PackFile(path)
+        for _, ts, frm, to in pack.columns(pr.hosts, start, end):
+            pr.process_columns(ts, frm, to)
+            if pr.metrics is not None:
+                pr.metrics.count('pack_blocks')
+        pack.close()
+    else:
+        with open_log(path, start, end) as f:
+            for chunk in read_chunks(f):
+                pr.process_chunk(chunk)
+    pr.dump_remaining()
+    pr.rejects.close()
+    return pr.hosts.names, pr.partials, pr.latest_ts, pr.min_ts, pr.too_late, pr.metrics
+
+
+def replay_range(pr, path, start, end):
+    """
+    Runs the lines of path in [start, end) through pr itself, as a
+    single process would. What a worker already counted of them, and
+    quarantined, isn't counted again.
+    """
+    metrics, pr.metrics = pr.metrics, None
+    try:
+        if is_packed(path):
+            pack = PackFile(path)
+            for _, ts, frm, to in pack.columns(pr.hosts, start, end):
+                pr.process_columns(ts, frm, to)
+            pack.close()
+            return
+        parser = BatchParser(pr.hosts)
+        with open_log(path, start, end) as f:
+            for chunk in read_chunks(f):
+                ts, frm, to, valid = parser.parse(chunk)
+                pr.process_columns(ts[valid], frm[valid], to[valid])
+    finally:
+        pr.metrics = metrics
+
+
+def make_jobs(files, workers):
+    """ (path, start, end) jobs, splitting big files when there are few """
+    per_file = max(workers // max(len(files), 1), 1)
+    jobs = []
+    for path in files:
+        size = os.stat(path).st_size
+        n = min(per_file, max(size // MIN_RANGE_BYTES, 1))
+        jobs.extend((path, start, end) for start, end in aligned_ranges(path, n))
+    return jobs
+
+
+def process_parallel(pr, files, workers):
+    """
+    Runs files, in order, through the Processor pr using a pool of
+    workers, each summarizing a file or a byte range of one.
+
+    The parent merges the partial summaries in file order, and those of
+    a job in the order the worker closed them: a partial window joins
+    the same window if still open, or opens it again if it was already
+    emitted, just like late lines do in a single process. Before and
+    after each, windows matured by the worker's latest timestamp at the
+    time are emitted through pr's callback, so a window a worker closed
+    and then opened again for lines later than --max_log_late_seconds
+    comes out twice, as it would have from a single process.
+
+    That's as long as lines are no later than --max_log_late_seconds,
+    as then which window they land in depends on every line before,
+    in other jobs too. A job with a line that late, in its own range or
+    given what the jobs before it read, is run again by the parent
+    itself instead, in order, so the output still matches a single
+    process.
+    """
+    # workers parse in batches whatever the engine asked for
+    args = copy.copy(pr.args)
+    args.engine = 'batch'
+
+    jobs = make_jobs(files, workers)
+    logger.info(f"{len(jobs)} jobs over {workers} workers")
+    if not jobs:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(summarize_range, *zip(*[(args,) + job for job in jobs]))
+
+        # map hands results back in job order, as they come in
+        for job, (names, partials, latest_ts, min_ts, too_late, metrics) in zip(jobs, results):
+            if too_late or pr.latest_ts - min_ts > args.max_log_late_seconds:
+                logger.info(f"lines of {job[0]} from byte {job[1]} on are too late "
+                            "to merge, reading them again")
+                replay_range(pr, *job)
+            else:
+                lut = np.array([pr.hosts.intern(name) for name in names], dtype=np.int32)
+                for window, opened, closed, to, frm, most, fans in partials:
+                    pr.close_windows(opened)
+                    pr.merge(window,
+                             {int(lut[t]): lut[ids] for t, ids in to.items()},
+                             {int(lut[t]): lut[ids] for t, ids in frm.items()},
+                             most.relabel(lut), [fan.relabel(lut) for fan in fans])
+                    pr.close_windows(closed)
+                pr.latest_ts = max(pr.latest_ts, latest_ts)
+                pr.close_windows(latest_ts)
+            if metrics is not None and pr.metrics is not None:
+                pr.metrics.merge(metrics)
+            if pr.reporter:
+                pr.reporter.maybe_report()
+
+
+def scan_range(args, path, start, end):
+    """
+    Worker side of scan_parallel. Runs process_chunks over the bytes
+    [start, end) of path and returns the distinct (frm, to) hosts it
+    found, in first seen order, the latest timestamp it read and, with
+    --metrics, its Metrics.
+    """
+    hits = []
+    metrics = Metrics() if args.metrics else None
+    rejects = Rejects(args.quarantine)
+    rejects.start(path, start)
+    with open_log(path, start, end) as f:
+        latest_ts = process_chunks(read_chunks(f), args,
+                                   lambda frm, to: hits.append((frm, to)), metrics, rejects)
+    rejects.close()
+    return hits, latest_ts, metrics
+
+
+def scan_parallel(args, byte_range, callback, metrics=None):
+    """
+    connspy's scan, with the byte range (see connspy.find_range, None
+    for the whole file) cut into line aligned slices for a pool of
+    args.workers processes.
+
+    Slices are merged in file order, so callback sees exactly what the
+    serial scan would have, in the same order. A slice in which the
+    serial scan would have stopped, being past time_end, is the last
+    one used. With args.unordered, hosts are reported as soon as their
+    slice is done instead, but only when the range is bounded since
+    otherwise where to stop depends on all the slices before. Even then
+    a slice after the line the serial scan stops at, but within the
+    range, can add hosts the serial scan wouldn't have. The
+    Metrics of the slices used are merged into metrics, if given.
+    """
+    bounded = byte_range is not None
+    start, end = byte_range if bounded else (0, None)
+    if end is None:
+        end = os.stat(args.file).st_size
+
+    n = min(args.workers * SLICES_PER_WORKER, max((end - start) // MIN_RANGE_BYTES, 1))
+    slices = aligned_ranges(args.file, n, start, end)
+    logger.info(f"{len(slices)} slices over {args.workers} workers")
+    stop_ts = args.time_end + args.max_log_late_seconds
+
+    seen = set()
+    def report(hits, sliced):
+        if metrics is not None and sliced is not None:
+            metrics.merge(sliced)
+        for frm, to in hits:
+            if (to, frm) not in seen:
+                seen.add((to, frm))
+                callback(frm, to)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(scan_range, args, args.file, s, e)
+                   for s, e in slices]
+
+        if args.unordered and bounded:
+            for future in as_completed(futures):
+                hits, _, sliced = future.result()
+                report(hits, sliced)
+            return
+
+        for future in futures:
+            hits, latest_ts, sliced = future.result()
+            report(hits, sliced)
+            if latest_ts >= stop_ts:
+                # the serial scan stops in this slice, drop the rest
+                for rest in futures:
+                    rest.cancel()
+                break
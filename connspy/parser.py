@@ -1,20 +1,44 @@
 import logging
 import re
 import datetime
+from collections import namedtuple
+
+import numpy as np
+
+from connspy.hosts import HostTable
+from connspy.rejects import Rejects, REASONS, FIELDS, TIMESTAMP, HOST
 
 VALID_HOST_REGEX = r"[0-9a-z]+"
 INVALID          = (None, None, None)
 logger = logging.getLogger("parser")
 
+CHUNK_SIZE = 4 * 2 ** 20  # bytes handed to the BatchParser at a time
+
+# bytes.split() treats exactly these as whitespace
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[list(b" \t\n\r\x0b\x0c")] = True
+
+# datetime.fromtimestamp() only covers the years 1 to 9999, so parse_ts
+# rejects anything outside. A day of slack on each side covers time zones.
+_TS_MIN = -62135596800.0 + 86400
+_TS_MAX = 253402300800.0 - 86400
+
+# one row per line of the chunk. ts is float64 seconds, frm and to are
+# int32 host ids (-1 when unknown) and valid is a boolean mask
+Columns = namedtuple("Columns", ["ts", "frm", "to", "valid"])
+
+
 class Parser():
     """
     This Parser currently rigidly accepts lines
     as whitespace delimited TS, FROM, TO and
-    enforces some validity of inputs.
+    enforces some validity of inputs. Rejected
+    lines are counted in rejects (see rejects.Rejects).
     """
 
-    def __init__(self):
+    def __init__(self, rejects=None):
         self.valid_domain_regex = re.compile(VALID_HOST_REGEX)
+        self.rejects = rejects if rejects is not None else Rejects()
 
     def parse_ts(ts):
         try:
@@ -24,7 +48,8 @@ class Parser():
             dt = datetime.datetime.fromtimestamp(ts)
             ts = dt.timestamp()
             return ts
-        except:
+        # not a number, or out of the years datetime covers (nan included)
+        except (ValueError, OverflowError, OSError):
             return None
 
     def parse(self, line):
@@ -34,19 +59,217 @@ class Parser():
         ele = line.lower().split()
 
         if len(ele) != 3:
-            logger.error("Invalid line, too many elements: " + line)
-            return INVALID 
+            self.rejects.add(FIELDS, [line])
+            return INVALID
         ts = Parser.parse_ts(ele[0])
 
         if not ts:
-            logger.error(f"Cannot parse {ele[0]} into a timestamp")
+            self.rejects.add(TIMESTAMP, [line])
             return INVALID
 
         # regex useful if you need character range guaratees for trie or compression)
         if not (self.valid_domain_regex.match(ele[1]) and
                 self.valid_domain_regex.match(ele[2])):
-            logger.error("Invalid domains for line: " + line)
+            self.rejects.add(HOST, [line])
             return INVALID
-       
+
         return ts, ele[1], ele[2]
 
+
+def parse_ts_array(ts):
+    """
+    Vectorized Parser.parse_ts over an array of raw float timestamps.
+    Returns the normalized seconds and a mask of the ones parse_ts
+    would have accepted.
+    """
+    ts = np.where(ts > 999999999999, ts / 1000.0, ts)
+    # nan fails every comparison so it drops out here too
+    valid = (ts > _TS_MIN) & (ts < _TS_MAX) & (ts != 0)
+
+    # the fromtimestamp().timestamp() round trip rounds the fraction to
+    # the microsecond, half to even, and adds it back onto the seconds
+    with np.errstate(invalid='ignore'):      # inf - inf
+        seconds = np.trunc(ts)
+        us = np.rint((ts - seconds) * 1e6)
+    borrow = us < 0
+    seconds -= borrow
+    us += borrow * 1e6
+    carry = us >= 1e6
+    seconds += carry
+    us -= carry * 1e6
+    return np.where(valid, seconds + us / 1e6, np.nan), valid
+
+
+def _float_or_nan(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+
+class _TokenIds(dict):
+    # raw token -> host id, falling back to the parser to validate
+    # and intern tokens we have not met yet
+    def __init__(self, intern):
+        self.intern = intern
+
+    def __missing__(self, token):
+        host_id = self.intern(token)
+        if host_id >= 0:            # don't let garbage grow the cache
+            self[token] = host_id
+        return host_id
+
+
+class BatchParser():
+    """
+    Same rules as Parser, but works on a whole chunk of lines at once
+    and returns numpy columns instead of a tuple per line. Hosts come
+    back as ids interned in hosts, a HostTable that can be shared with
+    whatever aggregates the columns.
+
+    Rejected lines are counted in rejects, with their byte offsets,
+    chunks being taken to follow each other from rejects.offset on.
+    """
+
+    def __init__(self, hosts=None, rejects=None):
+        self.valid_domain_regex = re.compile(VALID_HOST_REGEX)
+        self.hosts = hosts if hosts is not None else HostTable()
+        self.rejects = rejects if rejects is not None else Rejects()
+        self._token_ids = _TokenIds(self._intern_token)
+
+    def _intern_token(self, token):
+        host = token.decode('utf-8', 'replace').lower()
+        if not self.valid_domain_regex.match(host):
+            return -1
+        return self.hosts.intern(host)
+
+    def parse(self, data):
+        """
+        data: bytes holding whole lines, the last "\n" is optional
+        returns Columns with one row per line
+        """
+        if isinstance(data, str):
+            data = data.encode()
+
+        buf = np.frombuffer(data, dtype=np.uint8)
+        space = _IS_SPACE[buf]
+        newlines = np.flatnonzero(buf == 10)
+        n_lines = len(newlines)
+        if len(buf) and buf[-1] != 10:
+            n_lines += 1
+
+        # a token starts on any non space following a space
+        starts = ~space
+        starts[1:] &= space[:-1]
+        tok_line = np.searchsorted(newlines, np.flatnonzero(starts))
+        counts = np.bincount(tok_line, minlength=n_lines)
+
+        tokens = data.split()
+        shaped = counts == 3
+        n = int(shaped.sum())
+        if n == n_lines:
+            # the usual case, every line has exactly 3 fields
+            ts_tok, frm_tok, to_tok = tokens[0::3], tokens[1::3], tokens[2::3]
+        else:
+            first = (np.cumsum(counts) - counts)[shaped]
+            tokens = np.array(tokens, dtype=object)
+            ts_tok, frm_tok, to_tok = tokens[first], tokens[first + 1], tokens[first + 2]
+
+        try:
+            raw = np.fromiter(map(float, ts_tok), np.float64, n)
+        except ValueError:
+            raw = np.fromiter(map(_float_or_nan, ts_tok), np.float64, n)
+        ts, valid = parse_ts_array(raw)
+
+        lookup = self._token_ids.__getitem__
+        frm = np.fromiter(map(lookup, frm_tok), np.int32, n)
+        to  = np.fromiter(map(lookup, to_tok),  np.int32, n)
+        valid &= (frm >= 0) & (to >= 0)
+
+        offset = self.rejects.offset
+        self.rejects.offset += len(data)
+        if n == n_lines:
+            cols = Columns(ts, frm, to, valid)
+        else:
+            # spread the well shaped rows back out over all the lines
+            cols = Columns(np.full(n_lines, np.nan),
+                           np.full(n_lines, -1, dtype=np.int32),
+                           np.full(n_lines, -1, dtype=np.int32),
+                           np.zeros(n_lines, dtype=bool))
+            cols.ts[shaped]    = ts
+            cols.frm[shaped]   = frm
+            cols.to[shaped]    = to
+            cols.valid[shaped] = valid
+
+        if not cols.valid.all():
+            self._reject(data, offset, newlines, shaped, cols)
+        return cols
+
+    def _reject(self, data, offset, newlines, shaped, cols):
+        # an invalid ts is nan, so a well shaped line with a number
+        # there was rejected for its hosts
+        reasons = np.where(~shaped, REASONS.index(FIELDS),
+                           np.where(np.isnan(cols.ts), REASONS.index(TIMESTAMP),
+                                    REASONS.index(HOST)))
+        starts = np.concatenate(([0], newlines + 1))
+        ends = np.append(newlines, len(data))
+        for code, reason in enumerate(REASONS):
+            lines = np.flatnonzero(~cols.valid & (reasons == code))
+            if len(lines):
+                self.rejects.add(reason, [data[start:end] for start, end in
+                                          zip(starts[lines].tolist(), ends[lines].tolist())],
+                                 (offset + starts[lines]).tolist())
+
+
+def read_chunks(f, chunk_size=CHUNK_SIZE, limit=None):
+    """
+    Reads f in large blocks and yields bytes cut at line boundaries,
+    so no line is ever split between two chunks. Works on binary or
+    text file objects. With limit, stops after that many bytes
+    (binary files only). See tail.Tailer for following a live log.
+    """
+    # read1 hands back whatever is there without waiting for a
+    # full chunk, which matters for pipes
+    read = getattr(f, 'read1', f.read)
+    rest = b""
+    while True:
+        if limit is not None:
+            if limit <= 0:
+                break
+            data = read(min(chunk_size, limit))
+            limit -= len(data)
+        else:
+            data = read(chunk_size)
+        if not data:
+            break
+        if isinstance(data, str):
+            data = data.encode()
+
+        cut = data.rfind(b"\n") + 1
+        if cut == 0:
+            rest += data
+            continue
+        yield rest + data[:cut]
+        rest = data[cut:]
+
+    if rest:
+        yield rest
+
+
+def read_lines(f, limit=None):
+    """
+    Yields the lines of the binary file f as text, stopping
+    after limit bytes if given
+    """
+    for line in f:
+        if limit is not None:
+            if limit <= 0:
+                break
+            limit -= len(line)
+        yield line.decode('utf-8', 'replace')
+
+
+def first_seen(ids):
+    """ unique ids, in the order they first appear """
+    uniq, first = np.unique(ids, return_index=True)
+    return uniq[np.argsort(first)]
@@ -0,0 +1,92 @@
+import time
+import logging
+
+logger = logging.getLogger("rejects")
+
+# why a line was rejected
+FIELDS    = 'fields'        # not exactly 3 whitespace separated fields
+TIMESTAMP = 'timestamp'     # the first one is not a timestamp
+HOST      = 'host'          # the others are not both valid hosts
+REASONS = (FIELDS, TIMESTAMP, HOST)
+
+DEFAULT_EVERY_SECONDS = 10
+SAMPLE_CHARS = 200          # of the line quoted in a summary
+
+
+class Rejects:
+    """
+    Keeps count of the lines the parsers reject, by reason, so that a
+    corrupt stretch of log costs a counter increment per line rather
+    than a formatted log message.
+
+    What was rejected is logged as a summary, the first one right away
+    and then at most one every every_seconds, with a line to show for
+    it. With quarantine, a path, rejected lines are also appended to
+    that file as they come, a whole chunk's worth in one write, as
+
+        SOURCE <tab> BYTE OFFSET <tab> REASON <tab> LINE
+
+    the offset being where the line starts in SOURCE, the file being
+    read (see start()). Only parsers that know where their lines come
+    from, that is the BatchParser, can give offsets, others give -1.
+    """
+
+    def __init__(self, quarantine=None, every_seconds=DEFAULT_EVERY_SECONDS):
+        self.counts = dict.fromkeys(REASONS, 0)
+        self.every_seconds = every_seconds
+        self.last_logged = None
+        self.logged = dict(self.counts)     # counts as of the last summary
+        self.sample = None
+        # appending in one write per chunk lets workers share the file
+        self.quarantine = open(quarantine, 'ab', buffering=0) if quarantine else None
+        self.source = "-"
+        self.offset = 0         # of the next chunk to parse, in source
+
+    def start(self, source, offset=0):
+        """ the lines parsed from now on come from source, from byte offset on """
+        self.source = "-" if source is None else str(source)
+        self.offset = offset
+
+    def add(self, reason, lines, offsets=None):
+        """ counts lines, bytes or str, rejected for reason """
+        self.counts[reason] += len(lines)
+        self.sample = lines[-1]
+        if self.quarantine is not None:
+            source = self.source.encode('utf-8', 'replace')
+            reason = reason.encode()
+            if offsets is None:
+                offsets = [-1] * len(lines)
+            self.quarantine.write(b"".join(
+                b"%b\t%d\t%b\t%b\n" % (source, offset, reason,
+                                       line.rstrip(b"\r\n") if isinstance(line, bytes) else
+                                       line.rstrip("\r\n").encode('utf-8', 'replace'))
+                for line, offset in zip(lines, offsets)))
+        now = time.monotonic()
+        if self.last_logged is None or now - self.last_logged >= self.every_seconds:
+            self.log()
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def log(self):
+        """ logs a summary of what was rejected since the last one, if anything """
+        new = {reason: self.counts[reason] - self.logged[reason] for reason in REASONS}
+        if not any(new.values()):
+            return
+        sample = self.sample
+        if isinstance(sample, bytes):
+            sample = sample.decode('utf-8', 'replace')
+        since = "" if self.last_logged is None else \
+                f" in the last {time.monotonic() - self.last_logged:.0f}s"
+        reasons = ", ".join(f"{n} bad {reason}" for reason, n in new.items() if n)
+        logger.warning(f"{sum(new.values())} lines rejected{since} ({reasons}), "
+                       f"{self.total()} in all, last one: {sample.strip()[:SAMPLE_CHARS]!r}")
+        self.logged = dict(self.counts)
+        self.last_logged = time.monotonic()
+
+    def close(self):
+        """ a last summary, and the quarantine file is closed """
+        self.log()
+        if self.quarantine is not None:
+            self.quarantine.close()
+            self.quarantine = None
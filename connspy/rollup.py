@@ -0,0 +1,383 @@
+import os
+import sys
+import mmap
+import zlib
+import struct
+import logging
+import argparse
+
+import numpy as np
+
+from connspy.bloomset import hash_strings
+from connspy.hosts import HostTable, pair_ids, unpair_ids
+from connspy.index import checksums
+from connspy.pack import read_columns
+from connspy.parser import first_seen
+from connspy.windows import Windows
+
+logger = logging.getLogger("rollup")
+
+ROLLUP_SUFFIX = ".rollup"
+HOUR_SUFFIX = ".hour"
+LATE_NAME = "late"
+HOUR = 3600
+MAGIC = b"CSPYRUP3"
+# magic, inode of the log, start of the hour, number of hosts,
+# offset of the host names, offset of the host table, the
+# max_log_late_seconds the hour was closed with, and the size of the
+# log rolled up with crc32s of its first and last index.CHECKED_BYTES
+HEADER = struct.Struct("<8sQqQQQqQII")
+# one row per host seen in the hour, sorted by the hash of its name.
+# The hosts that connected to it (in) and that it connected to (out)
+# are stored as row numbers, in the order first seen, and compressed
+# when that makes them smaller, that is when len < count * 4
+HOST = np.dtype([('hash', '<u8'), ('name', '<u8'), ('name_len', '<u4'),
+                 ('in', '<u8'), ('in_len', '<u4'), ('in_count', '<u4'),
+                 ('out', '<u8'), ('out_len', '<u4'), ('out_count', '<u4')])
+
+
+def rollup_path(path):
+    return path + ROLLUP_SUFFIX
+
+
+class RollupHour:
+    """
+    The rollup of one closed hour of a log, memory mapped: for every
+    host seen in it, the distinct hosts that connected to it and that
+    it connected to. Looking a host up is a binary search on the hash
+    of its name, and only its own neighbors are then read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.inode, self.hour, n, self.names_at, table_at,
+         self.max_log_late_seconds, *self.source) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise Exception(f"{path} is not a connspy rollup")
+        self.hosts = np.frombuffer(self.mm, HOST, n, table_at)
+
+    def _name(self, row):
+        start = self.names_at + int(self.hosts['name'][row])
+        return self.mm[start:start + int(self.hosts['name_len'][row])].decode()
+
+    def _row(self, name):
+        h = hash_strings([name])[0]
+        row = np.searchsorted(self.hosts['hash'], h)
+        if row < len(self.hosts) and self.hosts['hash'][row] == h and self._name(row) == name:
+            return row
+        return None
+
+    def neighbors(self, name, direction='in'):
+        """ hosts that connected to name ('in') or that name connected to ('out') """
+        row = self._row(name)
+        if row is None:
+            return []
+        host = self.hosts[row]
+        count, size = int(host[direction + '_count']), int(host[direction + '_len'])
+        start = self.names_at + int(host[direction])
+        data = self.mm[start:start + size]
+        if size < count * 4:
+            data = zlib.decompress(data)
+        return [self._name(row) for row in np.frombuffer(data, np.int32).tolist()]
+
+    def close(self):
+        self.hosts = None
+        try:
+            self.mm.close()
+        except BufferError:
+            pass        # someone still holds a view, the gc will do it
+
+
+def _pack_ids(ids):
+    data = ids.astype(np.int32).tobytes()
+    packed = zlib.compress(data)
+    return packed if len(packed) < len(data) else data
+
+
+def write_hour(path, source, hour, hosts, pairs, max_log_late_seconds):
+    """
+    Writes the rollup of an hour to path, pairs being the paired
+    (to, frm) ids (see hosts.pair_ids) of hosts, a HostTable, in the
+    order first seen. source is the (inode, size, head_crc, tail_crc)
+    of the log rolled up.
+    """
+    inode, size_rolled, head_crc, tail_crc = source
+    to, frm = unpair_ids(pairs)
+    ids = np.unique(np.concatenate((to, frm)))
+    names = [hosts[i] for i in ids.tolist()]
+    hashes = hash_strings(names)
+    order = np.argsort(hashes, kind='stable')
+    # host id -> row, rows being sorted by hash
+    rows = np.empty(len(ids), np.int32)
+    rows[order] = np.arange(len(ids), dtype=np.int32)
+    to_rows, frm_rows = rows[np.searchsorted(ids, to)], rows[np.searchsorted(ids, frm)]
+
+    table = np.zeros(len(ids), HOST)
+    table['hash'] = hashes[order]
+    blob = []
+    size = 0
+    for row in order.tolist():
+        name = names[row].encode()
+        blob.append(name)
+        table['name'][rows[row]] = size
+        table['name_len'][rows[row]] = len(name)
+        size += len(name)
+
+    # a stable sort keeps the neighbors of each host in the order first seen
+    for direction, key, other in (('in', to_rows, frm_rows), ('out', frm_rows, to_rows)):
+        by = np.argsort(key, kind='stable')
+        keys, starts, counts = np.unique(key[by], return_index=True, return_counts=True)
+        for row, start, count in zip(keys.tolist(), starts.tolist(), counts.tolist()):
+            data = _pack_ids(other[by[start:start + count]])
+            table[direction][row] = size
+            table[direction + '_len'][row] = len(data)
+            table[direction + '_count'][row] = count
+            blob.append(data)
+            size += len(data)
+
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, inode, int(hour), len(ids), HEADER.size,
+                            HEADER.size + size, max_log_late_seconds,
+                            size_rolled, head_crc, tail_crc))
+        f.write(b"".join(blob))
+        f.write(table.tobytes())
+    os.replace(tmp, path)
+
+
+def write_late(path, source, max_log_late_seconds, hosts, late):
+    """
+    Writes the lines too late for their hour to path, as text: a first
+    line of MAGIC, the source (see write_hour) and max_log_late_seconds,
+    then the timestamp of each line, the latest timestamp read up to it
+    and its hosts. late is a list of (ts, latest, frm, to) arrays.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write(" ".join([MAGIC.decode()] + [str(v) for v in (*source, max_log_late_seconds)]) + "\n")
+        for ts, latest, frm, to in late:
+            for line in zip(ts.tolist(), latest.tolist(), frm.tolist(), to.tolist()):
+                f.write(f"{line[0]!r} {line[1]!r} {hosts[line[2]]} {hosts[line[3]]}\n")
+    os.replace(tmp, path)
+
+
+def build_rollup(path, max_log_late_seconds=5 * 60):
+    """
+    Writes the rollup of every closed hour of the log at path to its
+    rollup directory, an hour being closed once a line more than
+    max_log_late_seconds past its end was read. Returns the hours.
+    """
+    out = rollup_path(path)
+    os.makedirs(out, exist_ok=True)
+    with open(path, 'rb') as log:
+        statinfo = os.fstat(log.fileno())
+        # what's appended after doesn't change those
+        source = (statinfo.st_ino, statinfo.st_size, *checksums(log, statinfo.st_size))
+    limit = HOUR + max_log_late_seconds
+    hosts = HostTable()
+    # the (to, frm) pairs of each open hour, deduplicated a chunk at a time
+    hours = Windows(HOUR, factory=list)
+    written = []
+    late = []
+
+    def close(hour):
+        pairs = first_seen(np.concatenate(hours.pop(hour)))
+        write_hour(os.path.join(out, f"{int(hour)}{HOUR_SUFFIX}"), source, hour, hosts, pairs,
+                   max_log_late_seconds)
+        written.append(hour)
+
+    latest_ts = -np.inf
+    for ts, frm, to in read_columns(path, hosts):
+        if not len(ts):
+            continue
+        starts = hours.starts_array(ts)[0]
+        # a scan of the hour alone stops before the lines read once the
+        # latest timestamp is max_log_late_seconds past its end. Those
+        # are kept apart, with that latest timestamp, for the scans of
+        # longer ranges that get to them (see Rollups.late_lines)
+        latest = np.maximum(np.maximum.accumulate(ts), latest_ts)
+        too_late = latest >= starts + limit
+        if too_late.any():
+            late.append((ts[too_late], latest[too_late], frm[too_late], to[too_late]))
+        on_time = ~too_late
+        pairs = pair_ids(to, frm)
+        for hour in first_seen(starts[on_time]).tolist():
+            hours[hour].append(first_seen(pairs[on_time & (starts == hour)]))
+        latest_ts = float(latest[-1])
+        while hours and latest_ts - hours.oldest() > limit:
+            close(hours.oldest())
+
+    write_late(os.path.join(out, LATE_NAME), source, max_log_late_seconds, hosts, late)
+    too_late = sum(len(ts) for ts, _, _, _ in late)
+    if too_late:
+        logger.info(f"{too_late} lines were too late for their hour, kept apart")
+    logger.info(f"{len(written)} hours rolled up, {len(hours)} still open")
+    return written
+
+
+def read_header(path):
+    """ the HEADER fields of the rollup hour at path, None if it isn't one """
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+    if len(data) < HEADER.size or not data.startswith(MAGIC):
+        return None
+    return HEADER.unpack(data)
+
+
+def read_late(path):
+    """
+    the (header, lines) of the late lines at path (see write_late),
+    lines being (ts, latest, frm, to), None if it isn't one
+    """
+    with open(path) as f:
+        header = f.readline().split()
+        if header[:1] != [MAGIC.decode()]:
+            return None
+        ts, latest, frm, to = [], [], [], []
+        for line in f:
+            fields = line.split()
+            ts.append(float(fields[0]))
+            latest.append(float(fields[1]))
+            frm.append(fields[2])
+            to.append(fields[3])
+    return [int(v) for v in header[1:]], (np.array(ts), np.array(latest), frm, to)
+
+
+class Rollups:
+    """
+    The rollup hours of a log, by start of the hour. Only their headers
+    are read up front, an hour is mapped the first time it's looked up
+    (see get), so a long lived process only maps what it queries.
+    """
+
+    def __init__(self, path, max_log_late_seconds):
+        self.path = path
+        self.max_log_late_seconds = max_log_late_seconds
+        self.hours = {}         # start of the hour: path of its rollup
+        self.mapped = {}        # start of the hour: RollupHour
+        self.headers = {}       # path of a rollup file: ((inode, mtime), what's read of it)
+        self.late = None        # the late lines (see read_late)
+        self.refresh()
+
+    def _read(self, path, reader):
+        """ reader(path), only read again once the file changed """
+        statinfo = os.stat(path)
+        key = (statinfo.st_ino, statinfo.st_mtime_ns)
+        if self.headers.get(path, (None,))[0] != key:
+            self.headers[path] = (key, reader(path))
+        return self.headers[path][1]
+
+    def refresh(self):
+        """
+        picks up the hours rolled up since, and drops those of a log
+        replaced or rewritten since
+        """
+        out = rollup_path(self.path)
+        if not os.path.isdir(out):
+            return
+        statinfo = os.stat(self.path)
+        crcs = {}       # size rolled up: crcs of as much of the log now
+
+        def current(inode, max_log_late_seconds, size, head_crc, tail_crc):
+            # not of an older log by the same name, nor of this one
+            # rewritten in place, nor with lines let be later than we do
+            if (inode != statinfo.st_ino or size > statinfo.st_size or
+                    max_log_late_seconds != self.max_log_late_seconds):
+                return False
+            if size not in crcs:
+                with open(self.path, 'rb') as log:
+                    crcs[size] = checksums(log, size)
+            return crcs[size] == (head_crc, tail_crc)
+
+        self.hours = {}
+        for name in os.listdir(out):
+            path = os.path.join(out, name)
+            if name.endswith(HOUR_SUFFIX):
+                header = self._read(path, read_header)
+                if header is not None and current(header[1], *header[6:]):
+                    self.hours[header[2]] = path
+        # an hour mapped stays good as long as the log it was rolled up from
+        for hour, rollup in list(self.mapped.items()):
+            if hour not in self.hours or not current(rollup.inode, rollup.max_log_late_seconds, *rollup.source):
+                self.mapped.pop(hour).close()
+
+        self.late = None
+        path = os.path.join(out, LATE_NAME)
+        late = self._read(path, read_late) if os.path.exists(path) else None
+        if late is not None:
+            (inode, size, head_crc, tail_crc, max_log_late_seconds), lines = late
+            if current(inode, max_log_late_seconds, size, head_crc, tail_crc):
+                self.late = lines
+
+    def get(self, hour):
+        """ the RollupHour of the hour starting at hour, mapped on first use """
+        rollup = self.mapped.get(hour)
+        if rollup is None:
+            rollup = self.mapped[hour] = RollupHour(self.hours[hour])
+        return rollup
+
+    def within(self, time_init, time_end):
+        """ starts of the rolled up hours wholly in [time_init, time_end) """
+        return sorted(hour for hour in self.hours
+                      if time_init <= hour and hour + HOUR <= time_end)
+
+    def late_lines(self, time_init, time_end, until):
+        """
+        (frm, to) of the lines in [time_init, time_end) that were too
+        late for a scan of their hour alone, but that a scan stopping
+        once the latest timestamp gets to until reads, in log order
+        """
+        if self.late is None:
+            return []
+        ts, latest, frm, to = self.late
+        rows = np.flatnonzero((time_init <= ts) & (ts < time_end) & (latest < until))
+        return [(frm[row], to[row]) for row in rows.tolist()]
+
+    def close(self):
+        for hour in self.mapped.values():
+            hour.close()
+        self.mapped = {}
+
+
+def load_rollups(path, max_log_late_seconds=5 * 60):
+    """
+    the Rollups of the log at path made with the same
+    max_log_late_seconds, None if it has none
+    """
+    if not os.path.isdir(rollup_path(path)):
+        return None
+    rollups = Rollups(path, max_log_late_seconds)
+    if not rollups.hours:
+        return None
+    return rollups
+
+
+def parse_argv(argv):
+    args_parser = argparse.ArgumentParser(description=""
+            "connspy-rollup: roll every closed hour of logs up into the "
+            "distinct hosts each host connected to and from, so connspy "
+            "can answer long ranges without reading every line")
+    args_parser.add_argument('--max_log_late_seconds', type=int,
+            required=False, default=5 * 60,
+            help='the maximum time in seconds a log line can be late, '
+                 'an hour is only rolled up once no more can come')
+    args_parser.add_argument('files', type=str, nargs='+',
+            help='the log files to roll up')
+    args = args_parser.parse_args(argv)
+
+    if args.max_log_late_seconds < 0:
+        raise Exception("max_log_late_seconds mist be positive")
+    return args
+
+
+def main():
+    args = parse_argv(sys.argv[1:])
+    for path in args.files:
+        logger.info("rolling up " + path)
+        build_rollup(path, args.max_log_late_seconds)
+
+
+if __name__ == '__main__':
+    main()
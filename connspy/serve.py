@@ -0,0 +1,439 @@
+import os
+import re
+import sys
+import copy
+import json
+import math
+import mmap
+import signal
+import logging
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from connspy import aio
+from connspy.parser import Parser, VALID_HOST_REGEX, read_chunks
+from connspy.binaryseek import mapped_range, latest_timestamp, block_size
+from connspy.index import load_index
+from connspy.compressed import compression, open_log
+from connspy.pack import PackFile, is_packed, to_seconds
+from connspy.rollup import load_rollups, HOUR
+from connspy.connspy import process_chunks, process_packed
+from connspy.metrics import parse_target
+
+logger = logging.getLogger("serve")
+
+# host names kept in the cache, over all its hours
+DEFAULT_CACHE_HOSTS = 10 ** 7
+
+
+def parse_listen(addr):
+    """
+    unix:PATH, or http:[HOST:]PORT with HOST defaulting to 127.0.0.1.
+    Returns ('unix', path) or ('http', host, port)
+    """
+    if addr.startswith("unix:"):
+        return aio.parse_listen(addr)
+    if addr.startswith("http:"):
+        return parse_target(addr)
+    raise Exception(f"cannot listen on {addr}, expected unix:PATH or http:[HOST:]PORT")
+
+
+class Log:
+    """
+    A log kept open from one query to the next, with whatever connspy
+    would otherwise open afresh each time: the file itself and a map of
+    it to seek in, its index and rollups, or its pack. The latest
+    timestamp says which hours are over and done with as far as the log
+    goes. Packs and indexed compressed logs know it without a scan, a
+    compressed log without an index doesn't, so then whatever is known
+    of it is forgotten whenever it changes at all.
+    """
+
+    def __init__(self, path, args):
+        self.path = path
+        self.args = args
+        self.open()
+
+    def open(self, rollups=None):
+        """ opens the log, picking up where rollups, of the same log, left off """
+        statinfo = os.stat(self.path)
+        self.inode, self.size = statinfo.st_ino, statinfo.st_size
+        self.f = self.mm = self.pack = self.index = self.rollups = None
+        self.latest_ts = math.inf
+        self.compressed = compression(self.path) is not None
+        if rollups is not None:
+            rollups.refresh()
+            self.rollups = rollups
+        elif not self.args.norollup:
+            self.rollups = load_rollups(self.path, self.args.max_log_late_seconds)
+        if is_packed(self.path):
+            self.pack = PackFile(self.path)
+            max_ts = self.pack.blocks['max_ts']
+            self.latest_ts = float(to_seconds(max_ts.max())) if len(max_ts) else -math.inf
+            return
+
+        self.f = open(self.path, 'rb')
+        if not self.args.noindex:
+            self.index = load_index(self.path)
+        if self.compressed and self.index is not None:
+            self.latest_ts = float(self.index.blocks['max_ts'].max(initial=-math.inf))
+        elif not self.compressed:
+            self.latest_ts = -math.inf
+            if self.size:
+                self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+                ts = latest_timestamp(self.mm, self.size)
+                if ts is not None:
+                    self.latest_ts = ts
+
+    def refresh(self):
+        """
+        Catches up with the log if it changed since the last query.
+        Returns True if it was replaced or truncated, or changed at all
+        without its latest timestamp being known, whatever was known of
+        it then being no good.
+        """
+        statinfo = os.stat(self.path)
+        if statinfo.st_ino == self.inode and statinfo.st_size == self.size:
+            return False
+        replaced = (statinfo.st_ino != self.inode or statinfo.st_size < self.size or
+                    self.latest_ts == math.inf)
+        # appended to: the index gets extended, the map and the latest
+        # timestamp redone, and the hours rolled up since picked up
+        # along with those already mapped
+        rollups = None
+        if not replaced:
+            rollups, self.rollups = self.rollups, None
+        self.close()
+        self.open(rollups)
+        if replaced:
+            logger.info(f"{self.path} was replaced, forgetting it")
+        return replaced
+
+    def seekable(self):
+        """ whether range() can bound a scan, rather than it reading from the start """
+        return (self.pack is not None or self.index is not None or
+                not (self.compressed or self.args.nofastseek))
+
+    def range(self, time_init, time_end):
+        """ as connspy.find_range, with what's already open """
+        if self.index is not None:
+            return self.index.range(time_init, time_end, self.args.max_log_late_seconds)
+        if not self.seekable():
+            return None
+        if self.size < 5 * block_size:
+            return 0, None
+        return mapped_range(self.mm, self.size, time_init, time_end,
+                            self.args.max_log_late_seconds)
+
+    def scan(self, args, callback, hourly=False):
+        """
+        connspy.scan for args, the time range and targets of a query,
+        hour by hour with hourly (see connspy.process_chunks), which
+        packs don't do, being seekable
+        """
+        if self.pack is not None:
+            process_packed(self.pack, args, callback)
+            return
+
+        byte_range = self.range(args.time_init, args.time_end)
+        start, end = byte_range if byte_range is not None else (0, None)
+        if self.compressed:
+            with open_log(self.path, start, end) as f:
+                process_chunks(read_chunks(f), args, callback, hourly=hourly)
+            return
+        self.f.seek(start)
+        process_chunks(read_chunks(self.f, limit=None if end is None else end - start),
+                       args, callback, hourly=hourly)
+
+    def close(self):
+        for resource in (self.mm, self.f, self.pack, self.index, self.rollups):
+            if resource is not None:
+                resource.close()
+
+
+class Server:
+    """
+    Answers connspy queries, the hosts that connected to some targets
+    in a time range, from logs kept open (see Log). Every hour wholly
+    in a range is answered on its own and kept in an LRU cache, by log,
+    target and hour, so queries over overlapping ranges only scan the
+    hours not seen before. The partial hours at either end are scanned
+    each time. An hour is only cached once the log is past it, late
+    lines included.
+
+    As with rollups, hosts come out hour after hour, in the order first
+    seen within each, target after target.
+    """
+
+    def __init__(self, paths, args):
+        self.args = args
+        self.logs = OrderedDict((path, Log(path, args)) for path in paths)
+        self.cache = OrderedDict()      # (path, to, hour) -> tuple of frm
+        self.cached_hosts = 0
+        self.lock = threading.Lock()
+
+    def query(self, to, time_init, time_end, path=None):
+        """
+        Returns the (frm, to) of connspy --to each of to and --time_init,
+        --time_end for the log at path, the first one served if None,
+        and how many hours came from the cache and were scanned.
+        """
+        if path is None:
+            path = next(iter(self.logs))
+        if path not in self.logs:
+            raise Exception(f"{path} is not served")
+
+        with self.lock:
+            log = self.logs[path]
+            if log.refresh():
+                self.forget(path)
+
+            hits, seen = [], set()
+            def report(frm, to):
+                if (to, frm) not in seen:
+                    seen.add((to, frm))
+                    hits.append((frm, to))
+
+            stats = {'cached_hours': 0, 'scanned_hours': 0}
+            first = math.ceil(time_init / HOUR) * HOUR
+            hours = list(range(first, int(time_end - HOUR) + 1, HOUR))
+            found = self.hours(log, to, hours, stats)
+            scanned_to = time_init
+            for hour in hours:
+                self.scan(log, to, scanned_to, hour, report)
+                for target in to:
+                    for frm in found[hour][target]:
+                        report(frm, target)
+                scanned_to = hour + HOUR
+            self.scan(log, to, scanned_to, time_end, report)
+        return hits, stats
+
+    def hours(self, log, to, hours, stats):
+        """
+        {hour: {target: hosts}} for each of to in each of hours, from
+        the cache if it can. Where the log can't be seeked in, each run
+        of hours not cached nor rolled up is scanned in one go rather
+        than reading the log from the start for every one of them.
+        """
+        found, missing = {}, {}
+        for hour in hours:
+            found[hour] = {}
+            for target in to:
+                names = self.cache.get((log.path, target, hour))
+                if names is not None:
+                    self.cache.move_to_end((log.path, target, hour))
+                    found[hour][target] = names
+            missing[hour] = [target for target in to if target not in found[hour]]
+            stats['cached_hours' if not missing[hour] else 'scanned_hours'] += 1
+
+        runs = []       # of consecutive hours to scan together
+        for hour in hours:
+            if not missing[hour]:
+                continue
+            if log.seekable() or (log.rollups is not None and hour in log.rollups.hours):
+                found[hour].update(self.fill(log, missing[hour], hour))
+            elif runs and runs[-1][-1] == hour - HOUR:
+                runs[-1].append(hour)
+            else:
+                runs.append([hour])
+
+        for run in runs:
+            targets = list(dict.fromkeys(target for hour in run for target in missing[hour]))
+            scanned = {hour: {target: [] for target in targets} for hour in run}
+            self.scan(log, targets, run[0], run[-1] + HOUR,
+                      lambda frm, target, hour: scanned[hour][target].append(frm), hourly=True)
+            for hour in run:
+                names = {target: tuple(scanned[hour][target]) for target in missing[hour]}
+                if self.over(log, hour):
+                    self.keep(log, hour, names)
+                found[hour].update(names)
+        return found
+
+    def fill(self, log, to, hour):
+        """ {target: hosts} for the hour, rolled up or scanned, cached if it's over """
+        if log.rollups is not None and hour in log.rollups.hours:
+            rollup = log.rollups.get(hour)
+            found = {target: tuple(rollup.neighbors(target)) for target in to}
+        else:
+            found = {target: [] for target in to}
+            self.scan(log, to, hour, hour + HOUR, lambda frm, target: found[target].append(frm))
+            found = {target: tuple(names) for target, names in found.items()}
+            if not self.over(log, hour):
+                return found    # there may be more of it to come
+        self.keep(log, hour, found)
+        return found
+
+    def over(self, log, hour):
+        """ whether the log is past the hour, late lines included """
+        return hour + HOUR + self.args.max_log_late_seconds <= log.latest_ts
+
+    def keep(self, log, hour, found):
+        """ caches {target: hosts} of the hour, making room for them """
+        for target, names in found.items():
+            self.cache[(log.path, target, hour)] = names
+            self.cached_hosts += len(names)
+        while self.cached_hosts > self.args.cache_hosts and self.cache:
+            _, names = self.cache.popitem(last=False)
+            self.cached_hosts -= len(names)
+
+    def scan(self, log, to, time_init, time_end, callback, hourly=False):
+        if time_init < time_end:
+            part = copy.copy(self.args)
+            part.file, part.to = log.path, to
+            part.time_init, part.time_end = time_init, time_end
+            log.scan(part, callback, hourly)
+
+    def forget(self, path):
+        for key in [key for key in self.cache if key[0] == path]:
+            self.cached_hosts -= len(self.cache.pop(key))
+
+    def answer(self, request):
+        """
+        The JSON-able reply to a request, a dict with to (a host or a
+        list of them), time_init, time_end and optionally file
+        """
+        try:
+            to, time_init, time_end = parse_query(request.get('to'), request.get('time_init'),
+                                                  request.get('time_end'))
+            hits, stats = self.query(to, time_init, time_end, request.get('file'))
+        except Exception as e:
+            return {'error': str(e)}
+        stats['hits'] = [{'to': to, 'from': frm} for frm, to in hits]
+        return stats
+
+    def close(self):
+        for log in self.logs.values():
+            log.close()
+
+
+def parse_query(to, time_init, time_end):
+    """ a query's to hosts and time range checked as connspy would, see connspy.parse_argv """
+    if isinstance(to, str):
+        to = [to]
+    if not to:
+        raise Exception("at least one to host is needed")
+    to = list(dict.fromkeys(str(host).lower() for host in to))
+    for host in to:
+        if not re.match(VALID_HOST_REGEX, host):
+            raise Exception(f"invalid to-host {host} . Must match " + VALID_HOST_REGEX)
+    time_init = Parser.parse_ts(str(time_init))
+    if not time_init:
+        raise Exception("time_init invalid")
+    time_end = Parser.parse_ts(str(time_end))
+    if not time_end:
+        raise Exception("time_end invalid")
+    if time_end < time_init:
+        raise Exception("time_end is before time_init")
+    return to, time_init, time_end
+
+
+def http_server(server, host, port):
+    """ GET /query?to=HOST&time_init=TS&time_end=TS[&file=PATH], to repeatable """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/query':
+                self.send_error(404)
+                return
+            params = parse_qs(url.query)
+            request = {key: values[0] for key, values in params.items()}
+            request['to'] = params.get('to', [])
+            reply = server.answer(request)
+            body = json.dumps(reply).encode()
+            self.send_response(400 if 'error' in reply else 200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    listener = ThreadingHTTPServer((host, port), Handler)
+    listener.daemon_threads = True
+    return listener
+
+
+def unix_server(server, path):
+    """ a JSON request per line, as for Server.answer, a JSON reply per line """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    reply = {'error': f"bad request: {e}"}
+                else:
+                    reply = server.answer(request)
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+    if os.path.exists(path):
+        os.unlink(path)     # left behind by an earlier run
+    listener = socketserver.ThreadingUnixStreamServer(path, Handler)
+    # a client may stay connected for good, which must not hold up closing
+    listener.daemon_threads = True
+    return listener
+
+
+def parse_argv(argv):
+    args_parser = argparse.ArgumentParser(prog='connspy serve', description=""
+            "connspy serve: keep logs open and answer connspy queries over a "
+            "UNIX socket or HTTP, caching the answer for each whole hour")
+    args_parser.add_argument('--listen', type=str, required=True,
+            help='unix:PATH for a JSON request per line, or http:[HOST:]PORT '
+                 'for GET /query?to=HOST&time_init=TS&time_end=TS')
+    args_parser.add_argument('--cache_hosts', type=int, default=DEFAULT_CACHE_HOSTS,
+            help='the most host names kept in the cache of hours, the least '
+                 'recently used hours going first')
+    args_parser.add_argument('--max_log_late_seconds', type=int,
+            required=False, default=5 * 60,
+            help='the maximum time in seconds a log line can be late, relative to minimum time')
+    args_parser.add_argument('--nofastseek', action='store_true',
+            default=False, help='do not use fast block seek to start time')
+    args_parser.add_argument('--noindex', action='store_true',
+            default=False, help='ignore the index sidecar written by connspy-index')
+    args_parser.add_argument('--norollup', action='store_true',
+            default=False, help='ignore the hourly rollups written by connspy-rollup')
+    args_parser.add_argument('files', type=str, nargs='+',
+            help='the logs to answer for, the first one unless a query says')
+
+    args = args_parser.parse_args(argv)
+    args.listen = parse_listen(args.listen)
+    if args.max_log_late_seconds < 0:
+        raise Exception("max_log_late_seconds mist be positive")
+    if args.cache_hosts < 0:
+        raise Exception("cache_hosts can't be negative")
+    return args
+
+
+def main(argv=None):
+    args = parse_argv(sys.argv[1:] if argv is None else argv)
+    server = Server(args.files, args)
+    if args.listen[0] == 'unix':
+        listener = unix_server(server, args.listen[1])
+    else:
+        listener = http_server(server, *args.listen[1:])
+    logger.info(f"serving {', '.join(args.files)} on {listener.server_address}")
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        listener.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.server_close()
+        if args.listen[0] == 'unix':
+            os.unlink(args.listen[1])
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import sys
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+
+# text written out at a time, for connspy's hosts
+BUFFER_BYTES = 2 ** 20
+# rows inserted in one transaction, for connspy's hosts
+BATCH_ROWS = 50000
+
+KINDS = ('tsv', 'jsonl', 'sqlite')
+
+
+def parse_output(spec):
+    """
+    tsv, jsonl or sqlite, followed by :PATH to write to a file rather
+    than STDOUT, which sqlite needs. Returns (kind, path or None)
+    """
+    kind, _, path = spec.partition(":")
+    if kind not in KINDS:
+        raise Exception(f"unknown output {spec}, expected tsv, jsonl or sqlite, "
+                        "each with an optional :PATH")
+    if kind == 'sqlite' and not path:
+        raise Exception("sqlite output needs a database, as in sqlite:PATH")
+    return kind, path or None
+
+
+def make_sink(spec, tagged=False):
+    """ the sink for --output spec, see parse_output """
+    kind, path = parse_output(spec)
+    return {'tsv': TsvSink, 'jsonl': JsonlSink, 'sqlite': SqliteSink}[kind](path, tagged)
+
+
+class Sink(ABC):
+    """
+    Where results go. connspy-stream calls a sink with each window as
+    (window, to, frm, most), to and frm being hosts.TargetView, and
+    with --fan_top also fans, {"FAN_IN" or "FAN_OUT": [(host, count)]}.
+    connspy calls hit() with each (frm, to). With tagged, there are
+    several targets and the rows say which one each host is for.
+    close() writes out whatever is still buffered.
+    """
+
+    def __init__(self, path=None, tagged=False):
+        self.path = path
+        self.tagged = tagged
+
+    @abstractmethod
+    def __call__(self, window, to, frm, most, fans=None):
+        """ writes out a window of connspy-stream """
+
+    @abstractmethod
+    def hit(self, frm, to):
+        """ writes out a host connspy found """
+
+    def close(self):
+        pass
+
+
+class TextSink(Sink):
+    """
+    A sink writing lines of text, appended to path or to STDOUT. Each
+    window goes out in a single write once whole, and connspy's hosts
+    BUFFER_BYTES at a time, rather than a write per host.
+    """
+
+    def __init__(self, path=None, tagged=False):
+        super().__init__(path, tagged)
+        self.f = open(path, 'a') if path else sys.stdout
+        self.pending = []
+        self.pending_bytes = 0
+
+    @abstractmethod
+    def hit_line(self, frm, to):
+        """ the line of a host connspy found """
+
+    def write(self, text):
+        self.f.write(text)
+        # a window is done with, so whoever reads us can have it now
+        self.f.flush()
+
+    def hit(self, frm, to):
+        line = self.hit_line(frm, to)
+        self.pending.append(line)
+        self.pending_bytes += len(line)
+        if self.pending_bytes >= BUFFER_BYTES:
+            self.flush()
+
+    def flush(self):
+        self.f.write("".join(self.pending))
+        self.f.flush()
+        self.pending, self.pending_bytes = [], 0
+
+    def close(self):
+        self.flush()
+        if self.path:
+            self.f.close()
+
+
+class TsvSink(TextSink):
+    """
+    connspy-stream's rows, WINDOW TAB KIND TAB HOST with KIND being TO,
+    FROM or MOST, tagged ones with the target before the host, then
+    FAN_IN and FAN_OUT ones with the count after the host.
+    connspy's hosts one per line, tagged ones after their target.
+    """
+
+    def __call__(self, window, to, frm, most, fans=None):
+        text = []
+        for kind, hosts in (("TO", to), ("FROM", frm)):
+            if self.tagged:
+                for target, names in hosts.items():
+                    text.append(_lines(f"{window}\t{kind}\t{target}\t", names))
+            else:
+                text.append(_lines(f"{window}\t{kind}\t", hosts))
+        text.append(_lines(f"{window}\tMOST\t", most))
+        for kind, counts in (fans or {}).items():
+            text.extend(f"{window}\t{kind}\t{host}\t{count}\n" for host, count in counts)
+        self.write("".join(text))
+
+    def hit_line(self, frm, to):
+        return f"{to}\t{frm}\n" if self.tagged else f"{frm}\n"
+
+
+def _lines(prefix, names):
+    """ a line of prefix followed by each of names """
+    names = list(names)
+    if not names:
+        return ""
+    return prefix + ("\n" + prefix).join(names) + "\n"
+
+
+class JsonlSink(TextSink):
+    """
+    A JSON object per row: {"window", "kind", "target", "host"} for
+    connspy-stream, MOST rows having no target and FAN_IN and FAN_OUT
+    ones a "count" too, and {"to", "from"} for connspy. Targets are
+    always given, tagged or not.
+    """
+
+    def __call__(self, window, to, frm, most, fans=None):
+        dumps = json.dumps
+        text = []
+        for kind, hosts in (("TO", to), ("FROM", frm)):
+            for target, names in hosts.items():
+                text.extend(dumps({'window': window, 'kind': kind, 'target': target,
+                                   'host': host}) + "\n" for host in names)
+        text.extend(dumps({'window': window, 'kind': 'MOST', 'target': None,
+                           'host': host}) + "\n" for host in most)
+        for kind, counts in (fans or {}).items():
+            text.extend(dumps({'window': window, 'kind': kind, 'target': None,
+                               'host': host, 'count': count}) + "\n" for host, count in counts)
+        self.write("".join(text))
+
+    def hit_line(self, frm, to):
+        return json.dumps({'to': to, 'from': frm}) + "\n"
+
+
+class SqliteSink(Sink):
+    """
+    Inserts rows straight into the SQLite database at path, no TSV in
+    between: connspy-stream's into windows(window, kind, target, host),
+    MOST rows having a NULL target and coming most active first, and
+    FAN_IN and FAN_OUT ones into fans(window, kind, host, count), and
+    connspy's into hits(target, host). The tables are made if need be.
+    Each window is inserted with a single executemany in a transaction
+    of its own, connspy's hosts BATCH_ROWS at a time.
+    """
+
+    def __init__(self, path, tagged=False):
+        super().__init__(path, tagged)
+        self.db = sqlite3.connect(path)
+        # the rows can be written again from the logs, so durability
+        # can give way to speed
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS windows "
+                            "(window REAL, kind TEXT, target TEXT, host TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS hits (target TEXT, host TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS fans "
+                            "(window REAL, kind TEXT, host TEXT, count INTEGER)")
+        self.pending = []
+
+    def __call__(self, window, to, frm, most, fans=None):
+        rows = []
+        for kind, hosts in (("TO", to), ("FROM", frm)):
+            for target, names in hosts.items():
+                rows.extend((window, kind, target, host) for host in names)
+        rows.extend((window, 'MOST', None, host) for host in most)
+        fan_rows = [(window, kind, host, count) for kind, counts in (fans or {}).items()
+                    for host, count in counts]
+        with self.db:
+            self.db.executemany("INSERT INTO windows VALUES (?, ?, ?, ?)", rows)
+            self.db.executemany("INSERT INTO fans VALUES (?, ?, ?, ?)", fan_rows)
+
+    def hit(self, frm, to):
+        self.pending.append((to, frm))
+        if len(self.pending) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany("INSERT INTO hits VALUES (?, ?)", self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
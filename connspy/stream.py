@@ -1,41 +1,52 @@
+import io
+import os
 import sys
 import logging
 import argparse
 import re
-import datetime
 import time
-from collections import Counter, defaultdict
 from time import sleep
 
-from connspy.bloomset import BloomStringSet
-from connspy.parser import Parser, VALID_HOST_REGEX
+import numpy as np
+
+from connspy.bloomset import BloomIdSet, hash_strings
+from connspy.exactset import ExactIdSet, DEFAULT_MAX_KEYS
+from connspy.hosts import HostTable, pair_ids, unpair_ids, read_host_file
+from connspy.parser import Parser, BatchParser, VALID_HOST_REGEX, read_chunks, first_seen
+from connspy.tail import Tailer
+from connspy.topk import SpaceSaving, DEFAULT_CAPACITY
+from connspy.windows import Windows, parse_duration
+from connspy.checkpoint import Checkpointer, DEFAULT_EVERY_SECONDS
+from connspy.compressed import compression, open_log
+from connspy.pack import PackFile, is_packed
+from connspy.rejects import Rejects
+from connspy.sinks import make_sink, parse_output
+from connspy.metrics import Metrics, Reporter, parse_target, DEFAULT_EVERY_SECONDS as METRICS_SECONDS
+from connspy.merge import merge_columns
+from connspy.hll import HostHLL, DEFAULT_PRECISION
+from connspy import aio
 
 logger = logging.getLogger("stream")
 logger.setLevel(logging.DEBUG)
 
+# the line engine hands its counts over to the metrics this often
+METRICS_LINES = 2 ** 16
 
-class LimitedCounter(Counter):
-    def __init__(self, max_size=30000, reduce_factor=0.5):
-        self.max_size = max_size
-        self.reduce_factor = reduce_factor
-        super().__init__(self)
-
-    def add(self, key):
-        super().add(key)
-        # once in a while, maintain the size in place
-        if len(self.items()) >= self.max_size:
-            desired_size = int(len(self.items()) * self.reduce_factor)
-            # https://github.com/python/cpython/blob/3.7/Lib/collections/__init__.py#L586
-            for k,v in heapq.nsmallest(desired_size, self.items(), key=_itemgetter(1)):
-                del(self[k])
 
 def parse_argv(argv):
     args_parser = argparse.ArgumentParser(description=""
             "connspy: parse connection logs to see who is connecting to who")
-    args_parser.add_argument('--to', type=str, required=True,
-            help='Collect all hosts who connected to this host')
-    args_parser.add_argument('--from', type=str, dest='frm', required=True,
-            help='Collect all hosts who this host connected to')
+    args_parser.add_argument('--to', type=str, required=False, action='append',
+            default=[], help='Collect all hosts who connected to this host. '
+                             'Can be given several times')
+    args_parser.add_argument('--to_file', type=str, required=False,
+            help='a file listing more --to hosts, one per line')
+    args_parser.add_argument('--from', type=str, dest='frm', required=False,
+            action='append', default=[],
+            help='Collect all hosts who this host connected to. '
+                 'Can be given several times')
+    args_parser.add_argument('--from_file', type=str, required=False,
+            help='a file listing more --from hosts, one per line')
     args_parser.add_argument('--only_complete_hours', default=False,
             action='store_true', 
             help='Normally at end of batch, partially completed hours are '
@@ -51,134 +62,636 @@ def parse_argv(argv):
             required=False, default=5 * 60, 
             help='the maximum time in seconds a log line can be late, '
                  'relative to minimum time')
+    args_parser.add_argument('--window', type=str, required=False, default='1h',
+            help='summarize windows this long, say 1m, 5m, 1h or 1d')
+    args_parser.add_argument('--hop', type=str, required=False, default=None,
+            help='start a window this often, for sliding windows. '
+                 'Must divide --window. Defaults to --window')
+    args_parser.add_argument('--engine', choices=['batch', 'line'], default='batch',
+            help='batch parses large chunks at once into numpy columns, '
+                 'line parses one line at a time')
+    args_parser.add_argument('--top', type=int, required=False, default=1,
+            help='output this many of the most active hosts per window')
+    args_parser.add_argument('--most_capacity', type=int, required=False,
+            default=DEFAULT_CAPACITY,
+            help='hosts counted per window to find the most active. Counts '
+                 'are exact up to this many distinct hosts, and past it '
+                 'over by at most connections / most_capacity')
+    args_parser.add_argument('--fan_top', type=int, required=False, default=0,
+            help='also output this many hosts with the most distinct hosts '
+                 'connecting to them (FAN_IN) and connected to (FAN_OUT) per '
+                 'window, out of every host, as estimated by HyperLogLog')
+    args_parser.add_argument('--fan_precision', type=int, required=False,
+            default=DEFAULT_PRECISION,
+            help='2 to the power of this many one byte registers per host and '
+                 'window for --fan_top, estimates being within about '
+                 '104%% / the square root of that')
+    args_parser.add_argument('--distinct', choices=['bloom', 'exact'], default='bloom',
+            help='how TO and FROM hosts are deduplicated. bloom has a tiny '
+                 'chance of missing a host, exact spills to disk past '
+                 '--distinct_max_keys hosts')
+    args_parser.add_argument('--distinct_max_keys', type=int, required=False,
+            default=DEFAULT_MAX_KEYS,
+            help='with --distinct exact, hosts kept in memory per set before '
+                 'a sorted run of them is spilled to disk')
+    args_parser.add_argument('--workers', type=int, required=False, default=1,
+            help='summarize files, or byte ranges of big files, in this many '
+                 'processes and merge the hourly summaries')
+    args_parser.add_argument('--merge', default=False, action='store_true',
+            help='the files overlap in time, read them all at once and merge '
+                 'their lines in timestamp order rather than one file after another')
+    args_parser.add_argument('--listen', type=str, required=False,
+            action='append', default=[],
+            help='also read lines written to this socket, unix:PATH or '
+                 'HOST:PORT. Can be given several times. Implies --concurrent')
+    args_parser.add_argument('--concurrent', default=False, action='store_true',
+            help='read all files (and sockets) at once on an asyncio loop, '
+                 'with --tail following every one of them')
+    args_parser.add_argument('--checkpoint_dir', type=str, required=False,
+            help='save the state to this directory every so often, and on '
+                 'start pick up from the last state saved there')
+    args_parser.add_argument('--checkpoint_seconds', type=int, required=False,
+            default=DEFAULT_EVERY_SECONDS,
+            help='with --checkpoint_dir, save at least this often')
+    args_parser.add_argument('--metrics', type=str, required=False,
+            help='keep counters of lines, rejects, lag, windows and memory and '
+                 'report them as JSON lines to stderr, and to a Prometheus text '
+                 'file at this path or on a local endpoint with http:[HOST:]PORT '
+                 '(or just stderr with stderr)')
+    args_parser.add_argument('--metrics_seconds', type=int, required=False,
+            default=METRICS_SECONDS,
+            help='with --metrics, report this often')
+    args_parser.add_argument('--output', type=str, required=False, default='tsv',
+            help='tsv, jsonl or sqlite, each with an optional :PATH to write to '
+                 'instead of STDOUT, sqlite:PATH inserting the rows straight '
+                 'into that SQLite database')
+    args_parser.add_argument('--quarantine', type=str, required=False,
+            help='append malformed lines to this file, each with the file it '
+                 'came from, its byte offset and why it was rejected')
     args_parser.add_argument('files', type=str, nargs='*', default=None,
             help='the files to parse, separated by space. Leave blank for STDIN') 
     args = args_parser.parse_args(argv) 
 
-    args.to = args.to.lower()
-    args.frm = args.frm.lower()
+    if args.to_file:
+        args.to.extend(read_host_file(args.to_file))
+    if args.from_file:
+        args.frm.extend(read_host_file(args.from_file))
+    # dedup, but keep the order given
+    args.to = list(dict.fromkeys(to.lower() for to in args.to))
+    args.frm = list(dict.fromkeys(frm.lower() for frm in args.frm))
 
     if args.max_log_late_seconds < 0:
         raise Exception("max_log_late_seconds mist be positive")
-    if args.to and not re.match(VALID_HOST_REGEX, args.to):
-        raise Exception("invalid to-host format. Must match " + VALID_HOST_REGEX)
-    if args.frm and not re.match(VALID_HOST_REGEX, args.frm):
-        raise Exception("invalid from-host format. Must match " + VALID_HOST_REGEX)
-    if not args.tail and not args.files:
+    args.window = parse_duration(args.window)
+    args.hop = parse_duration(args.hop) if args.hop is not None else args.window
+    if args.window % args.hop:
+        raise Exception("window must be a multiple of hop")
+    if not args.to and not args.frm:
+        raise Exception("at least one --to or --from host is needed")
+    for to in args.to:
+        if not re.match(VALID_HOST_REGEX, to):
+            raise Exception(f"invalid to-host {to}. Must match " + VALID_HOST_REGEX)
+    for frm in args.frm:
+        if not re.match(VALID_HOST_REGEX, frm):
+            raise Exception(f"invalid from-host {frm}. Must match " + VALID_HOST_REGEX)
+    if not args.tail and not args.files and not args.listen:
         raise Exception("You must either --tail for STDIN or provide at least one file")
+    if args.workers < 1:
+        raise Exception("workers must be at least 1")
+    if args.distinct_max_keys < 1:
+        raise Exception("distinct_max_keys must be at least 1")
+    if args.top < 1:
+        raise Exception("top must be at least 1")
+    if args.most_capacity < args.top:
+        raise Exception("most_capacity must be at least top")
+    if args.fan_top < 0:
+        raise Exception("fan_top can't be negative")
+    if args.fan_top and args.engine != 'batch':
+        raise Exception("--fan_top only works with the batch engine")
+    if not 4 <= args.fan_precision <= 16:
+        raise Exception("fan_precision must be between 4 and 16")
+    if args.listen:
+        args.concurrent = True
+        for addr in args.listen:
+            aio.parse_listen(addr)
+    if args.concurrent and args.workers > 1:
+        raise Exception("--concurrent and --workers can't be used together")
+    if args.concurrent and not args.files and not args.listen:
+        raise Exception("--concurrent needs files or a --listen socket")
+    if args.checkpoint_dir:
+        if args.engine != 'batch' or args.workers > 1 or args.concurrent:
+            raise Exception("--checkpoint_dir only works with the batch engine, "
+                            "one worker and without --concurrent")
+        if not args.files:
+            raise Exception("--checkpoint_dir needs files, STDIN can't be resumed")
+    parse_output(args.output)
+    if args.merge:
+        if args.engine != 'batch' or args.workers > 1 or args.concurrent or args.tail:
+            raise Exception("--merge only works with the batch engine, one worker, "
+                            "without --concurrent and without --tail")
+        if not args.files or args.checkpoint_dir:
+            raise Exception("--merge needs files, and can't be resumed from a checkpoint")
+    if args.quarantine and (args.engine != 'batch' or args.concurrent):
+        raise Exception("--quarantine only works with the batch engine, "
+                        "and without --concurrent")
+    if args.metrics:
+        parse_target(args.metrics)
+        if args.metrics_seconds < 1:
+            raise Exception("metrics_seconds must be at least 1")
 
     return args
 
 # for convinience, but I should switch to keys
 TO, FROM, MOST = 0, 1, 2
+# and with --fan_top, the HostHLL of every host's peers each way
+FAN_IN, FAN_OUT = 3, 4
 class Processor:
 
     def __init__(self, args, callback):
         self.args = args
         self.callback = callback
-        self.hourly_summaries = defaultdict(lambda: [BloomStringSet(), BloomStringSet(), LimitedCounter()])
-
-    def hour_of(self, ts):
-        dt = datetime.datetime.utcfromtimestamp(ts)
-        # while you could ts % 3600, there have been like 40 leap
-        # seconds since 1970, and I'm sure UNIX type people
-        # def care about that kind of stuff
-        ts = datetime.datetime(dt.year, dt.month, dt.day, 
-                                 dt.hour, 0, 0, 
-                                 tzinfo=datetime.timezone.utc).timestamp()
-        return ts
-
-    def process(self, f, tail=False):
-        parser = Parser()
-        hourly_summaries = self.hourly_summaries
-        args = self.args
-        callback = self.callback
-
-        # bookkeeping... we need current hour and
-        # one for the upcoming hour
-
-        while True:
-            line = f.readline()
-            if line == "":
-                if tail:
-                    time.sleep(0.5)
-                    continue
-                else:
-                    break
+        # everything below is keyed on host ids, names only come
+        # back out when the callback iterates over them
+        self.hosts = HostTable()
+        # TO and FROM hold a set of hosts per target, made on first use
+        if args.fan_top:
+            self.windows = Windows(args.window, args.hop,
+                    lambda: [{}, {}, SpaceSaving(args.most_capacity),
+                             HostHLL(args.fan_precision), HostHLL(args.fan_precision)])
+        else:
+            self.windows = Windows(args.window, args.hop,
+                    lambda: [{}, {}, SpaceSaving(args.most_capacity)])
+        # with --fan_top, the hash of each host's name, by id
+        self.host_hashes = np.empty(0, np.uint64)
+        # a window is done once a line is this far past its start
+        self.limit = args.window + args.max_log_late_seconds
+        if args.distinct == 'exact':
+            self.new_set = lambda: ExactIdSet(args.distinct_max_keys)
+        else:
+            self.new_set = BloomIdSet
+        # malformed lines, counted and maybe quarantined, whatever the engine
+        self.rejects = Rejects(args.quarantine)
+        self.batch_parser = BatchParser(self.hosts, self.rejects)
+        self.to_ids = np.array([self.hosts.intern(to) for to in args.to], dtype=np.int32)
+        self.frm_ids = np.array([self.hosts.intern(frm) for frm in args.frm], dtype=np.int32)
+        self.latest_ts = -float('inf')
+        self.emitted = 0            # windows output so far
+        self.checkpointer = None    # see checkpoint.Checkpointer
+        self.metrics = None         # see metrics.Metrics
+        self.reporter = None        # and metrics.Reporter
+        self.tailers = []           # the tail.Tailer of every log followed
+
+    def process(self, f, tail=False, path=None):
+        """
+        Runs the lines of f through. With tail, keeps following f
+        as it's written, and if given its path, as it's rotated.
+        """
+        chunks = Tailer(f, path) if tail else read_chunks(f)
+        if tail:
+            self.tailers.append(chunks)
+        try:
+            self._process(f, chunks, tail, path)
+        finally:
+            if tail:
+                self.tailers.remove(chunks)
+
+    def _process(self, f, chunks, tail, path):
+        if self.args.engine == 'batch':
+            offset = f.tell() if f.seekable() else 0
+            self.rejects.start(path, offset)
+            for chunk in chunks:
+                if tail and path is not None:
+                    # a rotated or truncated log starts over
+                    self.rejects.offset = chunks.position()[1] - len(chunk)
+                self.process_chunk(chunk)
+                if self.checkpointer:
+                    offset += len(chunk)
+                    inode, at = (chunks.position() if tail else
+                                 (os.fstat(f.fileno()).st_ino, offset))
+                    self.checkpointer.maybe_save(self, (path, inode, at))
+                if self.reporter:
+                    self.reporter.maybe_report()
+            if self.checkpointer:
+                self.checkpointer.save(self, (path, os.fstat(f.fileno()).st_ino, f.tell()))
+            return
+
+        parser = Parser(self.rejects)
+        windows = self.windows
+        new_set = self.new_set
+        intern = self.hosts.intern
+        to_ids, frm_ids = set(self.to_ids.tolist()), set(self.frm_ids.tolist())
+        metrics = self.metrics
+        rejected = 0
+        late = []       # how far behind the latest each line was, for metrics
+
+        if tail:
+            lines = (line for chunk in chunks
+                     for line in chunk.decode('utf-8', 'replace').splitlines(True))
+        else:
+            lines = iter(f.readline, "")
 
+        for line in lines:
             ts, frm, to = parser.parse(line)
             if not ts:
+                rejected += 1
                 continue
+            frm, to = intern(frm), intern(to)
+            if metrics is not None:
+                late.append(max(self.latest_ts - ts, 0))
+                if len(late) >= METRICS_LINES:
+                    self.count_lines(late, rejected)
+                    late, rejected = [], 0
+            if ts > self.latest_ts:
+                self.latest_ts = ts
               
-            # our start time is defines as the hour of the first time stamp
-            ts_hr = self.hour_of(ts)
-            summary = hourly_summaries[ts_hr]
+            # one window, or with a hop several, hold the line
+            for window in windows.starts_of(ts):
+                summary = windows[window]
 
-            # seen hosts bookkeeping
-            if to == args.to and frm not in summary[TO]:
-                summary[TO].add(frm)
+                # seen hosts bookkeeping
+                if to in to_ids:
+                    target_set(summary[TO], to, new_set).add(frm)
 
-            if frm == args.frm and to not in summary[FROM]:
-                summary[FROM].add(to)
-     
-            # top connection bookkeeping
-            summary[MOST][frm] += 1
-            summary[MOST][to] += 1
+                if frm in frm_ids:
+                    target_set(summary[FROM], frm, new_set).add(to)
+
+                # top connection bookkeeping
+                summary[MOST].add(frm)
+                summary[MOST].add(to)
 
             # ok, if this timestamp is > than our waiting period
-            # we can call the oldest hour summary mature
+            # we can call the oldest window summary mature
+            oldest = windows.oldest()
+            if ts - oldest > self.limit:
+                self.emit(oldest)
+
+        if metrics is not None:
+            self.count_lines(late, rejected)
+
+    def count_lines(self, late, rejected):
+        """ the line engine's metrics, a batch of lines at a time """
+        self.metrics.count('lines', len(late))
+        self.metrics.count('rejected_lines', rejected)
+        self.metrics.observe('line_lateness_seconds', late)
+        if self.reporter:
+            self.reporter.maybe_report()
+
+    def process_chunk(self, chunk):
+        """
+        Batch version of process() for a chunk of whole lines.
+        Gives the same result as feeding the lines one by one.
+        """
+        self.process_columns(*self.parse_chunk(chunk))
+
+    def parse_chunk(self, chunk):
+        """ the valid lines of a chunk as (ts, frm, to) columns, counting the rest """
+        ts, frm, to, valid = self.batch_parser.parse(chunk)
+        if self.metrics is not None:
+            self.metrics.count('chunks')
+            self.metrics.count('bytes', len(chunk))
+            self.metrics.count('rejected_lines', len(valid) - np.count_nonzero(valid))
+        return ts[valid], frm[valid], to[valid]
+
+    def process_columns(self, ts, frm, to):
+        """ process_chunk() for already parsed valid lines, in our host ids """
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+            metrics.count('lines', len(ts))
+            # the latest timestamp read before each line
+            before = np.maximum.accumulate(np.concatenate(([self.latest_ts], ts[:-1])))
+            metrics.observe('line_lateness_seconds', np.maximum(before - ts, 0))
+        windows = self.windows
+        starts = windows.starts_array(ts)
+        earliest = windows.earliest_start(ts)
+
+        # process() closes the oldest open window as soon as a line is more
+        # than limit past it, so walk the chunk in runs ending on a close
+        start = 0
+        while start < len(ts):
+            oldest = np.minimum.accumulate(earliest[start:])
+            if windows:
+                oldest = np.minimum(oldest, windows.oldest())
+            close = np.flatnonzero(ts[start:] - oldest > self.limit)
+            end = start + close[0] + 1 if len(close) else len(ts)
+
+            if len(starts) == 1:
+                self.aggregate(starts[0][start:end], frm[start:end], to[start:end])
+            else:
+                # with a hop, every (window, line) pair at once, by line
+                # then latest window first, as process() goes through them
+                lines = np.tile(np.arange(start, end), len(starts))
+                order = np.argsort(lines, kind='stable')
+                self.aggregate(np.concatenate([window[start:end] for window in starts])[order],
+                               frm[lines[order]], to[lines[order]])
+            # as of the line closing a window, as process() has it
+            self.latest_ts = max(self.latest_ts, float(ts[start:end].max()))
+
+            if len(close):
+                self.emit(float(oldest[close[0]]))
+            start = end
+
+        if metrics is not None:
+            metrics.observe('chunk_seconds', [time.perf_counter() - started])
+
+    def process_pack(self, pack, path=None, offset=0):
+        """
+        Runs the rows of a packed log (see pack.PackFile) through,
+        from the block at byte offset on, without parsing anything
+        """
+        inode = os.stat(path).st_ino if self.checkpointer else None
+        for end, ts, frm, to in pack.columns(self.hosts, offset):
+            self.process_columns(ts, frm, to)
+            if self.metrics is not None:
+                self.metrics.count('pack_blocks')
+            if self.checkpointer:
+                self.checkpointer.maybe_save(self, (path, inode, end))
+            if self.reporter:
+                self.reporter.maybe_report()
+        if self.checkpointer:
+            self.checkpointer.save(self, (path, inode, os.stat(path).st_size))
+
+    def process_merged(self, paths):
+        """
+        Runs the logs at paths through all at once, their lines merged
+        in timestamp order however much the logs overlap (see
+        merge.merge_columns), holding only about a chunk per log.
+        """
+        for ts, frm, to in merge_columns([self.columns_of(path) for path in paths]):
+            self.process_columns(ts, frm, to)
+            if self.reporter:
+                self.reporter.maybe_report()
+
+    def columns_of(self, path):
+        """ yields the valid lines of the log at path, a chunk or block at a time """
+        if is_packed(path):
+            pack = PackFile(path)
+            for _, ts, frm, to in pack.columns(self.hosts):
+                if self.metrics is not None:
+                    self.metrics.count('pack_blocks')
+                yield ts, frm, to
+            pack.close()
+            return
+
+        offset = 0
+        with open_log(path) as f:
+            for chunk in read_chunks(f):
+                # the logs are read in turns, say where each chunk's from
+                self.rejects.start(path, offset)
+                offset += len(chunk)
+                yield self.parse_chunk(chunk)
+
+    def aggregate(self, starts, frm, to):
+        """ adds lines to the windows starting at starts, a (window, line) pair each, in line order """
+        for window in first_seen(starts):
+            in_window = starts == window
+            summary = self.windows[float(window)]
+
+            # one pass over each pair of target and host, in line order
+            hits = in_window & np.isin(to, self.to_ids)
+            add_pairs(summary[TO], to[hits], frm[hits], self.new_set)
+
+            hits = in_window & np.isin(frm, self.frm_ids)
+            add_pairs(summary[FROM], frm[hits], to[hits], self.new_set)
 
-            current_hour = min(hourly_summaries.keys())
+            # top connection bookkeeping, counted in line order
+            # so ties break the same way as process()
+            both = np.column_stack((frm[in_window], to[in_window])).ravel()
+            ids, first, counts = np.unique(both, return_index=True, return_counts=True)
+            order = np.argsort(first)
+            summary[MOST].add_many(ids[order].tolist(), counts[order].tolist())
 
-            if ts-current_hour > (3600 + args.max_log_late_seconds):
-                summary = hourly_summaries[current_hour]
-                callback(current_hour,
-                    summary[TO],
-                    summary[FROM],
-                    summary[MOST].most_common(1)[0][0])
-                del(hourly_summaries[current_hour])
+            if self.args.fan_top:
+                hashes = self.hashes()
+                frm_in, to_in = frm[in_window], to[in_window]
+                summary[FAN_IN].add(to_in, hashes[frm_in])
+                summary[FAN_OUT].add(frm_in, hashes[to_in])
+
+    def hashes(self):
+        """ the hash of every host name so far, by id, hashing only the new ones """
+        known = len(self.host_hashes)
+        if known < len(self.hosts):
+            self.host_hashes = np.concatenate((self.host_hashes,
+                                               hash_strings(self.hosts.names[known:])))
+        return self.host_hashes
+
+    def merge(self, window, to, frm, most, fans=()):
+        """
+        Folds a partial summary of the window starting at window, made
+        elsewhere over other lines but already in our host ids, into ours.
+        to, frm: {target id: array of host ids}
+        most: the SpaceSaving sketch of MOST
+        fans: with --fan_top, the HostHLL sketches of FAN_IN and FAN_OUT
+        """
+        summary = self.windows[window]
+        for sets, partial in ((summary[TO], to), (summary[FROM], frm)):
+            for target, ids in partial.items():
+                target_set(sets, target, self.new_set).add_many(ids)
+        summary[MOST].merge(most)
+        for sketch, partial in zip(summary[FAN_IN:], fans):
+            sketch.merge(partial)
+
+    def close_windows(self, ts):
+        """ emits, oldest first, every open window ts has matured """
+        windows = self.windows
+        while windows and ts - windows.oldest() > self.limit:
+            self.emit(windows.oldest())
+
+    def state(self):
+        """ everything needed to carry on later, see restore() """
+        return {'hosts': self.hosts.names,
+                'windows': dict(self.windows.summaries),
+                'latest_ts': self.latest_ts}
+
+    def restore(self, state):
+        """
+        Picks up from a state() of a Processor made with the same
+        --to, --from and window options
+        """
+        for host_id, name in enumerate(state['hosts']):
+            if self.hosts.intern(name) != host_id:
+                raise Exception("cannot restore a state made for other hosts")
+        for window, summary in state['windows'].items():
+            self.windows[window][:] = summary
+        self.latest_ts = state['latest_ts']
+
+    def ingest_lag(self):
+        """
+        Seconds between now and the latest log line read, that is
+        how far behind the log writers we are, plus their own delay.
+        None until a line is read, as is the latest timestamp gauge,
+        so the JSON metrics say null rather than Infinity.
+        """
+        if self.latest_ts == -float('inf'):
+            return None
+        return time.time() - self.latest_ts
+
+    def tail_backlog(self):
+        """ bytes written to the logs followed that we haven't read yet """
+        return sum(tailer.backlog() for tailer in list(self.tailers))
+
+    def update_gauges(self):
+        """ sets the gauges of self.metrics, too slow to keep up to date as we go """
+        metrics = self.metrics
+        metrics.set('latest_timestamp_seconds',
+                    None if self.latest_ts == -float('inf') else self.latest_ts)
+        metrics.set('ingest_lag_seconds', self.ingest_lag)
+        metrics.set('tail_backlog_bytes', self.tail_backlog)
+        metrics.set('open_windows', len(self.windows))
+        metrics.set('hosts', len(self.hosts))
+        fill, sizes = 0.0, {}
+        for window, summary in self.windows.summaries.items():
+            size = sum(sketch.nbytes() for sketch in summary[MOST:])
+            for sets in summary[TO], summary[FROM]:
+                for s in sets.values():
+                    size += s.nbytes()
+                    if isinstance(s, BloomIdSet):
+                        fill = max(fill, s.bloom.fill_ratio())
+            sizes[str(int(window))] = size
+        metrics.set('bloom_fill_ratio', fill)
+        # a new dict, as the HTTP endpoint may be reading the old one
+        metrics.set('window_bytes', sizes)
+
+    def emit(self, window):
+        lag = self.ingest_lag()
+        if lag is None:
+            # closed while merging workers' windows, see parallel.process_parallel
+            logger.info(f"closing window {window}")
+        else:
+            logger.info(f"closing window {window}, ingest lag {lag:.1f}s")
+        # the only place host ids get turned back into names
+        summary = self.windows.pop(window)
+        self.emitted += 1
+        if self.metrics is not None:
+            self.metrics.count('windows_emitted')
+        most = [self.hosts[host_id] for host_id, _ in summary[MOST].most_common(self.args.top)]
+        to, frm = self.hosts.targets_view(summary[TO]), self.hosts.targets_view(summary[FROM])
+        if not self.args.fan_top:
+            self.callback(window, to, frm, most)
+            return
+        fans = {kind: [(self.hosts[host_id], count) for host_id, count in
+                       summary[index].top(self.args.fan_top)]
+                for kind, index in (("FAN_IN", FAN_IN), ("FAN_OUT", FAN_OUT))}
+        self.callback(window, to, frm, most, fans)
 
     def dump_remaining(self): 
-        hours = sorted(self.hourly_summaries.keys())
-        for hour in hours:
-            summary = self.hourly_summaries[hour]
-            self.callback(hour,
-                summary[TO],
-                summary[FROM],
-                summary[MOST].most_common(1)[0][0])
-
-
-def output(hour, to, frm, most):
-    for t in to:
-        print (f"{hour}\tTO\t{t}")
-    for f in frm:
-        print (f"{hour}\tFROM\t{f}")
-    print (f"{hour}\tMOST\t{most}")
-    
+        while self.windows:
+            self.emit(self.windows.oldest())
+
+
+def target_set(sets, target, new_set=BloomIdSet):
+    s = sets.get(target)
+    if s is None:
+        s = sets[target] = new_set()
+    return s
+
+
+def add_pairs(sets, targets, host_ids, new_set=BloomIdSet):
+    """ adds each host id to the set of its target, in line order """
+    targets, host_ids = unpair_ids(first_seen(pair_ids(targets, host_ids)))
+    for target in first_seen(targets).tolist():
+        target_set(sets, target, new_set).add_many(host_ids[targets == target])
+
+
+def resume(pr, args):
+    """
+    Sets pr up to checkpoint to --checkpoint_dir, and restores it
+    from the last checkpoint there if any. Returns the files still
+    to read and the offset to start the first of them from.
+    """
+    pr.checkpointer = Checkpointer(args.checkpoint_dir, args, args.checkpoint_seconds)
+    state = pr.checkpointer.load()
+    if state is None:
+        return list(args.files), 0
+
+    pr.restore(state['processor'])
+    path, inode, offset = state['position']
+    if path not in args.files:
+        raise Exception(f"checkpoint is for {path}, which is not among the files")
+    stat = os.stat(path)
+    # offsets in a compressed log are of the inflated lines
+    if stat.st_ino != inode or (compression(path) is None and stat.st_size < offset):
+        logger.warning(f"{path} was replaced since the checkpoint, reading it from the start")
+        offset = 0
+    logger.info(f"Resuming {path} from byte {offset}")
+    return args.files[args.files.index(path):], offset
+
+
 def main():
     args = parse_argv(sys.argv[1:])
     logger.info(args)
 
-    pr = Processor(args, output)
+    # for several --to / --from hosts, with the one matched as a column
+    tagged = len(args.to) > 1 or len(args.frm) > 1
+    sink = make_sink(args.output, tagged)
+    pr = Processor(args, sink)
+    if args.metrics:
+        pr.metrics = Metrics()
+        pr.reporter = Reporter(pr.metrics, args.metrics, args.metrics_seconds,
+                               pr.update_gauges)
+    try:
+        run(pr, args)
+    finally:
+        sink.close()
+        pr.rejects.close()
+        if pr.reporter:
+            pr.reporter.close()
+
+
+def run(pr, args):
+    if args.concurrent:
+        aio.run(pr, args)
+        if not args.only_complete_hours:
+            pr.dump_remaining()
+        return
 
     # stdin case
     if len(args.files) == 0:
         logger.info("Reading from stdin")
         # not readline from stdin automatically blocks
-        pr.process(sys.stdin)
+        pr.process(sys.stdin.buffer if args.engine == 'batch' else sys.stdin)
         return
 
     files_remaining = list(args.files)        # to make mutable
+    offset = 0
+    if args.checkpoint_dir:
+        files_remaining, offset = resume(pr, args)
+
+    if args.workers > 1:
+        from connspy.parallel import process_parallel
+        # a tailed file is followed here, once the rest are done
+        in_parallel = files_remaining[:-1] if args.tail else files_remaining
+        process_parallel(pr, in_parallel, args.workers)
+        files_remaining = files_remaining[len(in_parallel):]
+    if args.merge:
+        logger.info("Merging " + " ".join(files_remaining))
+        pr.process_merged(files_remaining)
+        files_remaining = []
     while files_remaining:
         logger.info("Reading " + files_remaining[0])
 
         # TODO: Error recovery on bad file ? better to fail or skip
-        with open(files_remaining.pop(0), 'r') as f:
-            should_tail = not files_remaining and args.tail
-            pr.process(f, should_tail)
+        path = files_remaining.pop(0)
+        should_tail = not files_remaining and args.tail
+        if should_tail and (compression(path) is not None or is_packed(path)):
+            raise Exception(f"{path} is compressed or packed, it can't be followed with --tail")
+        if is_packed(path):
+            pack = PackFile(path)
+            pr.process_pack(pack, path, offset)
+            pack.close()
+            offset = 0
+            continue
+        with open_log(path) as f:
+            f.seek(offset)
+            offset = 0
+            if args.engine == 'line' and not should_tail:
+                f = io.TextIOWrapper(f)
+            pr.process(f, should_tail, path)
 
     if not args.only_complete_hours:
         pr.dump_remaining()
+        if pr.checkpointer:
+            pr.checkpointer.save(pr, pr.checkpointer.position)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,221 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+from connspy.parser import CHUNK_SIZE
+
+logger = logging.getLogger("tail")
+
+# how long to sleep at the end of the file when polling, and how long
+# to block on inotify before having a look anyway
+POLL_SECONDS = 0.5
+WAIT_SECONDS = 30
+
+# from inotify(7)
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+# wd, mask, cookie, len, followed by len bytes of name
+EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Just enough of inotify(7), through ctypes, to block until the
+    file at path changes. The directory is watched rather than the
+    file so that we also hear about it being renamed or recreated.
+    """
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "this libc has no inotify")
+
+        self.name = os.fsencode(os.path.basename(path))
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.fsencode(os.path.dirname(os.path.abspath(path)))
+        if libc.inotify_add_watch(self.fd, directory, self.MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"cannot watch {directory}")
+
+    def wait(self, timeout=WAIT_SECONDS):
+        """
+        Blocks until something happens to our file, or timeout.
+        Returns True if something did.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready and self.drain():
+                return True
+
+    def fileno(self):
+        return self.fd
+
+    def drain(self):
+        """ reads the queued events, saying if any were about our file """
+        hit = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return hit
+            pos = 0
+            while pos < len(data):
+                _, mask, _, length = EVENT.unpack_from(data, pos)
+                name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b"\0")
+                pos += EVENT.size + length
+                if name == self.name or mask & IN_Q_OVERFLOW:
+                    hit = True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """ Inotify's stand in where there is none, just sleeps a bit """
+
+    def wait(self, timeout=WAIT_SECONDS):
+        time.sleep(min(timeout, POLL_SECONDS))
+        return True
+
+    def close(self):
+        pass
+
+
+class Tailer:
+    """
+    Follows a log as it's written, like tail -F. Yields chunks of
+    whole lines, like parser.read_chunks, reading everything that's
+    there at once and then blocking on inotify until there's more.
+
+    With the path of f, it also notices the log being rotated, that
+    is renamed away or deleted and created again: whatever is left in
+    the old file is read and the new one followed from its start.
+    A log truncated in place is read again from its start. Without a
+    path (stdin say), or with poll, or without inotify, it polls.
+    """
+
+    def __init__(self, f, path=None, chunk_size=CHUNK_SIZE, poll=False,
+                 wait_seconds=WAIT_SECONDS):
+        self.f = f
+        self.path = path
+        self.chunk_size = chunk_size
+        self.wait_seconds = wait_seconds
+        self.owned = False          # whether we opened f, and so close it
+        self.watcher = None
+        if path is not None and not poll:
+            try:
+                self.watcher = Inotify(path)
+            except (OSError, AttributeError, TypeError) as e:
+                logger.info(f"cannot use inotify ({e}), polling {path}")
+        if self.watcher is None:
+            self.watcher = Poller()
+        self.rest = b""             # a line still being written
+
+    def read(self):
+        read = getattr(self.f, 'read1', self.f.read)
+        data = read(self.chunk_size)
+        if isinstance(data, str):
+            data = data.encode()
+        return data
+
+    def backlog(self):
+        """ bytes written to the log that we haven't read yet, see Processor.tail_backlog """
+        try:
+            return os.fstat(self.f.fileno()).st_size - self.f.tell()
+        except (OSError, ValueError):
+            return 0
+
+    def position(self):
+        """ (inode, offset) of the file being followed, up to the last whole line """
+        return os.fstat(self.f.fileno()).st_ino, self.f.tell() - len(self.rest)
+
+    def truncated(self):
+        try:
+            return self.f.seekable() and os.fstat(self.f.fileno()).st_size < self.f.tell()
+        except (OSError, ValueError):
+            return False
+
+    def rotated(self):
+        if self.path is None:
+            return False
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.f.fileno()).st_ino
+        except FileNotFoundError:
+            return False            # gone, wait for it to be created again
+
+    def reopen(self):
+        f = open(self.path, 'rb')
+        if self.owned:
+            self.f.close()
+        self.f, self.owned = f, True
+
+    def poll(self):
+        """
+        The next chunk of whole lines, or None if there's nothing
+        new yet, in which case the watcher says when to look again.
+        """
+        while True:
+            data = self.read()
+            if not data:
+                # at the end of the file, for now
+                if self.truncated():
+                    logger.info(f"{self.path} was truncated, reading it from the start")
+                    self.f.seek(0)
+                    self.rest = b""
+                    continue
+                if not self.rotated():
+                    return None
+                # a last look, in case it was written to while we checked
+                data = self.read()
+                if not data:
+                    logger.info(f"{self.path} was rotated, following the new one")
+                    self.reopen()
+                    rest, self.rest = self.rest, b""
+                    if rest:
+                        return rest     # its last line will never be finished
+                    continue
+
+            cut = data.rfind(b"\n") + 1
+            if cut == 0:
+                self.rest += data
+                continue
+            chunk = self.rest + data[:cut]
+            self.rest = data[cut:]
+            return chunk
+
+    def chunks(self):
+        while True:
+            chunk = self.poll()
+            if chunk is None:
+                self.watcher.wait(self.wait_seconds)
+            else:
+                yield chunk
+
+    def __iter__(self):
+        return self.chunks()
+
+    def close(self):
+        self.watcher.close()
+        if self.owned:
+            self.f.close()
@@ -0,0 +1,135 @@
+import sys
+import heapq
+from operator import itemgetter
+
+DEFAULT_CAPACITY = 30000
+
+
+class SpaceSaving:
+    """
+    Counts the most frequent keys of a stream in at most capacity
+    counters, the Space-Saving algorithm of Metwally, Agrawal and
+    El Abbadi. While there is room every key is counted exactly. Once
+    full, a new key takes over the counter of the least counted one,
+    and starts from its count, so counts are only ever overestimated.
+
+    With N the total of everything added, and m the capacity:
+    - any key counted is overestimated by at most error(key) <= N / m
+    - any key that really occurs more than N / m times is counted
+    so the top keys come out right as long as they stand out from the
+    rest by more than N / m. Sketches can be merged, with the same
+    guarantee over the combined streams.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise Exception("capacity must be at least 1")
+        self.capacity = capacity
+        self.counts = {}        # in the order keys came in, for ties
+        self.errors = {}        # overestimate of the counts that have one
+        self.heap = None        # (count, key) once full, counts may be stale
+        self.total = 0
+
+    def add(self, key, count=1):
+        self.add_many((key,), (count,))
+
+    def add_many(self, keys, counts):
+        """ add() for each key and its count, only faster """
+        mine, capacity = self.counts, self.capacity
+        if self.heap is None and len(mine) + len(keys) <= capacity:
+            # there's room for all of them, so it's plain counting
+            get = mine.get
+            for key, count in zip(keys, counts):
+                mine[key] = get(key, 0) + count
+            self.total += sum(counts)
+            return
+
+        for key, count in zip(keys, counts):
+            self.total += count
+            if key in mine:
+                mine[key] += count
+            elif len(mine) < capacity:
+                mine[key] = count
+            else:
+                # the new key takes over the least counted one's counter
+                floor, evicted = self._min()
+                heapq.heapreplace(self.heap, (floor + count, key))
+                del mine[evicted]
+                self.errors.pop(evicted, None)
+                mine[key] = floor + count
+                self.errors[key] = floor
+
+    def _min(self):
+        # the heap is only built once we're full, and counts only grow,
+        # so an entry that's out of date just goes back with its count
+        heap = self.heap
+        if heap is None:
+            heap = self.heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(heap)
+        while True:
+            count, key = heap[0]
+            actual = self.counts[key]
+            if actual == count:
+                return count, key
+            heapq.heapreplace(heap, (actual, key))
+
+    def min_count(self):
+        """ what any key not counted could have, 0 while not full """
+        if len(self.counts) < self.capacity:
+            return 0
+        return self._min()[0]
+
+    def error(self, key):
+        """ how much the count of key may be over """
+        return self.errors.get(key, 0)
+
+    def most_common(self, n=None):
+        """ [(key, count)] most counted first, ties in order of arrival """
+        if n is None:
+            return sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.counts.items(), key=itemgetter(1))
+
+    def merge(self, other):
+        """ adds the counts of the sketch other into this one """
+        mine, theirs = self.min_count(), other.min_count()
+        counts, errors = {}, {}
+        # a key missing from a full sketch could have had its min_count
+        for key, count in self.counts.items():
+            if key in other.counts:
+                counts[key] = count + other.counts[key]
+                errors[key] = self.error(key) + other.error(key)
+            else:
+                counts[key] = count + theirs
+                errors[key] = self.error(key) + theirs
+        for key, count in other.counts.items():
+            if key not in counts:
+                counts[key] = count + mine
+                errors[key] = other.error(key) + mine
+
+        if len(counts) > self.capacity:
+            keep = set(key for key, _ in heapq.nlargest(self.capacity,
+                                            counts.items(), key=itemgetter(1)))
+            counts = {key: count for key, count in counts.items() if key in keep}
+
+        self.counts = counts
+        self.errors = {key: e for key, e in errors.items() if e and key in counts}
+        self.heap = None
+        self.total += other.total
+
+    def relabel(self, mapping):
+        """ a copy with every key k replaced by mapping[k] """
+        sketch = SpaceSaving(self.capacity)
+        sketch.counts = {int(mapping[key]): count for key, count in self.counts.items()}
+        sketch.errors = {int(mapping[key]): e for key, e in self.errors.items()}
+        sketch.total = self.total
+        return sketch
+
+    def nbytes(self):
+        """ memory held, roughly """
+        size = sys.getsizeof(self.counts) + sys.getsizeof(self.errors) + 56 * len(self.counts)
+        if self.heap is not None:
+            size += sys.getsizeof(self.heap) + 64 * len(self.heap)
+        return size
+
+    def __len__(self):
+        return len(self.counts)
@@ -0,0 +1,83 @@
+import heapq
+
+import numpy as np
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(text):
+    """ 90, 90s, 5m, 1h, 1d... to a whole number of seconds """
+    text = str(text).strip().lower()
+    unit = 1
+    if text and text[-1] in UNITS:
+        text, unit = text[:-1], UNITS[text[-1]]
+    if not text.isdigit() or int(text) == 0:
+        raise Exception(f"invalid duration {text}, expected say 30s, 5m, 1h or 1d")
+    return int(text) * unit
+
+
+class Windows:
+    """
+    The open time windows, each with its summary, by start time.
+
+    Windows are width seconds long and start every hop seconds, so
+    with hop == width (the default) every timestamp falls in exactly
+    one, and with a smaller hop in width / hop overlapping ones.
+    Starts are computed with plain arithmetic on epoch seconds, so
+    windows line up on UTC minutes, hours and days.
+
+    The starts of the open windows are kept in a heap, making the
+    oldest one a lookup and closing it O(log n).
+    """
+
+    def __init__(self, width=3600, hop=None, factory=dict):
+        hop = width if hop is None else hop
+        if hop <= 0 or width % hop:
+            raise Exception(f"the window {width}s is not a multiple of the hop {hop}s")
+        self.width = width
+        self.hop = hop
+        self.overlap = width // hop     # windows each timestamp is in
+        self.factory = factory
+        self.summaries = {}
+        self.starts = []                # heap of the keys of summaries
+
+    def starts_of(self, ts):
+        """ starts of the windows holding ts, latest first """
+        last = (ts // self.hop) * self.hop
+        return [last - i * self.hop for i in range(self.overlap)]
+
+    def starts_array(self, ts):
+        """ same over an array of timestamps, one array per overlap """
+        last = np.floor_divide(ts, float(self.hop)) * self.hop
+        return [last - i * self.hop for i in range(self.overlap)]
+
+    def earliest_start(self, ts):
+        """ start of the earliest window holding each of ts """
+        return np.floor_divide(ts, float(self.hop)) * self.hop - (self.overlap - 1) * self.hop
+
+    def __getitem__(self, start):
+        summary = self.summaries.get(start)
+        if summary is None:
+            summary = self.summaries[start] = self.factory()
+            heapq.heappush(self.starts, start)
+        return summary
+
+    def oldest(self):
+        """ start of the oldest open window, None if there's none """
+        starts = self.starts
+        # windows popped out of order are only dropped from the heap here
+        while starts and starts[0] not in self.summaries:
+            heapq.heappop(starts)
+        return starts[0] if starts else None
+
+    def pop(self, start):
+        summary = self.summaries.pop(start)
+        if self.starts[0] == start:
+            heapq.heappop(self.starts)
+        return summary
+
+    def __contains__(self, start):
+        return start in self.summaries
+
+    def __len__(self):
+        return len(self.summaries)
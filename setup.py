@@ -10,10 +10,15 @@ setup (
     author='Nicholas Ursa',
     author_email='nick.ursa@gmail.com',
     packages=['connspy'],
-    install_requires=['bloom-filter'],
+    install_requires=['numpy'],
+    extras_require={'zstd': ['zstandard']},
     entry_points = {
         'console_scripts': ['connspy=connspy.connspy:main',
-            'connspy-stream=connspy.stream:main']
+            'connspy-stream=connspy.stream:main',
+            'connspy-index=connspy.index:main',
+            'connspy-pack=connspy.pack:main',
+            'connspy-rollup=connspy.rollup:main',
+            'connspy-graph=connspy.graph:main']
     }
 )
 
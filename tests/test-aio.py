@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import threading
+import unittest
+from tempfile import TemporaryDirectory
+from connspy import aio
+from connspy.aio import Ingest, parse_listen
+from connspy.stream import Processor, parse_argv
+
+# datetime.datetime(2019,3,1,14,0,0).utctimestamp() = 1551466800
+HOUR1 = 1551466800
+
+
+def processor(argv):
+    res = []
+    def callback(hr, to, frm, most):
+        res.append([hr, sorted(to), sorted(frm), most])
+    return Processor(parse_argv(argv.split()), callback), res
+
+
+class AioTest(unittest.TestCase):
+
+    def testParseListen(self):
+        self.assertEqual(('unix', '/tmp/s'), parse_listen('unix:/tmp/s'))
+        self.assertEqual(('tcp', 'localhost', 9000), parse_listen('localhost:9000'))
+        self.assertEqual(('tcp', None, 9000), parse_listen('tcp::9000'))
+        self.assertEqual(('tcp', '::1', 9000), parse_listen('[::1]:9000'))
+        self.assertRaises(Exception, parse_listen, 'localhost')
+        self.assertRaises(Exception, parse_listen, 'unix:')
+
+    def testFiles(self):
+        with TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, name) for name in ('a', 'b')]
+            with open(paths[0], 'w') as f:
+                f.write(f"{HOUR1 + 10} a b\n{HOUR1 + 20} c b\n")
+            with open(paths[1], 'w') as f:
+                f.write(f"{HOUR1 + 30} d b\n{HOUR1 + 40} a e\n")
+
+            pr, res = processor(f'--concurrent --to b --from a {" ".join(paths)}')
+            asyncio.run(Ingest(pr, source_chunks=1).run(paths))
+            pr.dump_remaining()
+
+            self.assertEqual(1, len(res))
+            self.assertListEqual(['a', 'c', 'd'], res[0][1])
+            self.assertListEqual(['b', 'e'], res[0][2])
+
+    def testStalledFile(self):
+        with TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, name) for name in ('stalled', 'b')]
+            with open(paths[0], 'w') as f:
+                f.write(f"{HOUR1 + 10} a b\n")
+            with open(paths[1], 'w') as f:
+                f.write(f"{HOUR1 + 20} c b\n")
+
+            pr, res = processor(f'--to b {" ".join(paths)}')
+            process_chunk = pr.process_chunk
+            other_read, stall_over = threading.Event(), threading.Event()
+            def process(chunk):
+                process_chunk(chunk)
+                if b" c b" in chunk:
+                    other_read.set()
+            pr.process_chunk = process
+
+            open_log = aio.open_log
+            def stalled_open(path, *args):
+                # a file on a mount that hangs until the other one is read
+                if path == paths[0]:
+                    stall_over.wait(10)
+                return open_log(path, *args)
+            read_while_stalled = []
+            def unstall():
+                read_while_stalled.append(other_read.wait(5))
+                stall_over.set()
+            threading.Thread(target=unstall).start()
+
+            aio.open_log = stalled_open
+            try:
+                asyncio.run(asyncio.wait_for(Ingest(pr).run(paths), 20))
+            finally:
+                aio.open_log = open_log
+            pr.dump_remaining()
+
+            self.assertListEqual([True], read_while_stalled)
+            self.assertListEqual(['a', 'c'], res[0][1])
+
+    def testSocketsAndTailedFile(self):
+        with TemporaryDirectory() as tmp:
+            sock = os.path.join(tmp, "sock")
+            path = os.path.join(tmp, "log")
+            with open(path, 'w') as f:
+                f.write(f"{HOUR1 + 10} a b\n")
+
+            pr, res = processor(f'--tail --listen unix:{sock} --to b --from a {path}')
+
+            async def ship():
+                ingest = Ingest(pr)
+                run = asyncio.create_task(ingest.run([path], tail=True, listen=[f"unix:{sock}"]))
+                while not os.path.exists(sock):
+                    await asyncio.sleep(0.01)
+
+                # two shippers at once, one holding a line back for a while
+                _, slow = await asyncio.open_unix_connection(sock)
+                _, fast = await asyncio.open_unix_connection(sock)
+                slow.write(f"{HOUR1 + 20} c ".encode())
+                fast.write(f"{HOUR1 + 30} d b\n{HOUR1 + 40} a e\n".encode())
+                await fast.drain()
+                with open(path, 'a') as f:
+                    f.write(f"{HOUR1 + 50} a f\n")
+                await asyncio.sleep(0.2)
+                slow.write(b"b\n")
+                for w in (slow, fast):
+                    w.close()
+                    await w.wait_closed()
+
+                # until a to f have all been through
+                while len(pr.hosts) < 6:
+                    await asyncio.sleep(0.01)
+                ingest.stop()
+                await run
+
+            asyncio.run(asyncio.wait_for(ship(), 10))
+            pr.dump_remaining()
+
+            self.assertEqual(1, len(res))
+            self.assertListEqual(['a', 'c', 'd'], res[0][1])
+            self.assertListEqual(['b', 'e', 'f'], res[0][2])
+
+    def testProcessorFails(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log")
+            with open(path, 'w') as f:
+                f.writelines(f"{HOUR1 + i} a b\n" for i in range(100))
+
+            pr, _ = processor(f'--concurrent --to b {path}')
+            def fail(chunk):
+                raise Exception("bad chunk")
+            pr.process_chunk = fail
+
+            # fails with it, rather than waiting on what's still queued
+            with self.assertRaisesRegex(Exception, "bad chunk"):
+                asyncio.run(asyncio.wait_for(Ingest(pr, 1, 1).run([path]), 10))
+
+    def testListensWhileParsing(self):
+        with TemporaryDirectory() as tmp:
+            sock = os.path.join(tmp, "sock")
+            pr, _ = processor(f'--listen unix:{sock} --to b')
+            process_chunk = pr.process_chunk
+            parsing, parsed = threading.Event(), threading.Event()
+            def slow(chunk):
+                parsing.set()
+                time.sleep(0.5)
+                process_chunk(chunk)
+                parsed.set()
+            pr.process_chunk = slow
+
+            async def ship():
+                ingest = Ingest(pr)
+                run = asyncio.create_task(ingest.run([], listen=[f"unix:{sock}"]))
+                while not os.path.exists(sock):
+                    await asyncio.sleep(0.01)
+                _, w = await asyncio.open_unix_connection(sock)
+                w.write(f"{HOUR1 + 10} a b\n".encode())
+                await w.drain()
+                while not parsing.is_set():
+                    await asyncio.sleep(0.01)
+                # the loop is still going while the first chunk is parsed
+                self.assertFalse(parsed.is_set())
+                _, w2 = await asyncio.open_unix_connection(sock)
+                w2.write(f"{HOUR1 + 20} c b\n".encode())
+                await w2.drain()
+                while len(pr.hosts) < 3:
+                    await asyncio.sleep(0.01)
+                for writer in (w, w2):
+                    writer.close()
+                    await writer.wait_closed()
+                ingest.stop()
+                await run
+
+            asyncio.run(asyncio.wait_for(ship(), 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import os
+import logging
+import unittest
+from tempfile import TemporaryDirectory
+from benchmarks import generate
+from benchmarks.generate import Workload
+from benchmarks.harness import BENCHMARKS, run_one, compare
+from connspy.parser import BatchParser
+
+
+class GenerateTest(unittest.TestCase):
+
+    def testDeterministic(self):
+        a, b = io.BytesIO(), io.BytesIO()
+        Workload(lines=5000, hosts=300, seed=3).write(a)
+        Workload(lines=5000, hosts=300, seed=3).write(b)
+        self.assertEqual(a.getvalue(), b.getvalue())
+        c = io.BytesIO()
+        Workload(lines=5000, hosts=300, seed=4).write(c)
+        self.assertNotEqual(a.getvalue(), c.getvalue())
+
+    def testBlocksInAnyOrder(self):
+        old = generate.BLOCK_LINES
+        generate.BLOCK_LINES = 1000
+        try:
+            wl = Workload(lines=3500, hosts=100)
+            blocks = list(wl.blocks())
+            self.assertEqual(4, len(blocks))
+            self.assertEqual(blocks[2], wl.block(2))
+            self.assertEqual(3500, sum(block.count(b"\n") for block in blocks))
+        finally:
+            generate.BLOCK_LINES = old
+
+    def testMalformed(self):
+        f = io.BytesIO()
+        Workload(lines=20000, hosts=500, malformed=0.05, late=0.1).write(f)
+        cols = BatchParser().parse(f.getvalue())
+        invalid = len(cols.ts) - int(cols.valid.sum())
+        self.assertEqual(20000, len(cols.ts))
+        self.assertTrue(700 < invalid < 1300)
+        # late lines make the timestamps go backwards now and then
+        ts = cols.ts[cols.valid]
+        self.assertTrue((ts[1:] < ts[:-1]).any())
+
+    def testSkew(self):
+        wl = Workload(lines=20000, hosts=1000, zipf=1.5, malformed=0)
+        f = io.BytesIO()
+        wl.write(f)
+        top = wl.names[wl.ranked[0]]
+        # the most popular host alone is in a good part of the lines
+        self.assertTrue(f.getvalue().count(b" " + top + b"\n") > 20000 / 10)
+
+
+class HarnessTest(unittest.TestCase):
+
+    def testRunOne(self):
+        # run_one silences logging, being meant for a process of its own
+        self.addCleanup(logging.disable, logging.NOTSET)
+        params = Workload(lines=2000, hosts=50).params()
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'log.txt')
+            with open(path, 'wb') as f:
+                Workload(**params).write(f)
+            results = {name: run_one(name, path, params) for name in
+                       ('BatchParser.parse', 'Processor.process', 'seek_just_before_index')}
+        self.assertEqual(2000, results['BatchParser.parse']['items'])
+        self.assertTrue(results['Processor.process']['peak_rss_mb'] > 0)
+        self.assertIn('mb_per_second', results['BatchParser.parse'])
+        self.assertNotIn('mb_per_second', results['seek_just_before_index'])
+        self.assertIn('Parser.parse', BENCHMARKS)
+
+        old = {'params': params, 'results': results}
+        lines = compare(old, old)
+        self.assertEqual(4, len(lines))
+        self.assertIn("1.00", lines[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
+import mmap
 import unittest
 import tempfile
-from connspy.binaryseek import seek_just_before_index, block_size
+from connspy.binaryseek import seek_just_before_index, seek_range, latest_timestamp, block_size
 
 class TestBinarySeek(unittest.TestCase):
     def test_binary_seek(self):
@@ -53,4 +54,41 @@ class TestBinarySeek(unittest.TestCase):
             actual = d[19999]
             self.assertTrue(0 <= actual - f.tell() <= 2 * block_size )
 
+    def test_seek_range(self):
+        path = None
+        d = {}
+        base = 1565000000
+        with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
+            path = f.name
+            for ts in range(10000, 20000):
+                d[ts] = f.tell()
+                if ts % 97 == 0:
+                    # malformed lines shouldn't throw the search off
+                    f.write("garbage\n")
+                    f.write("x" * 3000 + "\n")
+                # in ms this time
+                s = f"{base + ts}000 " + "a" * 50 + " " + "b" * 50 + "\n"
+                f.write(s)
+
+        start, end = seek_range(path, base + 12042, base + 13042, 10)
+        self.assertTrue(0 <= d[12032] - start < 2 * block_size)
+        self.assertTrue(0 <= end - d[13052] < 2 * block_size)
+
+        # out of bounds on either side
+        self.assertEqual((0, None), seek_range(path, base + 9000, base + 30000))
+        start, end = seek_range(path, base + 30000, base + 40000)
+        self.assertTrue(d[19999] <= start)
+        self.assertIsNone(end)
+
+        # the returned offsets are the starts of well formed lines
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self.assertEqual(3, len(f.readline().split()))
 
+    def test_latest_timestamp(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"1565000000000 a b\n1565000001000 a b\ngarbage\n1565000002")
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.assertEqual(1565000001, latest_timestamp(mm))
+                self.assertIsNone(latest_timestamp(mm, 10))
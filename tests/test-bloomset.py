@@ -1,5 +1,7 @@
 import unittest
-from connspy.bloomset import BloomStringSet
+import numpy as np
+from connspy.bloomset import (BloomStringSet, BloomIdSet, BloomFilter,
+                              ScalableBloomFilter, hash_ids)
 
 class BloomsetTest(unittest.TestCase):
 
@@ -16,3 +18,59 @@ class BloomsetTest(unittest.TestCase):
         res = sorted(list(s))
         self.assertListEqual(["1","2"], res)
 
+    def testIdSet(self):
+        s = BloomIdSet()
+        self.assertTrue(s.add(7))
+        self.assertFalse(s.add(7))
+        new = s.add_many(np.array([3, 7, 5, 3, 9]))
+        self.assertListEqual([True, False, True, False, True], new.tolist())
+        self.assertIn(5, s)
+        self.assertNotIn(4, s)
+        self.assertEqual(4, len(s))
+        self.assertListEqual([7, 3, 5, 9], list(s))
+        self.assertRaises(Exception, s.add, 1)
+
+    def testFalsePositiveRate(self):
+        bloom = BloomFilter(10000, 0.01)
+        bloom.add_hashes(hash_ids(np.arange(10000)))
+        self.assertTrue(bloom.contains_hashes(hash_ids(np.arange(10000))).all())
+        fp = bloom.contains_hashes(hash_ids(np.arange(10000, 110000))).mean()
+        self.assertLess(fp, 0.02)
+
+    def testScales(self):
+        bloom = ScalableBloomFilter(0.001, capacity=100)
+        keys = hash_ids(np.arange(50000))
+        for batch in np.array_split(keys, 7):
+            bloom.add_hashes(batch)
+
+        self.assertTrue(len(bloom.stages) > 1)
+        self.assertTrue(len(bloom) <= 50000)
+        self.assertTrue(bloom.contains_hashes(keys).all())
+        fp = bloom.contains_hashes(hash_ids(np.arange(50000, 250000))).mean()
+        self.assertLess(fp, 0.002)
+        # grown to fit, not sized upfront
+        self.assertEqual(0, ScalableBloomFilter(0.001).nbytes())
+
+    def testBytesAndUnion(self):
+        a, b = ScalableBloomFilter(0.001, capacity=100), ScalableBloomFilter(0.001, capacity=100)
+        a.add_hashes(hash_ids(np.arange(0, 150)))
+        b.add_hashes(hash_ids(np.arange(1000, 1500)))
+
+        c = ScalableBloomFilter.from_bytes(a.to_bytes())
+        self.assertEqual(a.to_bytes(), c.to_bytes())
+        self.assertTrue(c.contains_hashes(hash_ids(np.arange(0, 150))).all())
+
+        c.union(b)
+        self.assertTrue(c.contains_hashes(hash_ids(np.arange(0, 150))).all())
+        self.assertTrue(c.contains_hashes(hash_ids(np.arange(1000, 1500))).all())
+        self.assertRaises(Exception, ScalableBloomFilter.from_bytes, b"nope")
+
+    def testUnionCount(self):
+        a, b = BloomFilter(10000, 0.001), BloomFilter(10000, 0.001)
+        a.add_hashes(hash_ids(np.arange(0, 3000)))
+        b.add_hashes(hash_ids(np.arange(1000, 4000)))
+        a.union(b)
+        # 4000 keys, not the 6000 added, within a few percent
+        self.assertLess(abs(a.count - 4000), 200)
+        a.union(b)
+        self.assertLess(abs(a.count - 4000), 200)
@@ -0,0 +1,69 @@
+import os
+import pickle
+import unittest
+from tempfile import TemporaryDirectory
+from connspy.stream import Processor, parse_argv, resume
+from tests import TESTS_DIR
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt'), 'rb') as f:
+            self.lines = f.readlines()
+        self.dir = TemporaryDirectory()
+        self.log = os.path.join(self.dir.name, 'log.txt')
+        self.state_dir = os.path.join(self.dir.name, 'state')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_stream(self, options, res):
+        args = parse_argv(f'{options} --to aselin --from tanya {self.log}'.split())
+        def callback(hr, to, frm, most):
+            res.append([hr, sorted(to), sorted(frm), most])
+
+        pr = Processor(args, callback)
+        files, offset = resume(pr, args) if args.checkpoint_dir else (args.files, 0)
+        with open(files[0], 'rb') as f:
+            f.seek(offset)
+            pr.process(f, path=files[0])
+        return pr
+
+    def testResume(self):
+        with open(self.log, 'wb') as f:
+            f.writelines(self.lines)
+        expected = []
+        self.run_stream('--window 5m', expected).dump_remaining()
+
+        # the first half, then the rest appended after a restart
+        half = len(self.lines) // 2
+        with open(self.log, 'wb') as f:
+            f.writelines(self.lines[:half])
+        res = []
+        options = f'--window 5m --checkpoint_dir {self.state_dir} --distinct exact --distinct_max_keys 2'
+        pr = self.run_stream(options, res)
+        self.assertEqual(pr.emitted, len(res))
+        self.assertTrue(len(res) > 1)
+
+        with open(self.log, 'ab') as f:
+            f.writelines(self.lines[half:])
+        self.run_stream(options, res).dump_remaining()
+        self.assertListEqual(expected, res)
+
+    def testOptionsMustMatch(self):
+        with open(self.log, 'wb') as f:
+            f.writelines(self.lines[:100])
+        self.run_stream(f'--checkpoint_dir {self.state_dir}', [])
+        self.assertListEqual(['state.pickle'], os.listdir(self.state_dir))
+        with open(os.path.join(self.state_dir, 'state.pickle'), 'rb') as f:
+            self.assertEqual(os.path.getsize(self.log), pickle.load(f)['position'][2])
+
+        self.assertRaises(Exception, self.run_stream,
+                          f'--window 5m --checkpoint_dir {self.state_dir}', [])
+        self.assertRaises(Exception, parse_argv,
+                          f'--engine line --checkpoint_dir {self.state_dir} --to a x'.split())
+
+
+if __name__ == '__main__':
+    unittest.main()
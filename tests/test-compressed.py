@@ -0,0 +1,84 @@
+import os
+import gzip
+import unittest
+from tempfile import TemporaryDirectory
+from connspy.compressed import (open_log, compress_block, block_offsets,
+                                compression, zstandard)
+from connspy.index import build_index, compress_log, load_index
+from connspy.parallel import aligned_ranges
+from connspy.parser import read_chunks
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+class CompressedTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(SAMPLE, 'rb') as f:
+            self.data = f.read()
+        self.dir = TemporaryDirectory()
+        self.gz = os.path.join(self.dir.name, 'log.gz')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testPlainGzip(self):
+        with gzip.open(self.gz, 'wb') as f:
+            f.write(self.data)
+        self.assertEqual('gzip', compression(self.gz))
+        self.assertIsNone(compression(SAMPLE))
+        with open_log(self.gz) as f:
+            chunks = list(read_chunks(f))
+        self.assertEqual(self.data, b"".join(chunks))
+        self.assertTrue(all(chunk.endswith(b"\n") for chunk in chunks))
+
+        # one stream, so no index and no cutting it up
+        self.assertRaises(Exception, build_index, self.gz)
+        self.assertEqual([(0, os.path.getsize(self.gz))], aligned_ranges(self.gz, 4))
+
+    def testBlockCompressed(self):
+        index = compress_log(SAMPLE, self.gz, every_bytes=20000)
+        # still gzip as far as anyone else is concerned
+        with gzip.open(self.gz) as f:
+            self.assertEqual(self.data, f.read())
+        self.assertListEqual(block_offsets(self.gz), list(index.blocks['offset']))
+        self.assertTrue(len(index.blocks) > 10)
+
+        time_init, time_end = 1565660000, 1565670000
+        start, end = index.range(time_init, time_end)
+        index.close()
+        self.assertTrue(0 < start < end < os.path.getsize(self.gz))
+        with open_log(self.gz, start, end) as f:
+            lines = f.read().splitlines()
+        expected = [line for line in self.data.splitlines()
+                    if time_init <= int(line.split()[0]) / 1000 < time_end]
+        self.assertTrue(len(lines) > len(expected) > 0)
+        self.assertTrue(set(expected) <= set(lines))
+
+        for start, end in aligned_ranges(self.gz, 3):
+            self.assertIn(start, block_offsets(self.gz))
+
+    def testExtendsOnAppend(self):
+        compress_log(SAMPLE, self.gz, every_bytes=20000).close()
+        with open(self.gz, 'ab') as f:
+            appended = f.tell()
+            f.write(compress_block(b"1999999999000 a b\n"))
+            f.write(compress_block(b"1999999999001 a b\n")[:-3])     # still being written
+
+        index = load_index(self.gz)
+        self.assertEqual(appended, index.blocks['offset'][-1])
+        self.assertEqual(1999999999, index.blocks['max_ts'][-1])
+        index.close()
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def testZstd(self):
+        path = os.path.join(self.dir.name, 'log.zst')
+        with open(path, 'wb') as f:
+            f.write(zstandard.ZstdCompressor().compress(self.data))
+        with open_log(path) as f:
+            self.assertEqual(self.data, b"".join(read_chunks(f)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
+import os
+import random
 import unittest
 import datetime
 import logging 
 from tempfile import NamedTemporaryFile
 from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
 
 # datetime.datetime(2019,3,1,14,0,0).utctimestamp() = 1551466800
 
@@ -56,7 +59,7 @@ class StreamTest(unittest.TestCase):
                 # from a
                 self.assertListEqual(['b', 'c', 'd'], sorted(res[0][2]))
                 # most
-                self.assertEqual('a', res[0][3])
+                self.assertListEqual(['a'], res[0][3])
 
                 res = []
                 f1.write(f"{HOUR1 + 4500 + 3600} a f\n")
@@ -72,7 +75,7 @@ class StreamTest(unittest.TestCase):
                 # from a
                 self.assertListEqual(['e'], sorted(res[1][2]))
                 # most
-                self.assertEqual('e', res[1][3])
+                self.assertListEqual(['e'], res[1][3])
 
 
     def testMultipleFiles(self):
@@ -104,12 +107,156 @@ class StreamTest(unittest.TestCase):
             self.assertEqual(HOUR1, res[0][0])  # current hour
             self.assertListEqual(['a'], sorted(res[0][1]))
             self.assertListEqual(['b', 'c'], sorted(res[0][2]))
-            self.assertEqual('a', res[0][3])
+            self.assertListEqual(['a'], res[0][3])
 
             self.assertEqual(HOUR2, res[1][0])  # current hour
             self.assertListEqual(['c', 'e', 'f'], sorted(res[1][1]))
             self.assertListEqual([], sorted(res[1][2]))
-            self.assertEqual('b', res[1][3])
+            self.assertListEqual(['b'], res[1][3])
+
+    def testMultipleTargets(self):
+        with NamedTemporaryFile('w') as f1:
+            f1.write(f"{HOUR1 + 10} a b\n")
+            f1.write(f"{HOUR1 + 20} d b\n")
+            f1.write(f"{HOUR1 + 30} a c\n")
+            f1.write(f"{HOUR1 + 40} d c\n")
+            f1.write(f"{HOUR1 + 50} c a\n")
+            f1.flush()
+
+            for engine in ('line', 'batch'):
+                args = parse_argv(f'--engine {engine} --to b --to c --from a {f1.name}'.split())
+                res = []
+                def callback(hr, to, frm, most):
+                    res.append([hr,
+                        {target: list(hosts) for target, hosts in to.items()},
+                        {target: list(hosts) for target, hosts in frm.items()},
+                        most])
+
+                pr = Processor(args, callback)
+                with open(f1.name, 'r') as f2:
+                    pr.process(f2)
+                pr.dump_remaining()
+
+                self.assertEqual(1, len(res))
+                self.assertDictEqual({'b': ['a', 'd'], 'c': ['a', 'd']}, res[0][1])
+                self.assertDictEqual({'a': ['b', 'c']}, res[0][2])
+
+    def testTop(self):
+        with NamedTemporaryFile('w') as f1:
+            for line in ("a b", "c b", "a c", "d a", "c e", "c f"):
+                f1.write(f"{HOUR1 + 10} {line}\n")
+            f1.flush()
+
+            for engine in ('line', 'batch'):
+                args = parse_argv(f'--engine {engine} --top 3 --to b {f1.name}'.split())
+                res = []
+                def callback(hr, to, frm, most):
+                    res.append(most)
+
+                pr = Processor(args, callback)
+                with open(f1.name, 'r') as f2:
+                    pr.process(f2)
+                pr.dump_remaining()
+
+                self.assertListEqual([['c', 'a', 'b']], res)
+
+    def testWindows(self):
+        with NamedTemporaryFile('w') as f1:
+            f1.write(f"{HOUR1 + 10} a b\n")
+            f1.write(f"{HOUR1 + 320} c b\n")
+            f1.write(f"{HOUR1 + 290} d b\n")      # late, but not too late
+            f1.write(f"{HOUR1 + 700} e b\n")
+            f1.flush()
+
+            for engine in ('line', 'batch'):
+                res = []
+                def callback(hr, to, frm, most):
+                    res.append([hr, sorted(to)])
+
+                args = parse_argv(f'--engine {engine} --window 5m --max_log_late_seconds 60 '
+                                  f'--only_complete_hours --to b {f1.name}'.split())
+                pr = Processor(args, callback)
+                with open(f1.name, 'r') as f2:
+                    pr.process(f2)
+                self.assertListEqual([[HOUR1, ['a', 'd']]], res)
+
+                # 10 minute windows every 5 minutes
+                res = []
+                args = parse_argv(f'--engine {engine} --window 10m --hop 5m '
+                                  f'--to b {f1.name}'.split())
+                pr = Processor(args, callback)
+                with open(f1.name, 'r') as f2:
+                    pr.process(f2)
+                pr.dump_remaining()
+                self.assertListEqual([[HOUR1 - 300, ['a', 'd']],
+                                      [HOUR1, ['a', 'c', 'd']],
+                                      [HOUR1 + 300, ['c', 'e']],
+                                      [HOUR1 + 600, ['e']]], res)
+
+    def testExactDistinct(self):
+        path = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+        results = {}
+        for engine, distinct in (('batch', ''), ('line', '--distinct exact --distinct_max_keys 2'),
+                                 ('batch', '--distinct exact --distinct_max_keys 2')):
+            args = parse_argv(f'--engine {engine} {distinct} --window 1d '
+                              f'--to aselin --from tanya {path}'.split())
+            res = results[engine, distinct] = []
+            def callback(hr, to, frm, most):
+                res.append([hr, sorted(to), sorted(frm), most])
+
+            pr = Processor(args, callback)
+            with open(path, 'r') as f:
+                pr.process(f)
+            pr.dump_remaining()
+
+        self.assertTrue(len(results['batch', ''][0][1]) > 2)
+        for res in results.values():
+            self.assertListEqual(results['batch', ''], res)
+
+    def testEnginesAgree(self):
+        path = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+        results = {}
+        for engine, window in (('line', ''), ('batch', ''),
+                               ('line', '--window 5m --hop 1m'), ('batch', '--window 5m --hop 1m')):
+            args = parse_argv(f'--engine {engine} {window} --to aselin --from tanya {path}'.split())
+            res = results[engine, window] = []
+            def callback(hr, to, frm, most):
+                res.append([hr, list(to), list(frm), most])
+
+            pr = Processor(args, callback)
+            with open(path, 'r') as f:
+                pr.process(f)
+            pr.dump_remaining()
+
+        for window in ('', '--window 5m --hop 1m'):
+            self.assertTrue(len(results['line', window]) > 1)
+            self.assertListEqual(results['line', window], results['batch', window])
+
+    def testHopEnginesAgree(self):
+        # busy and out of order, so windows share lines and ties abound
+        rnd = random.Random(4)
+        with NamedTemporaryFile('w') as f1:
+            for i in range(3000):
+                ts = HOUR1 + i * 3 - rnd.randint(0, 200)
+                f1.write(f"{ts} h{rnd.randint(0, 60)} h{rnd.randint(0, 8)}\n")
+            f1.flush()
+
+            for window in ('--window 10m --hop 5m --from h2', '--window 1h --hop 15m --top 3'):
+                results = []
+                for engine in ('line', 'batch'):
+                    res = []
+                    def callback(hr, to, frm, most):
+                        res.append([hr, list(to), list(frm), most])
+                    args = parse_argv(f'--engine {engine} {window} --to h1 {f1.name}'.split())
+                    pr = Processor(args, callback)
+                    with open(f1.name, 'r') as f2:
+                        pr.process(f2)
+                    pr.dump_remaining()
+                    results.append(res)
+                self.assertTrue(len(results[0]) > 10)
+                self.assertListEqual(results[0], results[1])
 
     def testTailing(self):
         # this is the tricky one, we can't really use the
@@ -1,5 +1,8 @@
+import io
 import unittest
-from connspy.connspy import process_stream, parse_argv
+import tempfile
+from connspy.connspy import process_stream, process_chunks, parse_argv
+from connspy.parser import read_chunks
 
 class ProcessorTest(unittest.TestCase):
 
@@ -9,7 +12,7 @@ class ProcessorTest(unittest.TestCase):
               "1576815811 lilac garak"]
         args = parse_argv('--time_init 1567000000 --time_end 1580000000 --to garak dummyfile'.split())
         out = []
-        process_stream(f, args, lambda x: out.append(x))
+        process_stream(f, args, lambda x, to: out.append(x))
         self.assertListEqual(['lilac', 'quark'], sorted(out))
         
     def testDuplicatesRemoved(self):
@@ -23,12 +26,12 @@ class ProcessorTest(unittest.TestCase):
 
         out = []
         args = parse_argv('--time_init 1567000000 --time_end 1580000000 --to x dummyfile'.split())
-        process_stream(f, args, lambda x: out.append(x))
+        process_stream(f, args, lambda x, to: out.append(x))
         self.assertListEqual(['a', 'b'], sorted(out))
 
         out = []
         args = parse_argv('--time_init 1567000000 --time_end 1580000000 --to y dummyfile'.split())
-        process_stream(f, args, lambda x: out.append(x))
+        process_stream(f, args, lambda x, to: out.append(x))
         self.assertListEqual(['a', 'b', 'x'], sorted(out))
 
     def testTimeFilterWorks(self):
@@ -43,7 +46,7 @@ class ProcessorTest(unittest.TestCase):
         
         args = parse_argv('--time_init 1570000002 --time_end 1570000005 '
                           '--to y dummyfile'.split())
-        process_stream(f, args, lambda x: out.append(x))
+        process_stream(f, args, lambda x, to: out.append(x))
         out.sort()
         self.assertListEqual(['a', 'b'], sorted(out))
 
@@ -62,7 +65,70 @@ class ProcessorTest(unittest.TestCase):
         args = parse_argv('--time_init 1570000002 --time_end 1570000005 '
                           '--to y --max_log_late_seconds 4 dummyfile'.split())
         
-        process_stream(f, args, lambda x: out.append(x))
+        process_stream(f, args, lambda x, to: out.append(x))
 
         out.sort()
         self.assertListEqual(['a', 'd'], sorted(out))
+
+    def testBatchEngine(self):
+        f = [ "1570000000 b a", 
+              "1570000001 x y", 
+              "1570000002 a y",  # STARTS 
+              "1570000003 a x", 
+              "1570000005 x y",  # this should be missed due to cutoff
+              "1570000008 c y",  # this provides the latest timestamp
+              "1570000004 d y",  # still valid 
+              "1570000009 x y",  # this should make the end timestamp kick in 
+              "1570000004 e y"]  # thiis is outside cutoff time now 
+
+        args = parse_argv('--time_init 1570000002 --time_end 1570000005 '
+                          '--to y --max_log_late_seconds 4 dummyfile'.split())
+        for chunk_size in (1, 20, 1000):
+            out = []
+            data = io.BytesIO("\n".join(f).encode())
+            process_chunks(read_chunks(data, chunk_size), args, lambda x, to: out.append(x))
+            self.assertListEqual(['a', 'd'], out)
+
+    def testStopsPastLateLimit(self):
+        # a line later than --max_log_late_seconds behind the cutoff
+        # is left out, however much of the log the scan was given
+        f = [ "1570000002 a y",
+              "1570000009 x y",
+              "1570000004 e y"]
+        args = parse_argv('--time_init 1570000002 --time_end 1570000005 '
+                          '--to y --max_log_late_seconds 4 dummyfile'.split())
+        out = []
+        process_stream(f, args, lambda x, to: out.append(x))
+        self.assertListEqual(['a'], out)
+
+        out = []
+        data = io.BytesIO("\n".join(f).encode())
+        latest_ts = process_chunks(read_chunks(data), args, lambda x, to: out.append(x))
+        self.assertListEqual(['a'], out)
+        self.assertEqual(1570000009, latest_ts)
+
+    def testMultipleTargets(self):
+        f = [ "1570000000 b a", 
+              "1570000001 x y", 
+              "1570000002 a y",
+              "1570000003 a x", 
+              "1570000004 b y",
+              "1570000005 x y",
+              "1570000006 b x"]
+
+        with tempfile.NamedTemporaryFile('w') as targets:
+            targets.write("y  # comment\nzzz\n")
+            targets.flush()
+            args = parse_argv('--time_init 1567000000 --time_end 1580000000 '
+                              f'--to x --to_file {targets.name} dummyfile'.split())
+        self.assertListEqual(['x', 'y', 'zzz'], args.to)
+
+        expected = [('x', 'y'), ('a', 'y'), ('a', 'x'), ('b', 'y'), ('b', 'x')]
+        out = []
+        process_stream(f, args, lambda x, to: out.append((x, to)))
+        self.assertListEqual(expected, out)
+
+        out = []
+        data = io.BytesIO("\n".join(f).encode())
+        process_chunks(read_chunks(data), args, lambda x, to: out.append((x, to)))
+        self.assertListEqual(expected, out)
@@ -0,0 +1,42 @@
+import pickle
+import random
+import unittest
+import numpy as np
+from connspy.exactset import ExactIdSet
+
+
+class ExactSetTest(unittest.TestCase):
+
+    def testSmall(self):
+        s = ExactIdSet()
+        self.assertTrue(s.add(5))
+        self.assertFalse(s.add(5))
+        s.add_many(np.array([3, 5, 1]))
+        self.assertIn(3, s)
+        self.assertNotIn(4, s)
+        self.assertIsNone(s.file)
+        # in the order first added
+        self.assertListEqual([5, 3, 1], list(s))
+        self.assertRaises(Exception, s.add, 1)
+
+    def testSpills(self):
+        rnd = random.Random(5)
+        keys = [rnd.randrange(5000) for _ in range(20000)]
+        s = ExactIdSet(max_keys=300)
+        for i in range(0, len(keys), 1000):
+            s.add_many(keys[i:i + 1000])
+        for key in keys[:100]:
+            s.add(key)
+
+        self.assertTrue(len(s.runs) > 10)
+        self.assertTrue(len(s.keys) < 300)
+        self.assertIn(keys[0], s)
+        self.assertNotIn(5000, s)
+        again = pickle.loads(pickle.dumps(s))
+        self.assertListEqual(list(dict.fromkeys(keys)), list(s))
+        self.assertIsNone(s.file)
+        self.assertListEqual(list(dict.fromkeys(keys)), list(again))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+from connspy import connspy
+from connspy.graph import build_graph, load_graph, parse_argv, query
+from connspy.pack import write_pack
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+START, END = 1565650800, 1565672400     # six whole hours
+
+
+class GraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'log.txt')
+        shutil.copy(SAMPLE, self.path)
+        with open(SAMPLE) as f:
+            self.edges = [(frm, to) for ts, frm, to in (line.lower().split() for line in f)
+                          if START <= int(ts) / 1000 < END]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def reach(self, hosts, hops, direction):
+        """ by brute force over self.edges """
+        distance = {host: 0 for host in hosts}
+        frontier = set(hosts)
+        for hop in range(1, hops + 1):
+            frontier = {(frm if direction == 'in' else to) for frm, to in self.edges
+                        if (to if direction == 'in' else frm) in frontier} - set(distance)
+            distance.update((host, hop) for host in frontier)
+        return {host: hop for host, hop in distance.items() if hop}
+
+    def testReach(self):
+        build_graph(self.path)
+        graph = load_graph(self.path)
+        for host in ('zyla', 'aselin'):
+            for hops in (1, 2, 3):
+                for direction in ('in', 'out'):
+                    ids, found = graph.reach(graph.ids([host]), hops, direction, START, END)
+                    self.assertDictEqual(self.reach([host], hops, direction),
+                                         {graph.name(i): hop for i, hop in
+                                          zip(ids.tolist(), found.tolist())})
+
+        # one hop in is what connspy finds
+        args = connspy.parse_argv(['--to', 'zyla', '--time_init', str(START),
+                                   '--time_end', str(END), self.path])
+        expected = []
+        connspy.scan(args, lambda frm, to: expected.append(frm))
+        ids, _ = graph.reach(graph.ids(['zyla']), 1, 'in', START, END)
+        self.assertCountEqual(expected, [graph.name(i) for i in ids.tolist()])
+
+    def testBuckets(self):
+        build_graph(self.path, 5 * 60)
+        graph = load_graph(self.path)
+        ids, _ = graph.reach(graph.ids(['zyla']), 2, 'in', START, END)
+        self.assertEqual(len(self.reach(['zyla'], 2, 'in')), len(ids))
+        # a range within a bucket is answered with the whole bucket
+        self.assertEqual(graph.buckets(START + 1, START + 2),
+                         graph.buckets(START, START + 300))
+
+    def testFan(self):
+        write_pack(self.path)
+        build_graph(self.path + '.pack')
+        graph = load_graph(self.path + '.pack')
+        hosts = ['zyla', 'aselin', 'nosuchhost']
+        args = parse_argv(['query', '--fan', hosts[0], '--fan', hosts[1], '--fan', hosts[2],
+                           '--top', '3', '--time_init', str(START), '--time_end', str(END),
+                           self.path + '.pack'])
+        lines = [line.split("\t") for line in query(graph, args)]
+
+        fans = [line for line in lines if line[0] == 'FAN']
+        self.assertEqual(2, len(fans))
+        for _, host, fan_in, fan_out in fans:
+            self.assertEqual(len({frm for frm, to in self.edges if to == host}), int(fan_in))
+            self.assertEqual(len({to for frm, to in self.edges if frm == host}), int(fan_out))
+
+        top = [line for line in lines if line[0] == 'FAN_IN']
+        counts = {}
+        for frm, to in set(self.edges):
+            counts[to] = counts.get(to, 0) + 1
+        self.assertEqual(3, len(top))
+        self.assertListEqual(sorted(counts.values(), reverse=True)[:3],
+                             [int(count) for _, _, count in top])
+
+    def testStale(self):
+        build_graph(self.path)
+        with open(self.path, 'rb') as f:
+            lines = f.readlines()
+        with open(self.path, 'ab') as f:
+            f.writelines(lines[-10:])
+        with self.assertLogs('graph', 'WARNING'):
+            self.assertIsNotNone(load_graph(self.path))
+        with open(self.path, 'wb') as f:
+            f.writelines(lines[:100])
+        self.assertIsNone(load_graph(self.path))
+
+    def testIds(self):
+        build_graph(self.path)
+        graph = load_graph(self.path)
+        ids = graph.ids(['zyla', 'nosuchhost', 'aselin', 'zyla', 'zzzz', 'a'])
+        self.assertListEqual(['aselin', 'zyla'], sorted(graph.name(i) for i in ids.tolist()))
+        self.assertEqual(0, len(graph.ids([])))
+        # an empty time range reaches nobody
+        self.assertEqual(0, len(graph.reach(ids, 2, 'in', START, START)[0]))
+
+    def testArgs(self):
+        for argv in (['query', '--time_init', '1', '--time_end', '2', 'log'],
+                     ['query', '--to', 'a', '--hops', '0', '--time_init', '1',
+                      '--time_end', '2', 'log'],
+                     ['query', '--to', 'a', '--time_init', '2', '--time_end', '1', 'log'],
+                     ['build', '--bucket', '0', 'log']):
+            with self.assertRaises(Exception):
+                parse_argv(argv)
+
+
+if __name__ == '__main__':
+    unittest.main()
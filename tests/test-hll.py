@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from connspy.bloomset import hash_strings
+from connspy.hll import HostHLL
+from connspy.parallel import process_parallel
+from connspy.sinks import make_sink
+from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+def peers(n, prefix="peer"):
+    return hash_strings([f"{prefix}{i}" for i in range(n)])
+
+
+class HostHLLTest(unittest.TestCase):
+
+    def testEstimates(self):
+        hll = HostHLL(10)
+        for host_id, n in ((0, 10), (2, 1000), (5, 100000)):
+            hll.add(np.full(n, host_id, np.int32), peers(n))
+            # seeing them again changes nothing
+            hll.add(np.full(n, host_id, np.int32), peers(n))
+        estimates = hll.estimates()
+        self.assertEqual(6, len(estimates))
+        self.assertEqual(0, estimates[1])
+        # 1.04 / sqrt(1024) is about 3%, so well within 10%
+        for host_id, n in ((0, 10), (2, 1000), (5, 100000)):
+            self.assertTrue(abs(estimates[host_id] - n) < 0.1 * n + 1)
+        self.assertListEqual([5, 2, 0], [host_id for host_id, _ in hll.top(5)])
+
+    def testMerge(self):
+        a, b, both = HostHLL(), HostHLL(), HostHLL()
+        hashes = peers(5000)
+        owners = np.arange(5000, dtype=np.int32) % 3
+        a.add(owners[:3000], hashes[:3000])
+        b.add(owners[2000:], hashes[2000:])
+        both.add(owners, hashes)
+        a.merge(b)
+        self.assertTrue((a.registers[:3] == both.registers[:3]).all())
+
+        # host 1 of b is host 7 of the other table
+        moved = b.relabel(np.array([0, 7, 2], dtype=np.int32))
+        self.assertListEqual([0, 2, 7], sorted(moved.ids.tolist()))
+        self.assertEqual(b.estimates()[1], moved.estimates()[7])
+        self.assertEqual(3, len(b))
+        with self.assertRaises(Exception):
+            a.merge(HostHLL(8))
+
+    def testSparse(self):
+        hll = HostHLL(12)
+        hll.add(np.array([1000000, 5, 1000000], dtype=np.int32), peers(3))
+        hll.add(np.array([5, 70], dtype=np.int32), peers(2, "other"))
+        # a row for each host seen, however high its id, ties by lowest id
+        self.assertEqual(3, len(hll))
+        self.assertTrue(hll.nbytes() < 4 * 4096 + 100)
+        self.assertListEqual([(5, 2), (1000000, 2), (70, 1)], hll.top(5))
+        self.assertEqual(1000001, len(hll.estimates()))
+
+
+class FanTopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        with open(SAMPLE, 'rb') as f:
+            lines = f.readlines()
+        self.paths = []
+        for i, part in enumerate((lines[:5000], lines[5000:])):
+            path = os.path.join(self.dir.name, f'log{i}.txt')
+            with open(path, 'wb') as f:
+                f.writelines(part)
+            self.paths.append(path)
+        self.lines = [line.decode().lower().split() for line in lines]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_stream(self, argv, workers=1):
+        fans = []
+        def callback(window, to, frm, most, window_fans):
+            fans.extend((window, kind, host, count) for kind, counts in window_fans.items()
+                        for host, count in counts)
+        pr = Processor(parse_argv(argv + self.paths), callback)
+        if workers > 1:
+            process_parallel(pr, self.paths, workers)
+        else:
+            for path in self.paths:
+                with open(path, 'rb') as f:
+                    pr.process(f)
+        pr.dump_remaining()
+        return fans
+
+    def testExact(self):
+        fans = self.run_stream(['--to', 'zyla', '--fan_top', '3', '--fan_precision', '12'])
+        exact = {}
+        for ts, frm, to in self.lines:
+            window = int(ts) // 1000 // 3600 * 3600
+            exact.setdefault((window, 'FAN_IN', to), set()).add(frm)
+            exact.setdefault((window, 'FAN_OUT', frm), set()).add(to)
+
+        self.assertEqual(24 * 2 * 3, len(fans))
+        for window, kind, host, count in fans:
+            # so few peers are counted all but exactly
+            self.assertTrue(abs(len(exact[(int(window), kind, host)]) - count) <= 1)
+        best = {}
+        for (window, kind, _), hosts in exact.items():
+            best[(window, kind)] = max(best.get((window, kind), 0), len(hosts))
+        # the first of each window and kind is about the most connected
+        for window, kind, host, count in fans[::3]:
+            self.assertTrue(count >= best[(int(window), kind)] - 1)
+
+    def testParallel(self):
+        argv = ['--to', 'zyla', '--window', '2h', '--fan_top', '5']
+        self.assertListEqual(sorted(self.run_stream(argv)),
+                             sorted(self.run_stream(argv, workers=2)))
+
+    def testSinks(self):
+        fans = {'FAN_IN': [('a', 12)], 'FAN_OUT': [('b', 3), ('c', 2)]}
+        path = os.path.join(self.dir.name, 'out')
+        for kind in ('tsv', 'sqlite'):
+            sink = make_sink(f"{kind}:{path}.{kind}")
+            sink(1565647200.0, {}, {}, ['a'], fans)
+            sink.close()
+        with open(path + '.tsv') as f:
+            self.assertEqual("1565647200.0\tMOST\ta\n1565647200.0\tFAN_IN\ta\t12\n"
+                             "1565647200.0\tFAN_OUT\tb\t3\n1565647200.0\tFAN_OUT\tc\t2\n",
+                             f.read())
+        con = sqlite3.connect(path + '.sqlite')
+        rows = con.execute("SELECT window, kind, host, count FROM fans ORDER BY rowid").fetchall()
+        con.close()
+        self.assertListEqual([(1565647200.0, 'FAN_IN', 'a', 12), (1565647200.0, 'FAN_OUT', 'b', 3),
+                              (1565647200.0, 'FAN_OUT', 'c', 2)], rows)
+
+    def testArgs(self):
+        for argv in (['--fan_top', '3', '--engine', 'line'], ['--fan_top', '-1'],
+                     ['--fan_top', '3', '--fan_precision', '3']):
+            with self.assertRaises(Exception):
+                parse_argv(argv + ['--to', 'a', 'log'])
+
+
+if __name__ == '__main__':
+    unittest.main()
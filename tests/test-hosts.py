@@ -0,0 +1,22 @@
+import unittest
+from connspy.hosts import HostTable
+from connspy.bloomset import BloomIdSet
+
+class HostTableTest(unittest.TestCase):
+
+    def testInterning(self):
+        hosts = HostTable()
+        a = hosts.intern("a")
+        b = hosts.intern("b")
+        self.assertEqual(a, hosts.intern("a"))
+        self.assertNotEqual(a, b)
+        self.assertEqual("b", hosts[b])
+        self.assertEqual(2, len(hosts))
+        self.assertIsNone(hosts.get("c"))
+
+    def testViewOfIdSet(self):
+        hosts = HostTable()
+        s = BloomIdSet()
+        for name in ["x", "y", "x", "z"]:
+            s.add(hosts.intern(name))
+        self.assertListEqual(["x", "y", "z"], list(hosts.view(s)))
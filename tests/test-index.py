@@ -0,0 +1,104 @@
+import os
+import random
+import unittest
+import tempfile
+from connspy import connspy
+from connspy.index import build_index, load_index, index_path
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
+            self.path = f.name
+            self.offsets = {}
+            for ts in range(10000, 20000):
+                self.offsets[ts] = f.tell()
+                f.write(f"{ts} a b\n")
+            # a late line, far from where its timestamp belongs
+            self.late_offset = f.tell()
+            f.write("12000 late b\n")
+
+    def tearDown(self):
+        for p in (self.path, index_path(self.path)):
+            if os.path.exists(p):
+                os.unlink(p)
+
+    def testRange(self):
+        index = build_index(self.path, every_bytes=4096)
+        self.assertTrue(len(index.blocks) > 10)
+
+        start, end = index.range(15000, 15010)
+        self.assertTrue(start <= self.offsets[15000])
+        self.assertTrue(self.offsets[15000] - start < 2 * 4096)
+        self.assertTrue(0 <= end - self.offsets[15010] < 2 * 4096)
+
+        start, end = index.range(11000, 12000)
+        self.assertTrue(start <= self.offsets[11000] < self.offsets[12000] <= end)
+        self.assertTrue(end - self.offsets[12000] < 2 * 4096)
+
+        # a scan stops well before the late line at the very end,
+        # unless lines can be late enough for it
+        start, end = index.range(11990, 12010)
+        self.assertTrue(0 <= end - self.offsets[12010] < 2 * 4096)
+        self.assertIsNone(index.range(11990, 12010, 10000)[1])
+        index.close()
+
+    def testSameAsSeeking(self):
+        random.seed(5)
+        with open(self.path, 'w') as f:
+            for ts in range(10000, 40000):
+                if ts % 1000 == 500:
+                    # very late, from a host seen nowhere else
+                    f.write(f"{ts - random.randint(100, 5000)} late{ts} h1\n")
+                    continue
+                f.write(f"{ts} h{random.randint(0, 50)} h{random.randint(0, 3)}\n")
+        build_index(self.path, every_bytes=4096).close()
+
+        for time_init, time_end, late in ((12000, 13000, 0), (20000, 20100, 60),
+                                          (15000, 30000, 600), (39000, 50000, 0)):
+            found = {}
+            for options in ([], ['--noindex'], ['--noindex', '--nofastseek']):
+                args = connspy.parse_argv(options + ['--to', 'h1', '--to', 'h2', '--time_init',
+                                                     str(time_init), '--time_end', str(time_end),
+                                                     '--max_log_late_seconds', str(late),
+                                                     self.path])
+                hits = found[tuple(options)] = []
+                connspy.scan(args, lambda frm, to: hits.append((frm, to)))
+            self.assertTrue(found[()])
+            self.assertListEqual(found[('--noindex', '--nofastseek')], found[()])
+            self.assertListEqual(found[('--noindex', '--nofastseek')], found[('--noindex',)])
+
+    def testRewrittenInPlace(self):
+        build_index(self.path, every_bytes=4096).close()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        inode = os.stat(self.path).st_ino
+        # the same inode, bigger, but not an append
+        with open(self.path, 'wb') as f:
+            f.write(data.replace(b" a b", b" c d") + b"30000 a b\n")
+        self.assertEqual(inode, os.stat(self.path).st_ino)
+        self.assertIsNone(load_index(self.path))
+
+        # the old format isn't trusted either
+        with open(index_path(self.path), 'r+b') as f:
+            f.write(b"CSPYIDX1")
+        self.assertIsNone(load_index(self.path))
+
+    def testEveryLines(self):
+        index = build_index(self.path, every_lines=1000)
+        self.assertListEqual([self.offsets[ts] for ts in range(10000, 20000, 1000)],
+                             list(index.blocks['offset'][:-1]))
+        index.close()
+
+    def testExtendsOnAppend(self):
+        build_index(self.path, every_bytes=4096).close()
+        with open(self.path, 'a') as f:
+            appended = f.tell()
+            f.write("30000 a b\n")
+            f.write("30001 a b")     # still being written
+
+        index = load_index(self.path)
+        self.assertEqual(appended, index.blocks['offset'][-1])
+        self.assertEqual(30000, index.blocks['max_ts'][-1])
+        self.assertEqual(appended + len("30000 a b\n"), index.size)
+        index.close()
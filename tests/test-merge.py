@@ -0,0 +1,111 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from connspy.merge import merge_columns
+from connspy.pack import write_pack
+from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+def batches(ts, size):
+    """ ts cut into column batches, frm and to being the row numbers """
+    ts = np.asarray(ts, dtype=np.float64)
+    rows = np.arange(len(ts), dtype=np.int32)
+    for start in range(0, len(ts), size):
+        yield ts[start:start + size], rows[start:start + size], rows[start:start + size]
+
+
+class MergeTest(unittest.TestCase):
+
+    def testOrdered(self):
+        a = np.arange(0, 3000, 3)
+        b = np.arange(1, 3000, 2)
+        merged = list(merge_columns([batches(a, 100), batches(b, 37), batches([], 10)]))
+        ts = np.concatenate([batch[0] for batch in merged])
+        self.assertListEqual(sorted(a.tolist() + b.tolist()), ts.tolist())
+        # the same row numbers came through with each
+        frm = np.concatenate([batch[1] for batch in merged])
+        self.assertEqual(len(a) + len(b), len(frm))
+
+    def testHeldBack(self):
+        # a long log against a short one and one far behind the others
+        sources = [batches(np.arange(100000), 1000), batches(np.arange(50000, 51000), 1000),
+                   batches(np.arange(200000, 300000), 1000)]
+        last = -1
+        for ts, _, _ in merge_columns(sources):
+            # never much more than a batch a source at a time
+            self.assertTrue(len(ts) <= 3000)
+            self.assertTrue(ts[0] >= last)
+            last = ts[-1]
+
+    def testLate(self):
+        # a line late in its own log is no later once merged
+        a = [10, 20, 30, 15, 40, 50]
+        b = [12, 22, 32, 42, 52]
+        ts = np.concatenate([batch[0] for batch in
+                             merge_columns([batches(a, 2), batches(b, 2)])])
+        latest = np.maximum.accumulate(ts)
+        self.assertTrue((latest - ts).max() <= 15)
+        self.assertCountEqual(a + b, ts.tolist())
+
+
+class MergedStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        with open(SAMPLE, 'rb') as f:
+            lines = f.readlines()
+        # three collectors, each with a share of every hour
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.dir.name, f'collector{i}.txt')
+            with open(path, 'wb') as f:
+                f.writelines(lines[i::3])
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def summarize(self, argv, merged):
+        args = parse_argv(argv)
+        rows = []
+        pr = Processor(args, lambda window, to, frm, most: rows.extend(
+            [(window, 'TO', name) for name in to] + [(window, 'FROM', name) for name in frm] +
+            [(window, 'MOST', name) for name in most]))
+        if merged:
+            pr.process_merged(args.files)
+        else:
+            for path in args.files:
+                with open(path, 'rb') as f:
+                    pr.process(f)
+        pr.dump_remaining()
+        return sorted(rows)
+
+    def testSameAsOneLog(self):
+        options = ['--to', 'aselin', '--to', 'zyla', '--from', 'tanya', '--window', '1h',
+                   '--distinct', 'exact']
+        expected = self.summarize(options + [SAMPLE], False)
+        self.assertTrue(len(expected) > 20)
+        self.assertListEqual(expected, self.summarize(options + ['--merge'] + self.paths, True))
+        # one after the other, each window comes out once a log
+        self.assertNotEqual(expected, self.summarize(options + self.paths, False))
+
+        # a packed log merges just the same
+        write_pack(self.paths[1])
+        paths = [self.paths[0], self.paths[1] + '.pack', self.paths[2]]
+        self.assertListEqual(expected, self.summarize(options + ['--merge'] + paths, True))
+
+    def testOptions(self):
+        for options in (['--merge', '--engine', 'line'], ['--merge', '--tail'],
+                        ['--merge', '--workers', '2']):
+            with self.assertRaises(Exception):
+                parse_argv(options + ['--to', 'a'] + self.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import io
+import os
+import json
+import pickle
+import unittest
+import urllib.request
+from tempfile import TemporaryDirectory
+from connspy import connspy
+from connspy.metrics import Metrics, Reporter, parse_target
+from connspy.parser import read_chunks, read_lines
+from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(SAMPLE, 'rb') as f:
+            lines = f.readlines()
+        # some late lines, and some that aren't lines at all
+        lines[100], lines[101] = lines[101], lines[100]
+        lines[5000:5000] = [lines[10], b"garbage\n", b"1565647204351 nohost\n"]
+        self.log = b"".join(lines)
+
+    def testHistogram(self):
+        m = Metrics()
+        m.observe('line_lateness_seconds', [0, 0, 0.5, 1, 7, 10 ** 6])
+        m.count('lines', 6)
+        m.set('window_bytes', {'1565647200': 100})
+        text = m.prometheus()
+        self.assertIn('connspy_lines_total 6\n', text)
+        self.assertIn('connspy_line_lateness_seconds_bucket{le="0"} 2\n', text)
+        self.assertIn('connspy_line_lateness_seconds_bucket{le="1"} 4\n', text)
+        self.assertIn('connspy_line_lateness_seconds_bucket{le="15"} 5\n', text)
+        self.assertIn('connspy_line_lateness_seconds_bucket{le="+Inf"} 6\n', text)
+        self.assertIn('connspy_window_bytes{window="1565647200"} 100\n', text)
+
+        other = pickle.loads(pickle.dumps(m))
+        m.merge(other)
+        snapshot = m.snapshot()
+        self.assertEqual(12, snapshot['lines'])
+        self.assertEqual(8, snapshot['line_lateness_seconds']['buckets']['1'])
+
+    def testEngines(self):
+        snapshots = []
+        for engine in ('batch', 'line'):
+            args = parse_argv(f'--engine {engine} --window 5m --to aselin x'.split())
+            pr = Processor(args, lambda *summary: None)
+            pr.metrics = Metrics()
+            pr.process(io.BytesIO(self.log) if engine == 'batch' else
+                       io.StringIO(self.log.decode()))
+            pr.update_gauges()
+            self.assertTrue(pr.metrics.gauge('open_windows') > 0)
+            self.assertEqual(len(pr.windows), len(pr.metrics.gauge('window_bytes')))
+            pr.dump_remaining()
+            snapshots.append(pr.metrics.snapshot())
+
+        batch, line = snapshots
+        self.assertEqual(10001, batch['lines'])
+        self.assertEqual(2, batch['rejected_lines'])
+        self.assertEqual(len(self.log), batch['bytes'])
+        self.assertTrue(batch['windows_emitted'] > 100)
+        for name in ('lines', 'rejected_lines', 'windows_emitted', 'line_lateness_seconds'):
+            self.assertEqual(batch[name], line[name])
+        self.assertEqual(2, batch['line_lateness_seconds']['count'] -
+                            batch['line_lateness_seconds']['buckets']['0'])
+
+        # a day long window has all of aselin's hosts
+        pr = Processor(parse_argv('--window 1d --to aselin x'.split()), lambda *summary: None)
+        pr.metrics = Metrics()
+        pr.process(io.BytesIO(self.log))
+        pr.update_gauges()
+        self.assertTrue(0 < pr.metrics.gauge('bloom_fill_ratio') < 1)
+        self.assertTrue(min(pr.metrics.gauge('window_bytes').values()) > 0)
+        # nothing followed
+        self.assertEqual(0, pr.metrics.gauge('tail_backlog_bytes'))
+
+    def testNothingReadYet(self):
+        pr = Processor(parse_argv('--to aselin x'.split()), lambda *summary: None)
+        pr.metrics = Metrics()
+        pr.update_gauges()
+        # strict JSON, no Infinity
+        snapshot = json.loads(json.dumps(pr.metrics.snapshot(), allow_nan=False))
+        self.assertIsNone(snapshot['ingest_lag_seconds'])
+        self.assertIsNone(snapshot['latest_timestamp_seconds'])
+        self.assertNotIn('ingest_lag', pr.metrics.prometheus())
+
+        pr.process(io.BytesIO(self.log))
+        pr.update_gauges()
+        self.assertTrue(pr.metrics.gauge('ingest_lag_seconds') > 0)
+        self.assertEqual(pr.latest_ts, pr.metrics.gauge('latest_timestamp_seconds'))
+        self.assertIn('connspy_ingest_lag_seconds ', pr.metrics.prometheus())
+
+    def testConnspy(self):
+        args = connspy.parse_argv(['--to', 'zyla', '--time_init', '1565650000',
+                                   '--time_end', '1565700000', SAMPLE])
+        counts = []
+        for process, read in ((connspy.process_chunks, read_chunks),
+                              (connspy.process_stream, read_lines)):
+            m = Metrics()
+            process(read(io.BytesIO(self.log)), args, lambda frm, to: None, metrics=m)
+            counts.append((m.counters['lines'], m.counters['rejected_lines']))
+        self.assertEqual(counts[0], counts[1])
+        self.assertTrue(counts[0][0] < 10001)   # stopped once past the range
+
+        with self.assertRaises(Exception):
+            connspy.parse_argv(['--to', 'zyla', '--time_init', '1', '--time_end', '2',
+                                '--metrics', 'http:9100', SAMPLE])
+
+    def testTargets(self):
+        self.assertEqual(('http', '127.0.0.1', 9100), parse_target('http:9100'))
+        self.assertEqual(('http', '0.0.0.0', 9100), parse_target('http:0.0.0.0:9100'))
+        self.assertEqual(('file', 'x.prom'), parse_target('x.prom'))
+        with self.assertRaises(Exception):
+            parse_target('http:port')
+
+        m = Metrics()
+        m.count('lines', 3)
+        out = io.StringIO()
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'connspy.prom')
+            Reporter(m, path, stream=out).report()
+            with open(path) as f:
+                self.assertIn('connspy_lines_total 3\n', f.read())
+        self.assertEqual(3, json.loads(out.getvalue())['lines'])
+
+        reporter = Reporter(m, 'http:0', stream=out)
+        port = reporter.server.server_port
+        m.count('lines', 2)
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as page:
+            self.assertIn('connspy_lines_total 5\n', page.read().decode())
+        reporter.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import random
+import unittest
+from tempfile import TemporaryDirectory
+import numpy as np
+from connspy import connspy
+from connspy.pack import write_pack, is_packed, to_micros, to_seconds
+from connspy.parser import BatchParser, parse_ts_array, read_chunks
+from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+class PackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'log.pack')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testMicros(self):
+        raw = np.array([1565647204351, 1565647204.5, 1.25, -3.75, 1565647204.0000015])
+        ts, valid = parse_ts_array(raw)
+        self.assertTrue(valid.all())
+        self.assertTrue(np.array_equal(ts, to_seconds(to_micros(ts))))
+
+    def testColumns(self):
+        with open(SAMPLE, 'rb') as f:
+            cols = BatchParser().parse(f.read() + b"garbage line\n")
+        pack = write_pack(SAMPLE, self.path, block_rows=3000)
+        self.assertTrue(is_packed(self.path))
+        self.assertFalse(is_packed(SAMPLE))
+        self.assertListEqual([3000, 3000, 3000, 1000], pack.blocks['rows'].tolist())
+
+        ts, frm, to = (np.concatenate(col) for col in
+                       zip(*(pack.block(i) for i in range(len(pack.blocks)))))
+        self.assertTrue(np.array_equal(cols.ts[cols.valid], to_seconds(ts)))
+        self.assertTrue(np.array_equal(cols.frm[cols.valid], frm))
+        self.assertTrue(np.array_equal(cols.to[cols.valid], to))
+        self.assertEqual('aadvik', pack.names[0])
+
+        # a range in the middle of the second block only needs that one
+        first, last = to_seconds(pack.blocks['min_ts'][1]), to_seconds(pack.blocks['max_ts'][1])
+        self.assertListEqual([1], pack.blocks_between(first + 1, last - 1).tolist())
+        pack.close()
+
+    def testConnspy(self):
+        pack = write_pack(SAMPLE, self.path, block_rows=1000)
+        args = connspy.parse_argv(['--to', 'zyla', '--to', 'aselin', '--time_init', '1565650000',
+                                   '--time_end', '1565700000', SAMPLE])
+        expected, res = [], []
+        with open(SAMPLE, 'rb') as f:
+            connspy.process_chunks(read_chunks(f), args, lambda *hit: expected.append(hit))
+        connspy.process_packed(pack, args, lambda *hit: res.append(hit))
+        self.assertTrue(len(expected) > 2)
+        self.assertListEqual(expected, res)
+        pack.close()
+
+    def testLateLines(self):
+        rnd = random.Random(9)
+        log = os.path.join(self.dir.name, 'late.log')
+        with open(log, 'w') as f:
+            for i in range(20000):
+                ts = 1565000000 + i * 2
+                if i % 300 == 150:
+                    # past any --max_log_late_seconds, so after the end of a scan
+                    ts -= 2000
+                f.write(f"{ts} h{rnd.randint(0, 300)} h{rnd.randint(0, 3)}\n")
+        pack = write_pack(log, self.path, block_rows=1000)
+        for _ in range(30):
+            time_init = 1565000000 + rnd.randint(0, 36000)
+            time_end = time_init + rnd.randint(1, 4000)
+            args = connspy.parse_argv(['--to', 'h1', '--time_init', str(time_init),
+                                       '--time_end', str(time_end), log])
+            expected, res = [], []
+            with open(log, 'rb') as f:
+                connspy.process_chunks(read_chunks(f), args, lambda *hit: expected.append(hit))
+            connspy.process_packed(pack, args, lambda *hit: res.append(hit))
+            self.assertListEqual(expected, res)
+        pack.close()
+
+    def testStream(self):
+        pack = write_pack(SAMPLE, self.path, block_rows=777)
+        results = []
+        for packed in (False, True):
+            args = parse_argv(f'--window 5m --to aselin --from tanya {SAMPLE}'.split())
+            res = []
+            results.append(res)
+            def callback(hr, to, frm, most):
+                res.append([hr, sorted(to), sorted(frm), most])
+
+            pr = Processor(args, callback)
+            if packed:
+                pr.process_pack(pack)
+            else:
+                with open(SAMPLE, 'rb') as f:
+                    pr.process(f)
+            pr.dump_remaining()
+
+        self.assertTrue(len(results[0]) > 10)
+        self.assertListEqual(results[0], results[1])
+        pack.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import random
+import unittest
+from tempfile import TemporaryDirectory, NamedTemporaryFile
+from connspy import parallel
+from connspy import connspy
+from connspy.parallel import line_aligned_ranges, process_parallel, scan_parallel
+from connspy.parser import read_chunks
+from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+def run(argv, files, workers):
+    res = []
+    def callback(hr, to, frm, most):
+        res.append([hr, sorted(to), sorted(frm), most])
+
+    pr = Processor(parse_argv(argv.split() + files), callback)
+    if workers > 1:
+        process_parallel(pr, files, workers)
+    else:
+        for path in files:
+            with open(path, 'rb') as f:
+                pr.process(f)
+    pr.dump_remaining()
+    return res
+
+
+class ParallelTest(unittest.TestCase):
+
+    def testLineAlignedRanges(self):
+        with open(SAMPLE, 'rb') as f:
+            data = f.read()
+
+        for n in (1, 2, 3, 7, 50):
+            ranges = line_aligned_ranges(SAMPLE, n)
+            self.assertTrue(1 <= len(ranges) <= n)
+            self.assertEqual(0, ranges[0][0])
+            self.assertEqual(len(data), ranges[-1][1])
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(b"\n"[0], data[start - 1])
+
+        # a sub range
+        ranges = line_aligned_ranges(SAMPLE, 4, 1000, 5000)
+        self.assertEqual(1000, ranges[0][0])
+        self.assertEqual(5000, ranges[-1][1])
+
+    def testFilesMatchSerial(self):
+        with open(SAMPLE, 'r') as f:
+            lines = f.readlines()
+
+        with TemporaryDirectory() as tmp:
+            files = []
+            step = len(lines) // 3 + 1
+            for i in range(0, len(lines), step):
+                files.append(os.path.join(tmp, f"part{i}"))
+                with open(files[-1], 'w') as f:
+                    f.writelines(lines[i:i + step])
+
+            serial = run('--to aselin --from tanya', files, 1)
+            self.assertTrue(len(serial) > 1)
+            self.assertListEqual(serial, run('--to aselin --from tanya', files, 3))
+
+    def testVeryLateLines(self):
+        random.seed(3)
+        with TemporaryDirectory() as tmp:
+            files = []
+            for i in range(3):
+                files.append(os.path.join(tmp, f"part{i}"))
+                with open(files[-1], 'w') as f:
+                    for j in range(5000):
+                        ts = 1565000000 + (i * 5000 + j) * 2
+                        if j % 500 == 250:
+                            # past --max_log_late_seconds, so its hour is opened again
+                            ts -= 5000
+                        f.write(f"{ts}000 h{random.randint(0, 300)} h{random.randint(0, 5)}\n")
+
+            serial = run('--to h1 --top 2', files, 1)
+            hours = [hr for hr, _, _, _ in serial]
+            self.assertTrue(len(hours) > len(set(hours)))
+            self.assertListEqual(sorted(serial), sorted(run('--to h1 --top 2', files, 3)))
+
+    def testSplitFile(self):
+        min_range_bytes = parallel.MIN_RANGE_BYTES
+        parallel.MIN_RANGE_BYTES = 1024
+        try:
+            self.assertEqual(4, len(parallel.make_jobs([SAMPLE], 4)))
+            serial = run('--to aselin --from tanya', [SAMPLE], 1)
+            self.assertListEqual(serial, run('--to aselin --from tanya', [SAMPLE], 4))
+        finally:
+            parallel.MIN_RANGE_BYTES = min_range_bytes
+
+    def testSplitFileLateLines(self):
+        random.seed(27)
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log")
+            with open(path, 'w') as f:
+                ts = 1565647200
+                for i in range(8000):
+                    r = random.random()
+                    if r < 0.01:
+                        # too late, the windows it would go in depend on every line before
+                        line_ts = ts - random.randint(300, 5000)
+                    elif r < 0.3:
+                        line_ts = ts - random.randint(0, 300)
+                    else:
+                        ts += random.randint(0, 60)
+                        line_ts = ts
+                    f.write(f"{line_ts} h{random.randint(0, 100)} h{random.randint(0, 5)}\n")
+
+            min_range_bytes = parallel.MIN_RANGE_BYTES
+            parallel.MIN_RANGE_BYTES = 2048
+            try:
+                argv = '--to h1 --from h2 --window 5m --top 2'
+                serial = run(argv, [path], 1)
+                for workers in (2, 5):
+                    self.assertTrue(len(parallel.make_jobs([path], workers)) > 1)
+                    self.assertListEqual(serial, run(argv, [path], workers))
+            finally:
+                parallel.MIN_RANGE_BYTES = min_range_bytes
+
+    def testScanMatchesSerial(self):
+        random.seed(7)
+        with NamedTemporaryFile('w') as f:
+            for i in range(20000):
+                # a bit out of order, with the odd bad line
+                ts = 1565000000 + i + random.randint(-200, 0)
+                f.write(f"{ts} h{random.randint(0, 300)} h{random.randint(0, 5)}\n")
+                if i % 997 == 0:
+                    f.write("garbage\n")
+            f.flush()
+
+            min_range_bytes = parallel.MIN_RANGE_BYTES
+            parallel.MIN_RANGE_BYTES = 4096
+            try:
+                for extra in ('', '--to h2 --nofastseek', '--nofastseek --noindex'):
+                    args = connspy.parse_argv(f'--to h1 {extra} --time_init 1565005000 '
+                                              f'--time_end 1565009000 {f.name}'.split())
+                    byte_range = connspy.find_range(args)
+
+                    serial = []
+                    with open(f.name, 'rb') as r:
+                        connspy.process_chunks(read_chunks(r), args,
+                                               lambda x, to: serial.append((x, to)))
+                    self.assertTrue(len(serial) > 100)
+
+                    args.workers = 3
+                    res = []
+                    scan_parallel(args, byte_range, lambda x, to: res.append((x, to)))
+                    self.assertListEqual(serial, res)
+
+                    args.unordered = True
+                    res = []
+                    scan_parallel(args, byte_range, lambda x, to: res.append((x, to)))
+                    self.assertListEqual(sorted(serial), sorted(res))
+            finally:
+                parallel.MIN_RANGE_BYTES = min_range_bytes
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
+import io
 import unittest
-from connspy.parser import Parser
+from connspy.parser import Parser, BatchParser, read_chunks
 
 class ParserTest(unittest.TestCase):
     def testLines(self):
@@ -25,3 +26,33 @@ class ParserTest(unittest.TestCase):
         self.assertIsNone(p.parse("1565293593 b  c  d")[0])
 
 
+    def testBatchMatchesParse(self):
+        lines = ["1565293595 a b",
+                 "1565293593   A b  ",
+                 "  1565293593.123 1 b  ",
+                 "  1565293593123 1 b  ",
+                 "",
+                 "a  b  c",
+                 "1b  c",
+                 "1565293593 b  c  d",
+                 "1565293593 _b c",
+                 "0 a b"]
+        p = Parser()
+        bp = BatchParser()
+        cols = bp.parse("\n".join(lines).encode())
+
+        self.assertEqual(len(lines), len(cols.ts))
+        for i, line in enumerate(lines):
+            ts, frm, to = p.parse(line)
+            self.assertEqual(ts is not None, cols.valid[i])
+            if ts is not None:
+                self.assertEqual(ts, cols.ts[i])
+                self.assertEqual(frm, bp.hosts[cols.frm[i]])
+                self.assertEqual(to, bp.hosts[cols.to[i]])
+
+    def testReadChunks(self):
+        f = io.BytesIO(b"1 a b\n2 c d\n3 e f")
+        chunks = list(read_chunks(f, chunk_size=8))
+        self.assertEqual(b"1 a b\n2 c d\n3 e f", b"".join(chunks))
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b"\n"))
@@ -0,0 +1,99 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from connspy.parser import Parser, BatchParser
+from connspy.rejects import Rejects
+from connspy.stream import Processor, parse_argv
+
+LINES = [b"1565293595 a b\n",
+         b"1565293595 a b c\n",
+         b"\n",
+         b"notatime a b\n",
+         b"1565293596 a _b\n",
+         b"inf a b\n",
+         b"1565293597 c d\n",
+         b"1565293597 c"]
+
+
+class RejectsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.quarantine = os.path.join(self.dir.name, 'rejected.txt')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testParseTs(self):
+        for ts in ("x", "nan", "inf", "-inf", "1e300", ""):
+            self.assertIsNone(Parser.parse_ts(ts))
+        self.assertEqual(1565293595.0, Parser.parse_ts("1565293595"))
+
+    def testReasons(self):
+        rejects = Rejects()
+        p = Parser(rejects)
+        for line in LINES:
+            p.parse(line.decode())
+        expected = {'fields': 3, 'timestamp': 2, 'host': 1}
+        self.assertDictEqual(expected, rejects.counts)
+
+        bp = BatchParser(rejects=Rejects())
+        cols = bp.parse(b"".join(LINES))
+        self.assertEqual(2, cols.valid.sum())
+        self.assertDictEqual(expected, bp.rejects.counts)
+
+    def testQuarantine(self):
+        rejects = Rejects(self.quarantine)
+        rejects.start('log.txt', 1000)
+        bp = BatchParser(rejects=rejects)
+        data = b"".join(LINES)
+        bp.parse(data[:32])             # the first two lines
+        bp.parse(data[32:])
+        rejects.close()
+
+        with open(self.quarantine, 'rb') as f:
+            rows = [line.rstrip(b"\n").split(b"\t") for line in f]
+        self.assertEqual(6, len(rows))
+        offsets = [int(offset) - 1000 for _, offset, _, _ in rows]
+        # sorted by reason within a chunk, so compare as sets
+        self.assertListEqual([15], offsets[:1])
+        self.assertSetEqual({32, 33, 46, 62, 85}, set(offsets[1:]))
+        for source, offset, reason, line in rows:
+            self.assertEqual(b'log.txt', source)
+            start = int(offset) - 1000
+            self.assertEqual(data[start:start + len(line)], line)
+        self.assertIn([b'log.txt', b'1085', b'fields', b'1565293597 c'], rows)
+
+    def testRateLimited(self):
+        rejects = Rejects(every_seconds=3600)
+        p = Parser(rejects)
+        with self.assertLogs('rejects', 'WARNING') as logs:
+            for _ in range(1000):
+                p.parse("garbage")
+            rejects.close()
+        # the first one straight away, the rest once done
+        self.assertEqual(2, len(logs.output))
+        self.assertIn("999 lines rejected", logs.output[1])
+        self.assertIn("1000 in all", logs.output[1])
+
+    def testStream(self):
+        log = os.path.join(self.dir.name, 'log.txt')
+        with open(log, 'wb') as f:
+            f.writelines(LINES)
+        args = parse_argv(f'--quarantine {self.quarantine} --to b {log}'.split())
+        pr = Processor(args, lambda *summary: None)
+        with open(log, 'rb') as f:
+            f.seek(15)
+            pr.process(f, path=log)
+        pr.rejects.close()
+        with open(self.quarantine, 'rb') as f:
+            rows = [line.split(b"\t") for line in f]
+        self.assertEqual(6, len(rows))
+        self.assertSetEqual({15, 32, 33, 46, 62, 85}, set(int(row[1]) for row in rows))
+
+        with self.assertRaises(Exception):
+            parse_argv(f'--quarantine {self.quarantine} --engine line --to b {log}'.split())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import random
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+from connspy import connspy
+from connspy.rollup import build_rollup, load_rollups, HOUR
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'log.txt')
+        shutil.copy(SAMPLE, self.path)
+        with open(SAMPLE) as f:
+            self.lines = [line.lower().split() for line in f]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testNeighbors(self):
+        hours = build_rollup(self.path)
+        rollups = load_rollups(self.path)
+        self.assertListEqual(hours, sorted(rollups.hours))
+        # nothing is mapped until it's looked up
+        self.assertDictEqual({}, rollups.mapped)
+        # the last hour is still open as far as the log goes
+        last = max(int(ts) / 1000 for ts, _, _ in self.lines)
+        self.assertTrue(hours[-1] + HOUR <= last < hours[-1] + 2 * HOUR)
+
+        hour = rollups.get(hours[3])
+        self.assertListEqual([hours[3]], list(rollups.mapped))
+        lines = [(frm, to) for ts, frm, to in self.lines
+                 if hours[3] <= int(ts) / 1000 < hours[3] + HOUR]
+        frm, to = lines[0]
+        expected = list(dict.fromkeys(f for f, t in lines if t == to))
+        self.assertListEqual(expected, hour.neighbors(to))
+        expected = list(dict.fromkeys(t for f, t in lines if f == frm))
+        self.assertListEqual(expected, hour.neighbors(frm, 'out'))
+        self.assertListEqual([], hour.neighbors('nosuchhost'))
+        rollups.close()
+
+    def testConnspy(self):
+        build_rollup(self.path)
+        found = 0
+        for time_range in (['1565650000', '1565700000'], ['1565650000', '1565652000'],
+                           ['1565647264445', '1565733587895']):
+            results = []
+            for rollup in ([], ['--norollup']):
+                args = connspy.parse_argv(rollup + ['--to', 'zyla', '--time_init', time_range[0],
+                                          '--time_end', time_range[1], self.path])
+                res = []
+                results.append(res)
+                rollups = None if args.norollup else load_rollups(self.path, args.max_log_late_seconds)
+                if rollups is not None and rollups.within(args.time_init, args.time_end):
+                    connspy.process_rollups(rollups, args, lambda frm, to: res.append(frm))
+                else:
+                    connspy.scan(args, lambda frm, to: res.append(frm))
+            found += len(results[1])
+            self.assertListEqual(results[1], results[0])
+        self.assertTrue(found > 10)
+
+    def testReplacedLog(self):
+        build_rollup(self.path)
+        shutil.copy(SAMPLE, self.path + ".new")
+        os.rename(self.path + ".new", self.path)
+        self.assertIsNone(load_rollups(self.path))
+
+    def testRewrittenLog(self):
+        build_rollup(self.path)
+        rollups = load_rollups(self.path)
+        rollups.get(min(rollups.hours))
+        # the same inode and size, the first host renamed
+        with open(SAMPLE) as f:
+            data = f.read()
+        with open(self.path, 'r+') as f:
+            f.write(data.replace('Aadvik', 'Badvik', 1))
+        self.assertIsNone(load_rollups(self.path))
+        rollups.refresh()
+        self.assertDictEqual({}, rollups.hours)
+        self.assertDictEqual({}, rollups.mapped)
+
+    def testLateLines(self):
+        # some lines hours later than max_log_late_seconds: connspy's scan
+        # of a long range still reads them, and so do the rollups
+        rnd = random.Random(5)
+        t0 = 1565647200
+        lines = []
+        for i in range(20000):
+            ts = t0 + i * 6 + rnd.randint(0, 100)
+            if rnd.random() < 0.01:
+                ts -= rnd.randint(400, 4 * HOUR)
+            lines.append(f"{ts * 1000} h{rnd.randint(0, 60)} h{rnd.randint(0, 8)}\n")
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+        build_rollup(self.path)
+        rollups = load_rollups(self.path)
+        self.assertIsNotNone(rollups.late)
+        for _ in range(30):
+            time_init = t0 + rnd.randint(0, 100000)
+            time_end = time_init + rnd.randint(HOUR, 60000)
+            args = connspy.parse_argv(['--to', f"h{rnd.randint(0, 8)}", '--time_init', str(time_init),
+                                       '--time_end', str(time_end), self.path])
+            rolled, scanned = [], []
+            connspy.process_rollups(rollups, args, lambda frm, to: rolled.append(frm))
+            connspy.scan(args, lambda frm, to: scanned.append(frm))
+            self.assertListEqual(sorted(scanned), sorted(rolled))
+        rollups.close()
+
+    def testOtherLateSeconds(self):
+        hours = build_rollup(self.path, 60)
+        # hours closed with another max_log_late_seconds don't count
+        self.assertIsNone(load_rollups(self.path))
+        self.assertListEqual(hours, sorted(load_rollups(self.path, 60).hours))
+
+    def testRefresh(self):
+        with open(SAMPLE) as f:
+            lines = f.readlines()
+        with open(self.path, 'w') as f:
+            f.writelines(lines[:5000])
+        rollups = load_rollups(self.path) if build_rollup(self.path) else None
+        self.assertIsNotNone(rollups)
+        before = sorted(rollups.hours)
+        rollups.get(before[0])
+        with open(self.path, 'a') as f:
+            f.writelines(lines[5000:])
+        build_rollup(self.path)
+        rollups.refresh()
+        self.assertTrue(set(before) < set(rollups.hours))
+        self.assertListEqual([before[0]], list(rollups.mapped))
+        rollups.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import os
+import gzip
+import json
+import math
+import socket
+import shutil
+import threading
+import unittest
+import urllib.request
+from tempfile import TemporaryDirectory
+from connspy import connspy
+from connspy.pack import write_pack
+from connspy.rollup import build_rollup
+from connspy.serve import Server, parse_argv, parse_listen, http_server, unix_server
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+class ServeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'log.txt')
+        shutil.copy(SAMPLE, self.path)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.close()
+        self.dir.cleanup()
+
+    def serve(self, *options):
+        self.server = Server([self.path], parse_argv(list(options) +
+                                                     ['--listen', 'http:0', self.path]))
+        return self.server
+
+    def connspy(self, to, time_init, time_end):
+        args = connspy.parse_argv([opt for host in to for opt in ('--to', host)] +
+                                  ['--time_init', str(time_init), '--time_end', str(time_end),
+                                   self.path])
+        hits = []
+        connspy.scan(args, lambda frm, to: hits.append((frm, to)))
+        return hits
+
+    def testSameAsConnspy(self):
+        server = self.serve()
+        for to, time_init, time_end in ((['zyla'], 1565650000, 1565700000),
+                                        (['zyla', 'aselin'], 1565660000, 1565720000),
+                                        (['zyla'], 1565652000, 1565670000),
+                                        (['aselin'], 1565647264445, 1565733587895)):
+            hits, _ = server.query(to, time_init / (1000 if time_init > 1e12 else 1),
+                                   time_end / (1000 if time_end > 1e12 else 1))
+            expected = self.connspy(to, time_init, time_end)
+            self.assertTrue(expected)
+            self.assertCountEqual(expected, hits)
+
+    def testCache(self):
+        server = self.serve()
+        first, stats = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertDictEqual({'cached_hours': 0, 'scanned_hours': 13}, stats)
+        again, stats = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertListEqual(first, again)
+        self.assertDictEqual({'cached_hours': 13, 'scanned_hours': 0}, stats)
+        # overlapping, only the new hours are scanned
+        _, stats = server.query(['zyla'], 1565660000, 1565710000)
+        self.assertDictEqual({'cached_hours': 10, 'scanned_hours': 3}, stats)
+        # another target is a miss for the same hours
+        _, stats = server.query(['zyla', 'aselin'], 1565650000, 1565660000)
+        self.assertEqual(2, stats['scanned_hours'])
+
+        # the last hours aren't over as far as the log goes
+        _, stats = server.query(['zyla'], 1565720000, 1565740000)
+        _, stats = server.query(['zyla'], 1565720000, 1565740000)
+        self.assertDictEqual({'cached_hours': 2, 'scanned_hours': 2}, stats)
+
+    def testUnseekable(self):
+        expected, _ = self.serve().query(['zyla', 'aselin'], 1565650000, 1565700000)
+        self.server.close()
+        server = self.serve('--nofastseek')
+        log = server.logs[self.path]
+        scans = []
+        scan = log.scan
+        log.scan = lambda args, *rest: scans.append(args.time_init) or scan(args, *rest)
+        hits, stats = server.query(['zyla', 'aselin'], 1565650000, 1565700000)
+        self.assertListEqual(expected, hits)
+        self.assertEqual(13, stats['scanned_hours'])
+        # the whole hours in one go, then the partial hours at either end
+        self.assertEqual(3, len(scans))
+
+        scans.clear()
+        again, stats = server.query(['zyla', 'aselin'], 1565650000, 1565700000)
+        self.assertListEqual(expected, again)
+        self.assertEqual(13, stats['cached_hours'])
+        self.assertEqual(2, len(scans))
+
+    def testEvicted(self):
+        server = self.serve('--cache_hosts', '2')
+        hits, _ = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertTrue(0 < server.cached_hosts <= 2)
+        again, stats = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertListEqual(hits, again)
+        # what's left of the cache are the latest hours, the rest is scanned again
+        self.assertTrue(stats['scanned_hours'] > 0)
+        self.assertEqual(13, stats['scanned_hours'] + stats['cached_hours'])
+
+    def testRollups(self):
+        build_rollup(self.path)
+        server = self.serve()
+        hits, stats = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertCountEqual(self.connspy(['zyla'], 1565650000, 1565700000), hits)
+        # rolled up hours go straight into the cache
+        _, stats = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertEqual(13, stats['cached_hours'])
+
+    def testReplaced(self):
+        server = self.serve()
+        server.query(['zyla'], 1565650000, 1565700000)
+        with open(self.path) as f:
+            lines = f.readlines()
+        os.unlink(self.path)
+        with open(self.path, 'w') as f:
+            f.writelines(line for line in lines if not line.rstrip().endswith(' Zyla'))
+        hits, stats = server.query(['zyla'], 1565650000, 1565700000)
+        self.assertListEqual([], hits)
+        self.assertEqual(0, stats['cached_hours'])
+
+    def testAppendedCompressed(self):
+        with open(SAMPLE, 'rb') as f:
+            lines = f.readlines()
+        # the log so far ends at 1565730000, what's after gets appended
+        cut = next(i for i, line in enumerate(lines) if int(line.split()[0]) >= 1565730000000)
+        path = self.path + '.gz'
+        with gzip.open(path, 'wb') as f:
+            f.writelines(lines[:cut])
+        self.path = path
+        server = self.serve()
+        self.assertEqual(math.inf, server.logs[path].latest_ts)
+        before, _ = server.query(['aselin'], 1565730000, 1565740000)
+        with gzip.open(path, 'ab') as f:
+            f.writelines(lines[cut:])
+        # the hours cached past the end of the log are forgotten
+        hits, stats = server.query(['aselin'], 1565730000, 1565740000)
+        self.assertEqual(0, stats['cached_hours'])
+        self.assertCountEqual(self.connspy(['aselin'], 1565730000, 1565740000), hits)
+        self.assertNotEqual(before, hits)
+
+    def testPacked(self):
+        write_pack(self.path)
+        self.path += '.pack'
+        server = self.serve()
+        self.assertEqual(1565733598.341, server.logs[self.path].latest_ts)
+        # the last hours aren't over as far as the pack goes
+        _, stats = server.query(['zyla'], 1565720000, 1565740000)
+        _, stats = server.query(['zyla'], 1565720000, 1565740000)
+        self.assertDictEqual({'cached_hours': 2, 'scanned_hours': 2}, stats)
+
+    def testAnswer(self):
+        server = self.serve()
+        reply = server.answer({'to': 'Zyla', 'time_init': '1565650000', 'time_end': 1565660000})
+        self.assertNotIn('error', reply)
+        self.assertDictEqual({'to': 'zyla', 'from': reply['hits'][0]['from']}, reply['hits'][0])
+        for request in ({'time_init': 1, 'time_end': 2}, {'to': 'a', 'time_init': 2, 'time_end': 1},
+                        {'to': '_b', 'time_init': 1, 'time_end': 2},
+                        {'to': 'a', 'time_init': 1, 'time_end': 2, 'file': '/etc/passwd'}):
+            self.assertIn('error', server.answer(request))
+
+    def testHttp(self):
+        server = self.serve()
+        listener = http_server(server, '127.0.0.1', 0)
+        threading.Thread(target=listener.serve_forever, daemon=True).start()
+        try:
+            port = listener.server_address[1]
+            url = (f"http://127.0.0.1:{port}/query?to=zyla&to=aselin"
+                   "&time_init=1565650000&time_end=1565660000")
+            with urllib.request.urlopen(url) as response:
+                reply = json.load(response)
+            expected = self.connspy(['zyla', 'aselin'], 1565650000, 1565660000)
+            self.assertCountEqual(expected, [(hit['from'], hit['to']) for hit in reply['hits']])
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/query?to=zyla")
+        finally:
+            listener.shutdown()
+            listener.server_close()
+
+    def testUnix(self):
+        server = self.serve()
+        path = os.path.join(self.dir.name, 'connspy.sock')
+        listener = unix_server(server, path)
+        threading.Thread(target=listener.serve_forever, daemon=True).start()
+        try:
+            with socket.socket(socket.AF_UNIX) as s:
+                s.connect(path)
+                with s.makefile('rwb') as f:
+                    for request in (b'{"to": "zyla", "time_init": 1565650000, "time_end": 1565660000}\n',
+                                    b'not json\n'):
+                        f.write(request)
+                        f.flush()
+                    replies = [json.loads(f.readline()), json.loads(f.readline())]
+            self.assertEqual(len(self.connspy(['zyla'], 1565650000, 1565660000)),
+                             len(replies[0]['hits']))
+            self.assertIn('error', replies[1])
+        finally:
+            listener.shutdown()
+            listener.server_close()
+
+    def testParse(self):
+        self.assertEqual(('unix', '/tmp/s'), parse_listen('unix:/tmp/s'))
+        self.assertEqual(('http', '127.0.0.1', 80), parse_listen('http:80'))
+        for addr in ('80', 'tcp:a:80', 'unix:'):
+            with self.assertRaises(Exception):
+                parse_listen(addr)
+
+
+if __name__ == '__main__':
+    unittest.main()
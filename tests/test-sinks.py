@@ -0,0 +1,103 @@
+import os
+import json
+import sqlite3
+import unittest
+from tempfile import TemporaryDirectory
+from connspy.hosts import HostTable
+from connspy.sinks import make_sink, parse_output, Sink, TextSink
+from connspy.stream import Processor, parse_argv
+from tests import TESTS_DIR
+
+SAMPLE = os.path.join(TESTS_DIR, '..', 'sample_data', 'input-file-10000.txt')
+
+
+class SinksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        hosts = HostTable()
+        a, b, c, d = (hosts.intern(name) for name in "abcd")
+        self.window = (1565647200.0, hosts.targets_view({a: [b, c], d: [a]}),
+                       hosts.targets_view({b: [d]}), ['a', 'b'])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def testTsv(self):
+        sink = make_sink('tsv:' + self.path('out.tsv'))
+        sink(*self.window)
+        sink.hit('x', 'y')
+        sink.close()
+        tagged = make_sink('tsv:' + self.path('tagged.tsv'), tagged=True)
+        tagged(*self.window)
+        tagged.hit('x', 'y')
+        tagged.close()
+
+        with open(self.path('out.tsv')) as f:
+            self.assertEqual("1565647200.0\tTO\tb\n1565647200.0\tTO\tc\n1565647200.0\tTO\ta\n"
+                             "1565647200.0\tFROM\td\n"
+                             "1565647200.0\tMOST\ta\n1565647200.0\tMOST\tb\nx\n", f.read())
+        with open(self.path('tagged.tsv')) as f:
+            self.assertEqual("1565647200.0\tTO\ta\tb\n1565647200.0\tTO\ta\tc\n"
+                             "1565647200.0\tTO\td\ta\n1565647200.0\tFROM\tb\td\n"
+                             "1565647200.0\tMOST\ta\n1565647200.0\tMOST\tb\ny\tx\n", f.read())
+
+    def testJsonl(self):
+        sink = make_sink('jsonl:' + self.path('out.jsonl'))
+        sink(*self.window)
+        sink.hit('x', 'y')
+        sink.close()
+        with open(self.path('out.jsonl')) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(7, len(rows))
+        self.assertDictEqual({'window': 1565647200.0, 'kind': 'TO', 'target': 'd', 'host': 'a'},
+                             rows[2])
+        self.assertDictEqual({'window': 1565647200.0, 'kind': 'MOST', 'target': None, 'host': 'b'},
+                             rows[5])
+        self.assertDictEqual({'to': 'y', 'from': 'x'}, rows[6])
+
+    def testSqlite(self):
+        tsv, db = self.path('out.tsv'), self.path('out.db')
+        for output in ('tsv:' + tsv, 'sqlite:' + db):
+            args = parse_argv(f'--window 5m --to aselin --to zyla --from tanya {SAMPLE}'.split())
+            sink = make_sink(output, tagged=True)
+            pr = Processor(args, sink)
+            with open(SAMPLE, 'rb') as f:
+                pr.process(f)
+            pr.dump_remaining()
+            sink.close()
+
+        with open(tsv) as f:
+            expected = [line.rstrip("\n").split("\t") for line in f]
+        con = sqlite3.connect(db)
+        rows = con.execute("SELECT window, kind, target, host FROM windows ORDER BY rowid").fetchall()
+        con.close()
+        self.assertTrue(len(expected) > 100)
+        self.assertListEqual(expected, [[str(window), kind] + ([target] if target else []) + [host]
+                                        for window, kind, target, host in rows])
+
+    def testParse(self):
+        self.assertEqual(('tsv', None), parse_output('tsv'))
+        self.assertEqual(('sqlite', 'a.db'), parse_output('sqlite:a.db'))
+        for spec in ('csv', 'sqlite', 'sqlite:'):
+            with self.assertRaises(Exception):
+                parse_output(spec)
+
+    def testIncompleteSink(self):
+        # a sink has to say how it writes windows and hits out
+        class WindowsOnly(Sink):
+            def __call__(self, window, to, frm, most, fans=None):
+                pass
+        class NoLines(TextSink):
+            def __call__(self, window, to, frm, most, fans=None):
+                pass
+        for sink in (Sink, WindowsOnly, NoLines):
+            with self.assertRaises(TypeError):
+                sink()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import time
+import threading
+import unittest
+from tempfile import TemporaryDirectory
+from connspy.tail import Tailer, Inotify, Poller
+
+
+class TailTest(unittest.TestCase):
+
+    def follow(self, poll):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log")
+            with open(path, 'w') as w:
+                w.write("1 a b\n2 a")
+                w.flush()
+
+                tailer = Tailer(open(path, 'rb'), path, poll=poll, wait_seconds=0.05)
+                self.assertIsInstance(tailer.watcher, Poller if poll else Inotify)
+                chunks = iter(tailer)
+                self.assertEqual(b"1 a b\n", next(chunks))
+                self.assertEqual(0, tailer.backlog())
+
+                # the partial line is held back until it's done
+                w.write(" c\n3 b c\n")
+                w.flush()
+                self.assertEqual(9, tailer.backlog())
+                self.assertEqual(b"2 a c\n3 b c\n", next(chunks))
+
+                # rotated away, but still written to for a bit
+                os.rename(path, path + ".1")
+                w.write("4 c d\n5 d")
+                w.flush()
+                with open(path, 'w') as w2:
+                    w2.write("6 e f\n")
+                self.assertEqual(b"4 c d\n", next(chunks))
+                self.assertEqual(b"5 d", next(chunks))
+                self.assertEqual(b"6 e f\n", next(chunks))
+
+            # truncated in place, then written again
+            with open(path, 'w') as w:
+                w.write("7 g\n")
+            self.assertEqual(b"7 g\n", next(chunks))
+
+            tailer.close()
+
+    def testInotify(self):
+        self.follow(poll=False)
+
+    def testPolling(self):
+        self.follow(poll=True)
+
+    def testWakesOnWrite(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log")
+            open(path, 'w').close()
+            tailer = Tailer(open(path, 'rb'), path, wait_seconds=10)
+
+            def append():
+                time.sleep(0.2)
+                with open(path, 'a') as w:
+                    w.write("1 a b\n")
+            threading.Thread(target=append).start()
+
+            start = time.monotonic()
+            self.assertEqual(b"1 a b\n", next(iter(tailer)))
+            # woken by inotify, not by the 10s timeout
+            self.assertLess(time.monotonic() - start, 5)
+            tailer.close()
+
+    def testNoPath(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log")
+            with open(path, 'w') as w:
+                w.write("1 a b\n")
+            with open(path, 'rb') as f:
+                tailer = Tailer(f)
+                self.assertIsInstance(tailer.watcher, Poller)
+                self.assertEqual(b"1 a b\n", next(iter(tailer)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import random
+import unittest
+from collections import Counter
+from connspy.topk import SpaceSaving
+
+
+def zipf_stream(n, hosts, seed):
+    rnd = random.Random(seed)
+    weights = [1.0 / (i + 1) for i in range(hosts)]
+    return rnd.choices(range(hosts), weights, k=n)
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def testExactUnderCapacity(self):
+        s = SpaceSaving(10)
+        for key in "abcabcaab":
+            s.add(key)
+        s.add_many(['d', 'a'], [2, 1])
+        self.assertListEqual([('a', 5), ('b', 3), ('c', 2), ('d', 2)], s.most_common())
+        # ties go to whoever came first, like Counter
+        self.assertListEqual([('a', 5), ('b', 3), ('c', 2)], s.most_common(3))
+        self.assertEqual(0, s.error('a'))
+        self.assertEqual(12, s.total)
+
+    def testErrorBound(self):
+        stream = zipf_stream(20000, 2000, 1)
+        exact = Counter(stream)
+        s = SpaceSaving(100)
+        for key in stream:
+            s.add(key)
+
+        self.assertEqual(100, len(s))
+        bound = len(stream) / 100
+        for key, count in s.most_common():
+            self.assertTrue(count - s.error(key) <= exact[key] <= count)
+            self.assertTrue(s.error(key) <= bound)
+        # everything more frequent than the bound is in there
+        for key, count in exact.items():
+            if count > bound:
+                self.assertIn(key, s.counts)
+        self.assertListEqual([k for k, _ in exact.most_common(3)],
+                             [k for k, _ in s.most_common(3)])
+
+    def testMerge(self):
+        a, b = zipf_stream(10000, 2000, 2), zipf_stream(10000, 2000, 3)
+        exact = Counter(a + b)
+        sa, sb = SpaceSaving(100), SpaceSaving(100)
+        sa.add_many(a, [1] * len(a))
+        sb.add_many(b, [1] * len(b))
+        sa.merge(sb)
+
+        self.assertEqual(100, len(sa))
+        self.assertEqual(20000, sa.total)
+        bound = 20000 / 100
+        for key, count in sa.most_common():
+            self.assertTrue(count - sa.error(key) <= exact[key] <= count)
+            self.assertTrue(sa.error(key) <= bound)
+        self.assertEqual(exact.most_common(1)[0][0], sa.most_common(1)[0][0])
+
+        # under capacity, merging is exact counting
+        sa, sb = SpaceSaving(10), SpaceSaving(10)
+        sa.add_many(['a', 'b'], [1, 2])
+        sb.add_many(['c', 'a'], [2, 3])
+        sa.merge(sb)
+        self.assertListEqual([('a', 4), ('b', 2), ('c', 2)], sa.most_common())
+
+    def testRelabel(self):
+        s = SpaceSaving(2)
+        s.add_many([0, 1, 2], [5, 1, 3])
+        r = s.relabel([10, 11, 12])
+        self.assertDictEqual({10: 5, 12: 4}, r.counts)
+        self.assertEqual(1, r.error(12))
+
+
+if __name__ == '__main__':
+    unittest.main()
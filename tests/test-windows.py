@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from connspy.windows import Windows, parse_duration
+
+
+class WindowsTest(unittest.TestCase):
+
+    def testParseDuration(self):
+        self.assertEqual(90, parse_duration('90'))
+        self.assertEqual(30, parse_duration('30s'))
+        self.assertEqual(300, parse_duration('5m'))
+        self.assertEqual(3600, parse_duration('1H'))
+        self.assertEqual(86400, parse_duration('1d'))
+        for bad in ('', 'm', '0m', '-5m', '1.5h', '1w'):
+            self.assertRaises(Exception, parse_duration, bad)
+
+    def testStarts(self):
+        w = Windows(300)
+        self.assertListEqual([1551466800.0], w.starts_of(1551466810.5))
+        self.assertListEqual([1551466800.0], w.starts_of(1551466800.0))
+
+        w = Windows(3600, 1200)
+        self.assertListEqual([1551469200.0, 1551468000.0, 1551466800.0],
+                             w.starts_of(1551469210.0))
+        ts = np.array([1551469210.0, 1551466799.9])
+        for scalar, array in zip(zip(*(w.starts_of(t) for t in ts)), w.starts_array(ts)):
+            self.assertListEqual(list(scalar), array.tolist())
+        self.assertListEqual([1551466800.0, 1551463200.0], w.earliest_start(ts).tolist())
+
+        self.assertRaises(Exception, Windows, 3600, 700)
+
+    def testOldest(self):
+        w = Windows(60, factory=list)
+        self.assertIsNone(w.oldest())
+        for start in (120, 60, 180, 0):
+            w[start].append(start)
+        self.assertEqual(4, len(w))
+        self.assertEqual(0, w.oldest())
+        self.assertListEqual([0], w.pop(0))
+
+        # out of order pops and reopened windows
+        w.pop(120)
+        self.assertEqual(60, w.oldest())
+        w[120]
+        w.pop(60)
+        self.assertEqual(120, w.oldest())
+        w.pop(120)
+        self.assertEqual(180, w.oldest())
+        self.assertNotIn(120, w)
+
+
+if __name__ == '__main__':
+    unittest.main()